@@ -4,7 +4,7 @@ version='1.0',
 description='A package to control the tandberg camera',
 url='#',
 author='Aashvij Shenai',
-install_requires=['opencv-python', 'pyserial'],
+install_requires=['numpy', 'opencv-python', 'pyserial'],
 author_email='',
 packages=setuptools.find_packages(),
 zip_safe=False)
\ No newline at end of file
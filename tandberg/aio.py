@@ -0,0 +1,215 @@
+import asyncio
+
+from . import visca
+from .tandberg import Controller, bufferFull, replyStatus, reportBufferFull, stat_OK, stat_FAIL, _speed_changes
+from .pipeline import SocketTracker, _Request
+from .state import SEED_INQUIRIES
+
+# asyncio flavour of Controller. Every camera method (steer, pt_direct, ptzf,
+# zoomFocus, qCmd, the toggles, ...) is inherited unchanged and returns a
+# coroutine instead of a status, because the frames they build are handed
+# to the async _execute below:
+#
+#   cam = AsyncController()
+#   await cam.connect("/dev/ttyUSB0")
+#   await cam.ptzf([408, 135, 0, 0])
+#
+# The port is read from the event loop (loop.add_reader), so no call ever
+# blocks the loop and one process can drive many cameras. Replies are
+# matched the same way as in PipelinedController.
+
+class AsyncController(Controller):
+    def __init__(self, max_inflight=2, timeout=20):
+        super().__init__()
+        #Commands allowed in the camera at once (VISCA gives two buffers)
+        self.max_inflight   = max_inflight
+        #How long send() waits for a completion
+        self.timeout        = timeout
+
+        self.tracker        = SocketTracker()
+        self._slots         = None
+        self._loop          = None
+
+    async def connect(self, inp):
+        status = self._openPort(inp)
+        if(status == stat_OK):
+            #Never block in read(), the loop tells us when data is there
+            self.ser.timeout = 0
+            self._loop = asyncio.get_running_loop()
+            self._slots = asyncio.Semaphore(self.max_inflight)
+            self._loop.add_reader(self.ser.fileno(), self._onReadable)
+            #Speed detection runs on the loop too, with the reader in place
+            status = await self._negotiate()
+            if(status != stat_OK):
+                self._loop.remove_reader(self.ser.fileno())
+                self.tracker.failAll()
+                self._closePort()
+                return status
+            await self.sync()
+        return status
+
+    async def _negotiate(self):
+        """Finds the speed the camera is at and, with upgradeBaud, moves it to 115200"""
+        self.baudrate = await self.detectBaud()
+        if(self.baudrate is None):
+            print("Baud detection : FAILED")
+            return stat_FAIL
+        if(self.upgradeBaud and self.baudrate != 115200):
+            status, reply = await self.transact(visca.fixed["speed_115200"])
+            if(status != stat_OK):
+                print("Update serial speed status : FAILED")
+                return stat_FAIL
+            return await self._followBaud(115200, True)
+        return stat_OK
+
+    async def detectBaud(self):
+        """Tries every speed in self.baudrates, leaves the port at the one the
+        camera answers at and returns it. None (port at the first) if none"""
+        for baudrate in self.baudrates:
+            self.ser.baudrate = baudrate
+            #Drop anything received at the old speed
+            self.ser.reset_input_buffer()
+            self._rxbuf.clear()
+            if(await self.probe()):
+                return baudrate
+        self.ser.baudrate = self.baudrates[0]
+        return None
+
+    async def disconnect(self):
+        if(self._loop is not None and self.ser is not None):
+            self._loop.remove_reader(self.ser.fileno())
+        self.tracker.failAll()
+        return Controller.disconnect(self)
+
+    async def send(self, cmd):
+        """Sends a command and waits for its completion, returns the success code"""
+        status, reply = await self.transact(cmd)
+        return status
+
+    async def submit(self, cmd):
+        """Sends cmd once a command buffer is free, returns a Future for its status"""
+        future = asyncio.get_running_loop().create_future()
+        future.reply = None
+        if(self.ser is None):
+            future.set_result(stat_FAIL)
+            return future
+
+        request = _Request(cmd, future)
+        if(not request.inquiry):
+            await self._slots.acquire()
+            future.add_done_callback(lambda f : self._slots.release())
+
+        self.tracker.add(request)
+        self.ser.write(self.address + cmd + b'\xff')
+        return future
+
+    async def transact(self, cmd):
+        """Sends a command, returns its status and reply (address and terminator stripped)"""
+        future = await self.submit(cmd)
+        try:
+            status = await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError:
+            print("Receive timeout")
+            self.tracker.discard(future)
+            return stat_FAIL, None
+        return status, future.reply
+
+    async def inquire(self, name):
+        """Sends inquiry name and returns the decoded reply, None on failure"""
+        status, reply = await self.transact(visca.inquiries[name][0])
+        reportBufferFull(reply)
+        value = visca.parse(name, reply) if status == stat_OK else None
+
+        if(value is None):
+            print("Query status : FAILED")
+            return None
+        self.state.seed(name, value)
+        return value
+
+    async def probe(self, timeout=0.25):
+        """True if the camera answers a power inquiry within timeout seconds"""
+        future = await self.submit(visca.fixed["q_pwr"])
+        try:
+            status = await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            self.tracker.discard(future)
+            return False
+        reply = future.reply
+        return status == stat_OK and reply is not None and len(reply) == 2
+
+    async def _followBaud(self, baudrate, wait):
+        """Moves the port to the camera's new speed, polls until it answers"""
+        self.ser.baudrate = baudrate
+        self.baudrate = baudrate
+        self.state.set("baud", baudrate)
+        if(not wait):
+            return stat_OK
+        deadline = self._loop.time() + self.baudTimeout
+        while self._loop.time() < deadline:
+            if(await self.probe()):
+                return stat_OK
+        print("Camera not answering at %d baud" % baudrate)
+        return stat_FAIL
+
+    async def sync(self):
+        """Seeds the shadow state with a bulk inquiry, returns the success code"""
+        self.state.clear()
+        if(self.baudrate is None):
+            return stat_FAIL
+        self.state.set("baud", self.baudrate)
+        if(not self.shadow):
+            return stat_OK
+        #Inquiries are answered in order, so they can all be in flight at once
+        values = await asyncio.gather(*[self.inquire(name) for name in SEED_INQUIRIES])
+        return stat_FAIL if None in values else stat_OK
+
+    async def _execute(self, steps, delay=0):
+        """Sends (message, name) steps in order and returns the status of the last one"""
+        status = stat_OK
+        sent = False
+        for msg, name in steps:
+            if(self.shadow and self.state.current(msg)):
+                #Camera is already there
+                status = stat_OK
+                continue
+            status, reply = await self.transact(msg)
+            sent = True
+            for attempt in range(self.retries):
+                if(status == stat_OK or not bufferFull(reply)):
+                    break
+                await asyncio.sleep(self.backoff * 2**attempt)
+                status, reply = await self.transact(msg)
+
+            if(status != stat_OK):
+                reportBufferFull(reply)
+                self.state.forget(msg)
+                print(name + " : FAILED")
+            else:
+                self.state.update(msg)
+                if(msg in _speed_changes):
+                    baudrate, wait = _speed_changes[msg]
+                    status = await self._followBaud(baudrate, wait)
+
+        if(status == stat_OK and delay and sent):
+            await asyncio.sleep(delay)
+        return status
+
+    def _onReadable(self):
+        while True:
+            try:
+                frame = self.readFrame()
+            except Exception:
+                return
+            if(frame is None):
+                return
+            if(len(frame) < 3):
+                continue
+
+            resp = frame[1:-1]
+            request = self.tracker.dispatch(resp)
+            if(request is None or request.future.done()):
+                continue
+            if(request.inquiry and self.debug):
+                print([frame[i:i + 1].hex() for i in range(len(frame))])
+            request.future.reply = resp
+            request.future.set_result(replyStatus(resp))
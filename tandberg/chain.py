@@ -0,0 +1,153 @@
+import threading
+
+import serial
+
+from .tandberg import Controller, stat_OK, stat_FAIL
+from .pipeline import PipelinedController
+
+# Several cameras daisy-chained on one RS-232 line. Address_Set numbers the
+# cameras 1..n, every camera gets its own ChainCamera handle and a single
+# reader thread routes replies by their source address byte ((n + 8) << 4,
+# i.e. 0x90 for camera 1, 0xa0 for camera 2), so commands for different
+# cameras are interleaved on the wire:
+#
+#   chain = Chain()
+#   chain.connect("/dev/ttyUSB0")
+#   front, back = chain.address_set()
+#   front.ptzf([300, 100, 0, 0])     # from one thread
+#   back.qCmd(["q_pt"])              # from another, no waiting on front
+
+class ChainCamera(PipelinedController):
+    """One camera on a shared daisy-chain link"""
+    def __init__(self, link, address, max_inflight=2, timeout=20):
+        super().__init__(max_inflight, timeout)
+        self.link       = link
+        self.address    = bytes((0x80 | address,))
+        self.interface  = link.interface
+        self.ser        = link.ser
+        #Writes and reply matching are serialised across the whole chain
+        self._lock      = link.lock
+
+    def connect(self, inp=None):
+        """The port belongs to the Chain, handles only check it is open"""
+        return stat_OK if self.link.ser is not None else stat_FAIL
+
+    def disconnect(self):
+        with self._lock:
+            self.tracker.failAll()
+        return stat_OK
+
+class Chain(object):
+    #Same framing as a single camera connection
+    readFrame = Controller.readFrame
+
+    def __init__(self, max_inflight=2, timeout=20):
+        self.max_inflight   = max_inflight
+        self.timeout        = timeout
+
+        self.interface      = None
+        self.ser            = None
+        self.lock           = threading.Lock()
+        #address -> ChainCamera
+        self.cameras        = {}
+        #Set when a camera reports that the chain was changed
+        self.networkChanged = False
+
+        self._rxbuf         = bytearray()
+        #Bytes readFrame dropped while resynchronising
+        self.garbage        = 0
+        #Optional metrics.Metrics / wire.Recorder, as on Controller
+        self.metrics        = None
+        self.recorder       = None
+        self._reader        = None
+        self._running       = False
+        self._addrReply     = None
+        self._addrEvent     = threading.Event()
+
+    def connect(self, inp):
+        #9600 baud, 8N1, no flow control.
+        try:
+            self.ser = serial.Serial(inp, timeout=0.1)
+            if(self.recorder is not None):
+                self.ser = self.recorder.wrap(self.ser)
+            self.interface = inp
+        except Exception as error:
+            print("Exception when connecting to device.")
+            self.interface = None
+            return stat_FAIL
+
+        self._rxbuf.clear()
+        self._running = True
+        self._reader = threading.Thread(target=self._readLoop, daemon=True)
+        self._reader.start()
+        return stat_OK
+
+    def disconnect(self):
+        self._running = False
+        if(self._reader is not None):
+            self._reader.join()
+            self._reader = None
+        for camera in self.cameras.values():
+            camera.disconnect()
+        status = stat_OK
+        try:
+            if(self.ser != None):
+                self.ser.close()
+                self.interface = None
+        except Exception as error:
+            print("Exception when disconnecting to device.")
+            status = stat_FAIL
+        return status
+
+    def address_set(self):
+        """Numbers the cameras on the chain, returns a handle per camera"""
+        if(self.ser is None):
+            return []
+        self._addrEvent.clear()
+        with self.lock:
+            self.ser.write(b'\x88\x30\x01\xff')
+        if(not self._addrEvent.wait(self.timeout)):
+            print("SetAddress : FAILED")
+            return []
+
+        #The reply carries the next free address
+        count = self._addrReply - 1
+        for camera in self.cameras.values():
+            camera.disconnect()
+        self.cameras = {}
+        for address in range(1, count + 1):
+            self.cameras[address] = ChainCamera(self, address, self.max_inflight, self.timeout)
+        self.networkChanged = False
+        return [self.cameras[a] for a in sorted(self.cameras)]
+
+    def __getitem__(self, address):
+        return self.cameras[address]
+
+    def __len__(self):
+        return len(self.cameras)
+
+    def _readLoop(self):
+        while self._running:
+            try:
+                frame = self.readFrame()
+            except Exception as error:
+                if(self._running):
+                    #Nothing would answer the cameras any more, say so and fail their requests
+                    print("Chain reader stopped: %r" % error)
+                    for camera in self.cameras.values():
+                        with self.lock:
+                            camera.tracker.failAll()
+                break
+            if(frame is None or len(frame) < 3):
+                continue
+
+            source = (frame[0] >> 4) - 8
+            if(frame[1] == 0x30):
+                self._addrReply = frame[2]
+                self._addrEvent.set()
+            elif(frame[1] == 0x38):
+                #Network_Change push, cameras were added or removed
+                print("Camera chain changed, run address_set again")
+                self.networkChanged = True
+            elif(source in self.cameras):
+                self.cameras[source]._dispatch(frame)
@@ -0,0 +1,241 @@
+import threading
+import time
+from collections import deque
+
+from .tandberg import Controller, bufferFull, reportBufferFull, stat_OK, stat_FAIL
+
+# Latest-wins queue in front of Controller.send. Motion commands return as
+# soon as they are queued; while one is waiting for the link, a newer
+# command for the same axis group replaces it in place, so the camera never
+# works through a backlog of stale targets. Everything else (flip, call_led,
+# inquiries, ...) keeps its place in the queue and send() waits for it.
+#
+# stat_OK from a motion command means accepted, not completed. The shadow
+# state follows it once the worker has its real status, and the recovery
+# policy is fed those statuses on the next command.
+
+#Message prefix -> axis group
+motion_groups = {
+    b'\x01\x06\x01' : "pantilt",    #steer, including stop
+    b'\x01\x06\x02' : "pantilt",    #pt_direct
+    b'\x01\x06\x20' : "ptzf",
+    b'\x01\x04\x07' : "zoom",       #zoom tele/wide/stop
+    b'\x01\x04\x47' : "zoom",       #zoom (and focus) direct
+    b'\x01\x04\x08' : "focus",      #focus far/near/stop
+    b'\x01\x04\x48' : "focus",      #focus direct
+}
+
+def motionGroup(cmd):
+    """Axis group a command belongs to, None for non-motion commands"""
+    return motion_groups.get(bytes(cmd[:3]))
+
+class _Entry(object):
+    __slots__ = ('group', 'cmd', 'status', 'reply', 'done')
+
+    def __init__(self, group, cmd):
+        self.group  = group
+        self.cmd    = cmd
+        self.status = None
+        self.reply  = None
+        self.done   = None if group else threading.Event()
+
+class CoalescingController(Controller):
+    def __init__(self):
+        super().__init__()
+        self.submitted  = 0
+        self.sent       = 0
+        #Motion commands replaced by a newer one before reaching the link
+        self.dropped    = 0
+        #Motion commands the camera rejected (they are not waited for)
+        self.failed     = 0
+
+        #Final status of motion commands completed since the last _execute
+        self._outcomes  = []
+        self._queue     = deque()
+        self._waiting   = {}    #group -> queued entry
+        self._cond      = threading.Condition()
+        self._worker    = None
+        self._running   = False
+
+    def connect(self, inp):
+        status = self._open(inp)
+        if(status == stat_OK):
+            if(self._worker is None):
+                self._running = True
+                self._worker = threading.Thread(target=self._run, daemon=True)
+                self._worker.start()
+            #Inquiries go through the worker
+            self.sync()
+        return status
+
+    def disconnect(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        if(self._worker is not None):
+            self._worker.join()
+            self._worker = None
+        return super().disconnect()
+
+    def send(self, cmd):
+        """Queues cmd. Motion commands return stat_OK once accepted into the queue,
+        others wait for their status"""
+        status, reply = self.transact(cmd)
+        return status
+
+    def transact(self, cmd):
+        """Queues cmd like send(), also returns the reply of non-motion commands"""
+        if(self.ser is None):
+            return stat_FAIL, None
+        group = motionGroup(cmd)
+        with self._cond:
+            self.submitted += 1
+            entry = self._waiting.get(group) if group else None
+            if(entry is not None):
+                entry.cmd = cmd
+                self.dropped += 1
+                return stat_OK, None
+
+            entry = _Entry(group, cmd)
+            if(group):
+                self._waiting[group] = entry
+            self._queue.append(entry)
+            self._cond.notify()
+            #Every command ahead may take its full timeout and retries
+            limit = self.timeout * (1 + self.retries) * len(self._queue)
+
+        if(group):
+            return stat_OK, None
+        if(not entry.done.wait(limit)):
+            with self._cond:
+                if(entry in self._queue):
+                    self._queue.remove(entry)
+            print("Queued command timeout")
+            return stat_FAIL, None
+        return entry.status, entry.reply
+
+    def _execute(self, steps, delay=0, replies=None):
+        """Controller._execute, but motion steps only go into the queue: the
+        shadow state is left to the worker, which knows whether they completed"""
+        self._recordOutcomes()
+        status = stat_OK
+        sent = False
+        for msg, name in steps:
+            if(self.shadow and self.state.current(msg)):
+                #Camera is already there
+                status = stat_OK
+                if(replies is not None):
+                    replies.append(None)
+                continue
+            sent = True
+            if(motionGroup(msg) is None):
+                status = Controller._execute(self, [(msg, name)], replies=replies)
+            else:
+                status, reply = self.transact(msg)
+                if(replies is not None):
+                    replies.append(reply)
+
+        if(status == stat_OK and delay and sent):
+            time.sleep(delay)
+        return status
+
+    def _recordOutcomes(self):
+        """Feeds the recovery policy the motion commands completed meanwhile.
+        Not done by the worker: a recovery step queues commands and waits for them"""
+        with self._cond:
+            outcomes, self._outcomes = self._outcomes, []
+        if(self.recovery is not None):
+            for status in outcomes:
+                self.recovery.record(self, status)
+
+    def pending(self):
+        """Number of queued commands not yet on the link"""
+        with self._cond:
+            return len(self._queue)
+
+    def idle(self):
+        with self._cond:
+            if(self._queue):
+                return False
+        return Controller.idle(self)
+
+    def stats(self):
+        with self._cond:
+            return {
+                "submitted" : self.submitted,
+                "sent"      : self.sent,
+                "dropped"   : self.dropped,
+                "failed"    : self.failed,
+                "pending"   : len(self._queue),
+            }
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._running and not self._queue:
+                    self._cond.wait()
+                if(not self._running):
+                    break
+                entry = self._queue.popleft()
+                if(entry.group):
+                    del self._waiting[entry.group]
+
+            try:
+                status, reply = self._send(entry)
+            except Exception as error:
+                #Port closed or gone: nothing queued behind it can go out either
+                print("Coalescing worker: %r" % (error,))
+                self._failAll(entry)
+                continue
+            if(entry.group):
+                if(status == stat_OK):
+                    self.state.update(entry.cmd)
+                else:
+                    self.state.forget(entry.cmd)
+            with self._cond:
+                self.sent += 1
+                if(entry.group):
+                    self._outcomes.append(status)
+                    if(status != stat_OK):
+                        self.failed += 1
+            entry.status = status
+            entry.reply = reply
+            if(entry.done is not None):
+                entry.done.set()
+
+        #Release anyone still waiting on a non-motion command
+        self._failAll()
+
+    def _send(self, entry):
+        #Only the worker touches the link, so self.reply is this entry's
+        self.reply = None
+        status = Controller.send(self, entry.cmd)
+        reply = self.reply
+        if(entry.group):
+            #Nobody waits on motion commands, so their retries happen here
+            for attempt in range(self.retries):
+                if(status == stat_OK or not bufferFull(reply)):
+                    break
+                time.sleep(self.backoff * 2**attempt)
+                status = Controller.send(self, entry.cmd)
+                reply = self.reply
+            reportBufferFull(reply)
+        return status, reply
+
+    def _failAll(self, current=None):
+        """Fails current and every queued command"""
+        with self._cond:
+            entries = ([current] if current is not None else []) + list(self._queue)
+            self._queue.clear()
+            self._waiting.clear()
+            for entry in entries:
+                #On a send error, not when the queue is dropped at disconnect
+                if(entry.group and current is not None):
+                    self.failed += 1
+                    self._outcomes.append(stat_FAIL)
+        for entry in entries:
+            if(entry.group):
+                self.state.forget(entry.cmd)
+            entry.status = stat_FAIL
+            if(entry.done is not None):
+                entry.done.set()
@@ -0,0 +1,158 @@
+import threading
+from collections import deque
+
+# Hold-to-move keyboard control. Key events go in, camera commands come out
+# of a worker thread, so a slow link never holds up the key handler:
+#
+#   console = KeyConsole(cam).start()
+#   keyboard.hook(lambda e : console.key(e.name, e.event_type == "down"))
+#   keyboard.wait("esc")
+#   console.stop()                              # stops anything still moving
+#
+# Key down on w/a/s/d starts steering, key up stops it; two held keys on
+# different axes steer diagonally, opposite keys go the way pressed last.
+# q/e zoom and z/x focus the same way. Auto-repeated key downs change
+# nothing and send nothing. If keys change faster than the link, only the
+# newest state of every axis group is sent.
+#
+# The other keys of ACTION_KEYS run once per press.
+
+#key -> (axis, direction)
+MOTION_KEYS = {
+    "w" : ("tilt", "up"),
+    "s" : ("tilt", "down"),
+    "a" : ("pan", "left"),
+    "d" : ("pan", "right"),
+    "q" : ("zoom", "in"),
+    "e" : ("zoom", "out"),
+    "z" : ("focus", "near"),
+    "x" : ("focus", "far"),
+}
+
+#key -> fn(camera)
+ACTION_KEYS = {
+    "c" : lambda cam : cam.clear(),
+    "r" : lambda cam : cam.reset(),
+    "f" : lambda cam : cam.flip(["toggle"]),
+    "m" : lambda cam : cam.mirror(["toggle"]),
+    "b" : lambda cam : cam.backlight(["toggle"]),
+}
+
+#Axis group -> fn(camera, state), state as kept in KeyConsole._want
+_senders = {
+    "pantilt"   : lambda cam, s : cam.steer([s]),
+    "zoom"      : lambda cam, s : cam.zoomFocus(["zoom", s]),
+    "focus"     : lambda cam, s : cam.zoomFocus(["focus", s]),
+}
+
+class KeyConsole(object):
+    def __init__(self, camera, motion_keys=None, action_keys=None):
+        self.camera         = camera
+        self.motion_keys    = MOTION_KEYS if motion_keys is None else motion_keys
+        self.action_keys    = ACTION_KEYS if action_keys is None else action_keys
+        #Key events seen, auto-repeats ignored, commands sent
+        self.events         = 0
+        self.repeats        = 0
+        self.sent           = 0
+
+        #axis -> held directions, last pressed at the end
+        self._held          = {"pan" : [], "tilt" : [], "zoom" : [], "focus" : []}
+        self._down          = set()
+        #group -> state wanted / last sent
+        self._want          = dict.fromkeys(_senders, "stop")
+        self._sent          = dict.fromkeys(_senders, "stop")
+        self._actions       = deque()
+        self._cond          = threading.Condition()
+        self._worker        = None
+        self._running       = False
+
+    def start(self):
+        if(self._worker is None):
+            self._running = True
+            self._worker = threading.Thread(target=self._run, daemon=True)
+            self._worker.start()
+        return self
+
+    def stop(self):
+        """Releases every key, waits for the stops to go out and ends the worker"""
+        with self._cond:
+            for key in list(self._down):
+                self._release(key)
+            self._down.clear()
+            self._running = False
+            self._cond.notify()
+        if(self._worker is not None):
+            self._worker.join()
+            self._worker = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def key(self, name, down):
+        """Feeds one key event; returns at once, the camera is driven from the worker"""
+        if(name is None):
+            return
+        name = name.lower()
+        with self._cond:
+            self.events += 1
+            if(down):
+                if(name in self._down):
+                    self.repeats += 1
+                    return
+                self._down.add(name)
+                if(name in self.motion_keys):
+                    axis, direction = self.motion_keys[name]
+                    self._held[axis].append(direction)
+                elif(name in self.action_keys):
+                    self._actions.append(self.action_keys[name])
+            else:
+                if(name not in self._down):
+                    return
+                self._down.discard(name)
+                self._release(name)
+            self._update()
+            self._cond.notify()
+
+    def _release(self, name):
+        if(name in self.motion_keys):
+            axis, direction = self.motion_keys[name]
+            if(direction in self._held[axis]):
+                self._held[axis].remove(direction)
+        self._update()
+
+    def _update(self):
+        held = self._held
+        tilt = held["tilt"][-1] if held["tilt"] else ""
+        pan = held["pan"][-1] if held["pan"] else ""
+        #STEER_DIRECTIONS names: up, left, upleft, ...
+        self._want["pantilt"] = (tilt + pan) or "stop"
+        self._want["zoom"] = held["zoom"][-1] if held["zoom"] else "stop"
+        self._want["focus"] = held["focus"][-1] if held["focus"] else "stop"
+
+    def moving(self):
+        """Axis groups the console has told to move"""
+        with self._cond:
+            return [group for group, state in self._sent.items() if state != "stop"]
+
+    def _run(self):
+        camera = self.camera
+        while True:
+            with self._cond:
+                while not self._actions and self._want == self._sent:
+                    if(not self._running):
+                        return
+                    self._cond.wait()
+                #Stops first, the camera should never coast; then one-shot actions
+                changed = [g for g in self._want if self._want[g] != self._sent[g]]
+                changed.sort(key=lambda g : self._want[g] != "stop")
+                if(changed and (self._want[changed[0]] == "stop" or not self._actions)):
+                    group = changed[0]
+                    state = self._sent[group] = self._want[group]
+                    job = lambda cam : _senders[group](cam, state)
+                else:
+                    job = self._actions.popleft()
+                self.sent += 1
+            job(camera)
@@ -0,0 +1,198 @@
+import json
+import math
+import time
+
+import numpy as np
+
+from . import visca
+from .tandberg import stat_OK
+
+# Conversions between physical angles, VISCA counts and image pixels. All of
+# them take scalars or NumPy arrays and work on whole arrays at once:
+#
+#   cal = Calibration.load("camera1.json")          # or Calibration() for nominal values
+#   pan, tilt = cal.toCounts(pan_deg, tilt_deg)
+#   pan, tilt = cal.pixelTarget(x, y, pan, tilt, zoom) # counts that centre pixels x, y
+#
+# Angles: pan positive to the right, tilt positive up, 0/0 straight ahead.
+# Pixels: x to the right, y down, (0, 0) top left of a width x height image.
+#
+# Pan and tilt map through (degrees, counts) tables and zoom through a
+# (counts, horizontal field of view) table, all interpolated linearly.
+# calibrate() measures them on the camera.
+
+#Mechanical range, from the camera specification
+PAN_RANGE   = (-90.0, 90.0)
+TILT_RANGE  = (-25.0, 15.0)
+
+#Nominal optics: 12x zoom over counts 0-2850, 72 deg horizontal at wide
+ZOOM_MAX    = 2850
+HFOV_WIDE   = 72.0
+ZOOM_RATIO  = 12.0
+
+def _nominalFov(zoom):
+    magnification = ZOOM_RATIO**(np.asarray(zoom, dtype=float)/ZOOM_MAX)
+    return np.degrees(2*np.arctan(math.tan(math.radians(HFOV_WIDE/2))/magnification))
+
+class Calibration(object):
+    def __init__(self, pan=None, tilt=None, fov=None, width=1920, height=1080):
+        """pan, tilt: ((degrees, ..), (counts, ..)), fov: ((zoom counts, ..), (hfov degrees, ..))"""
+        if(pan is None):
+            deg = np.array(PAN_RANGE)
+            pan = (deg, deg*visca.PAN_PER_DEG + visca.PAN_CENTER)
+        if(tilt is None):
+            deg = np.array(TILT_RANGE)
+            tilt = (deg, deg*visca.TILT_PER_DEG + visca.TILT_CENTER)
+        if(fov is None):
+            zoom = np.linspace(0, ZOOM_MAX, 12)
+            fov = (zoom, _nominalFov(zoom))
+
+        self.pan_deg,  self.pan_counts  = self._table(pan)
+        self.tilt_deg, self.tilt_counts = self._table(tilt)
+        self.zoom_counts, self.hfov     = self._table(fov)
+        self.width  = width
+        self.height = height
+
+    @staticmethod
+    def _table(pair):
+        x, y = (np.asarray(v, dtype=float) for v in pair)
+        if(x.shape != y.shape or len(x) < 2):
+            raise ValueError("Calibration tables need at least two matching points")
+        order = np.argsort(x)
+        return x[order], y[order]
+
+    # --------------------------------------------------------- angle <-> counts
+    def toCounts(self, pan, tilt):
+        """Pan/tilt degrees -> counts"""
+        return (self._interp(pan, self.pan_deg, self.pan_counts),
+                self._interp(tilt, self.tilt_deg, self.tilt_counts))
+
+    def toDegrees(self, pan, tilt):
+        """Pan/tilt counts -> degrees"""
+        return (self._interp(pan, self.pan_counts, self.pan_deg),
+                self._interp(tilt, self.tilt_counts, self.tilt_deg))
+
+    @staticmethod
+    def _interp(v, xs, ys):
+        #Linear inside the table, continued along the end segments outside it
+        v = np.asarray(v, dtype=float)
+        out = np.interp(v, xs, ys)
+        lo, hi = v < xs[0], v > xs[-1]
+        if(lo.any() or hi.any()):
+            out = np.where(lo, ys[0] + (v - xs[0])*(ys[1] - ys[0])/(xs[1] - xs[0]), out)
+            out = np.where(hi, ys[-1] + (v - xs[-1])*(ys[-1] - ys[-2])/(xs[-1] - xs[-2]), out)
+        return out
+
+    # ------------------------------------------------------------ field of view
+    def fov(self, zoom):
+        """(horizontal, vertical) field of view in degrees at zoom counts"""
+        hfov = np.interp(np.asarray(zoom, dtype=float), self.zoom_counts, self.hfov)
+        vfov = np.degrees(2*np.arctan(np.tan(np.radians(hfov)/2)*self.height/self.width))
+        return hfov, vfov
+
+    def focalLength(self, zoom):
+        """Focal length in pixels at zoom counts"""
+        hfov = np.interp(np.asarray(zoom, dtype=float), self.zoom_counts, self.hfov)
+        return (self.width/2)/np.tan(np.radians(hfov)/2)
+
+    # ---------------------------------------------------------- pixels <-> angle
+    def pixelsToDegrees(self, x, y, zoom):
+        """Angles of pixels x, y relative to where the camera points"""
+        f = self.focalLength(zoom)
+        dx = np.asarray(x, dtype=float) - self.width/2
+        dy = np.asarray(y, dtype=float) - self.height/2
+        return np.degrees(np.arctan2(dx, f)), -np.degrees(np.arctan2(dy, f))
+
+    def degreesToPixels(self, pan, tilt, zoom):
+        """Pixels at which angles pan, tilt relative to the camera direction appear"""
+        f = self.focalLength(zoom)
+        x = self.width/2 + f*np.tan(np.radians(np.asarray(pan, dtype=float)))
+        y = self.height/2 - f*np.tan(np.radians(np.asarray(tilt, dtype=float)))
+        return x, y
+
+    def pixelTarget(self, x, y, pan, tilt, zoom):
+        """Pan/tilt counts that bring pixels x, y to the image centre, seen
+        with the camera at pan, tilt, zoom counts"""
+        dpan, dtilt = self.pixelsToDegrees(x, y, zoom)
+        pan_deg, tilt_deg = self.toDegrees(pan, tilt)
+        return self.toCounts(pan_deg + dpan, tilt_deg + dtilt)
+
+    # -------------------------------------------------------------- persistence
+    def save(self, path):
+        data = {
+            "pan"       : [self.pan_deg.tolist(), self.pan_counts.tolist()],
+            "tilt"      : [self.tilt_deg.tolist(), self.tilt_counts.tolist()],
+            "fov"       : [self.zoom_counts.tolist(), self.hfov.tolist()],
+            "width"     : self.width,
+            "height"    : self.height,
+        }
+        with open(path, "w") as f:
+            json.dump(data, f, indent=4)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            data = json.load(f)
+        return cls(data["pan"], data["tilt"], data["fov"], data["width"], data["height"])
+
+# ------------------------------------------------------------------ calibration
+def _driveToLimit(camera, direction, timeout=10.0):
+    """Steers until the position stops changing, returns (pan, tilt) counts"""
+    camera.steer([direction])
+    last = None
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        time.sleep(0.2)
+        pt = camera.inquire("q_pt")
+        if(pt is not None and last is not None and (pt.pan, pt.tilt) == (last.pan, last.tilt)):
+            break
+        last = pt
+    camera.steer(["stop"])
+    return None if last is None else (last.pan, last.tilt)
+
+def calibrate(camera, measure=None, zooms=(0, 500, 1000, 1500, 2000, 2500, 2850), step=None,
+              width=1920, height=1080):
+    """Measures a Calibration on the camera.
+
+    Pan and tilt: the camera is steered into its end stops, which are at the
+    specified PAN_RANGE/TILT_RANGE angles. Field of view: only with measure,
+    a function returning the x pixel of a fixed target in the current image
+    (e.g. the ball detector). At every zoom the camera pans a quarter of the
+    nominal field of view (step counts if that is less) and the target's
+    shift in pixels gives the focal length.
+    """
+    limits = [_driveToLimit(camera, d) for d in ("left", "right", "down", "up")]
+    if(None in limits):
+        print("Calibration : FAILED")
+        return None
+    pan = (PAN_RANGE, (limits[0][0], limits[1][0]))
+    tilt = (TILT_RANGE, (limits[2][1], limits[3][1]))
+    cal = Calibration(pan, tilt, width=width, height=height)
+    if(measure is None):
+        return cal
+
+    #Centre of the pan range, where the pan table is most accurate
+    centre_pan = int((limits[0][0] + limits[1][0])/2)
+    centre_tilt = int(cal.toCounts(0, 0)[1])
+    centre_deg = float(cal.toDegrees(centre_pan, 0)[0])
+    focus = camera.inquire("q_fPos") or 0
+    hfov = []
+    for zoom in zooms:
+        #The target must stay in the picture, so the step shrinks as the camera zooms in
+        quarter = float(cal.toCounts(centre_deg + float(cal.fov(zoom)[0])/4, 0)[0]) - centre_pan
+        counts = max(1, int(quarter) if step is None else min(step, int(quarter)))
+        step_deg = float(cal.toDegrees(centre_pan + counts, 0)[0]) - centre_deg
+        if(camera.ptzf([centre_pan, centre_tilt, zoom, focus]) != stat_OK):
+            print("Calibration : FAILED")
+            return None
+        x0 = measure()
+        camera.pt_direct([centre_pan + counts, centre_tilt])
+        x1 = measure()
+        if(x0 is None or x1 is None or x0 == x1):
+            print("Calibration : no target at zoom %d" % zoom)
+            return None
+        #Target moves left when the camera pans right
+        f = abs(x0 - x1)/math.tan(math.radians(step_deg))
+        hfov.append(math.degrees(2*math.atan((width/2)/f)))
+    cal.zoom_counts, cal.hfov = Calibration._table((zooms, hfov))
+    return cal
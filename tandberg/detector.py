@@ -0,0 +1,123 @@
+import cv2
+import numpy as np
+
+# Coloured ball detection, the same steps as tests/ball_detector.py:
+# HSV threshold, erode/dilate to drop small blobs, largest contour.
+#
+#   detect = BallDetector(scale=0.5)
+#   found = detect(frame)               # (x, y, radius) in frame pixels, or None
+#
+# Every intermediate image is written into buffers allocated for the first
+# frame, so a steady stream of frames allocates nothing but the contours.
+# After a hit only a window of roi times the radius around it is searched;
+# a miss there searches the whole frame again in the same call. With
+# scale < 1 the window (or the whole frame) is cut out first and only that
+# is shrunk, all further work happens on the small copy.
+
+#HSV range of the yellow ball
+ylo_lower = (20, 100, 100)
+ylo_upper = (30, 255, 255)
+
+class BallDetector(object):
+    def __init__(self, lower=ylo_lower, upper=ylo_upper, min_radius=10, scale=1.0, roi=4.0, min_roi=64):
+        self.lower      = np.array(lower, dtype=np.uint8)
+        self.upper      = np.array(upper, dtype=np.uint8)
+        #Smaller blobs are not taken for the ball, in frame pixels
+        self.min_radius = min_radius
+        #Processing resolution relative to the frame
+        self.scale      = scale
+        #Search window half size in radii of the last hit, at least min_roi frame pixels.
+        #None always searches the whole frame
+        self.roi        = roi
+        self.min_roi    = min_roi
+        #Last hit (x, y, radius), in frame pixels
+        self.last       = None
+        #Searches of a window / the whole frame
+        self.roi_searches   = 0
+        self.full_searches  = 0
+
+        self._shape     = None
+        self._kernel    = cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3))
+
+    def _allocate(self, shape):
+        h, w = shape[:2]
+        if(self.scale != 1.0):
+            h, w = int(round(h*self.scale)), int(round(w*self.scale))
+            self._small = np.empty((h, w, 3), dtype=np.uint8)
+        self._hsv   = np.empty((h, w, 3), dtype=np.uint8)
+        self._mask  = np.empty((h, w), dtype=np.uint8)
+        self._tmp   = np.empty((h, w), dtype=np.uint8)
+        self._shape = shape
+
+    def reset(self):
+        """Forgets the last hit, the next call searches the whole frame"""
+        self.last = None
+
+    def __call__(self, frame):
+        """(x, y, radius) of the ball in frame, None if there is none"""
+        if(frame.shape != self._shape):
+            self._allocate(frame.shape)
+
+        found = None
+        if(self.last is not None and self.roi is not None):
+            x, y, radius = self.last
+            half = max(self.min_roi, self.roi*radius)
+            h, w = frame.shape[:2]
+            x0 = max(0, int(x - half))
+            y0 = max(0, int(y - half))
+            x1 = min(w, int(x + half) + 1)
+            y1 = min(h, int(y + half) + 1)
+            if(x1 > x0 and y1 > y0):
+                self.roi_searches += 1
+                found = self._find(frame, x0, y0, x1, y1)
+        if(found is None):
+            self.full_searches += 1
+            found = self._find(frame, 0, 0, frame.shape[1], frame.shape[0])
+        self.last = found
+        return found
+
+    def _find(self, frame, x0, y0, x1, y1):
+        """Ball in the window x0..x1, y0..y1 of the frame, in frame pixels.
+        The window is cropped first and only the crop is shrunk"""
+        crop = frame[y0:y1, x0:x1]
+        if(self.scale == 1.0):
+            found = self._search(crop, 0, 0, x1 - x0, y1 - y0)
+            if(found is None):
+                return None
+            return (x0 + found[0], y0 + found[1], found[2])
+        w = max(1, int(round((x1 - x0)*self.scale)))
+        h = max(1, int(round((y1 - y0)*self.scale)))
+        small = self._small[:h, :w]
+        small = cv2.resize(crop, (w, h), dst=small, interpolation=cv2.INTER_AREA)
+        found = self._search(small, 0, 0, w, h)
+        if(found is None):
+            return None
+        #Back through the scale, then the crop
+        return (x0 + found[0]/self.scale, y0 + found[1]/self.scale, found[2]/self.scale)
+
+    def _search(self, frame, x0, y0, x1, y1):
+        """Ball in the window x0..x1, y0..y1 of an image at processing scale, in its pixels"""
+        #Views into the full size buffers, OpenCV writes through them
+        hsv = self._hsv[:y1 - y0, :x1 - x0]
+        mask = self._mask[:y1 - y0, :x1 - x0]
+        tmp = self._tmp[:y1 - y0, :x1 - x0]
+        cv2.cvtColor(frame[y0:y1, x0:x1], cv2.COLOR_BGR2HSV, dst=hsv)
+        cv2.inRange(hsv, self.lower, self.upper, dst=mask)
+        cv2.erode(mask, self._kernel, dst=tmp, iterations=2)
+        cv2.dilate(tmp, self._kernel, dst=mask, iterations=2)
+
+        #findContours leaves the mask alone since OpenCV 3.2, no copy needed
+        cnts = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        #OpenCV 3 returns (image, contours, hierarchy), 2 and 4 (contours, hierarchy)
+        cnts = cnts[0] if len(cnts) == 2 else cnts[1]
+        if(len(cnts) == 0):
+            return None
+
+        c = max(cnts, key=cv2.contourArea)
+        ((x, y), radius) = cv2.minEnclosingCircle(c)
+        if(radius < self.min_radius*self.scale):
+            return None
+        M = cv2.moments(c)
+        if(M["m00"] == 0):
+            return None
+        return (x0 + M["m10"]/M["m00"], y0 + M["m01"]/M["m00"], radius)
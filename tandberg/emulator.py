@@ -0,0 +1,490 @@
+import heapq
+import os
+import select
+import termios
+import threading
+import time
+
+from .visca import toNibbles, fromNibbles
+
+# Software stand-in for a PrecisionHD 1080p on the far end of a pseudo-terminal.
+# Controller.connect(emu.port) talks to it exactly as it would to the camera.
+# Serial timing (10 bits per byte at the configured baud) and motor travel
+# time are simulated so latency measurements are meaningful. With timing on,
+# bytes sent while the host port is at another speed than the camera are lost,
+# like the framing garbage a real camera would see.
+
+# Motor travel in counts/second at maximum speed
+PAN_RATE    = 400.0
+TILT_RATE   = 200.0
+ZOOM_RATE   = 1140.0
+FOCUS_RATE  = 2000.0
+
+PAN_CENTER  = 408
+TILT_CENTER = 135
+
+#VISCA allows 14 message bytes; PTZF_Direct (19) is the longest the camera accepts
+MAX_MESSAGE     = 19
+
+err_length      = 0x01
+err_syntax      = 0x02
+err_buffer_full = 0x03
+err_cancelled   = 0x04
+err_no_socket   = 0x05
+err_not_exec    = 0x41
+
+#termios speed constant -> baudrate
+_speeds = {getattr(termios, "B%d" % b) : b for b in (1200, 2400, 4800, 9600, 19200, 38400, 57600, 115200)}
+
+class _Axis(object):
+    """One motor: position, limits and the current movement"""
+    def __init__(self, pos, lo, hi, rate):
+        self.pos    = float(pos)
+        self.lo     = lo
+        self.hi     = hi
+        self.rate   = rate
+        self.vel    = 0.0
+        self.target = None
+
+    def advance(self, dt):
+        if(self.vel == 0.0):
+            return
+        pos = self.pos + self.vel*dt
+        if(self.target is not None and (pos - self.target)*self.vel >= 0):
+            pos = self.target
+            self.vel = 0.0
+            self.target = None
+        self.pos = min(max(pos, self.lo), self.hi)
+
+    def moveTo(self, target, scale=1.0):
+        """Starts a move to target, returns the travel time in seconds"""
+        target = min(max(target, self.lo), self.hi)
+        dist = target - self.pos
+        rate = self.rate*scale
+        if(dist == 0 or rate <= 0):
+            self.vel = 0.0
+            self.target = None
+            return 0.0
+        self.target = target
+        self.vel = rate if dist > 0 else -rate
+        return abs(dist)/rate
+
+    def drive(self, direction, scale=1.0):
+        """Continuous movement (-1, 0, +1) until stopped or a limit is hit"""
+        self.target = None
+        self.vel = direction*self.rate*scale
+
+class Emulator(object):
+    def __init__(self, baudrate=9600, ack=False, buffers=2, address=1, units=1):
+        #baudrate=None disables serial timing, replies are immediate
+        self.baudrate   = baudrate
+        #The PrecisionHD sends completions only; Sony style cameras ACK first
+        self.ack        = ack
+        #Commands held at once, including the one being executed
+        self.buffers    = buffers
+        self.address    = address
+
+        self.port       = None
+        self.master     = None
+        self.slave      = None
+        self.thread     = None
+        self.running    = False
+        self.lock       = threading.Lock()
+
+        #Wire statistics
+        self.bytesIn    = 0
+        self.bytesOut   = 0
+        self.framesIn   = 0
+        self.framesOut  = 0
+
+        self._events    = []
+        self._seq       = 0
+        self._rxFree    = 0.0
+        self._txFree    = 0.0
+        self._pending   = b''
+        self._failNext  = []
+        self.reset_state()
+
+        #Further cameras daisy-chained behind this one share its line
+        self.line       = self
+        self.units      = [self]
+        for i in range(1, units):
+            unit = Emulator(baudrate, ack, buffers, address + i)
+            unit.line = self
+            unit.lock = self.lock
+            self.units.append(unit)
+
+    def reset_state(self):
+        """Power-on defaults"""
+        self.pan    = _Axis(PAN_CENTER, 0, 816, PAN_RATE)
+        self.tilt   = _Axis(TILT_CENTER, 7, 212, TILT_RATE)
+        self.zoom   = _Axis(0, 0, 2850, ZOOM_RATE)
+        self.focus  = _Axis(0, 0, 4095, FOCUS_RATE)
+        self._moved = time.monotonic()
+        #Sockets holding a running command, socket -> completion event
+        self.sockets = {}
+        self.regs = {
+            'power'     : 2,
+            'wbMode'    : 0,
+            'wbTable'   : 0,
+            'aeMode'    : 0,
+            'iris'      : 0,
+            'gain'      : 12,
+            'backlight' : 3,
+            'mirror'    : 3,
+            'flip'      : 3,
+            'gMode'     : 2,
+            'gTable'    : 4,
+            'fMode'     : 2,
+            'callLed'   : 3,
+            'pwrLed'    : 2,
+            'mmDetect'  : 1,
+            'vidFormat' : 1,
+            'dip'       : 9,    #Video mode DIP set to SW control
+            'bestView'  : 0,
+            'invert'    : 0,
+        }
+
+    # ---------------------------------------------------------------- runtime
+    def start(self):
+        """Opens the pseudo-terminal and starts answering, returns the port name"""
+        self.master, self.slave = os.openpty()
+        self.port = os.ttyname(self.slave)
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        return self.port
+
+    def stop(self):
+        self.running = False
+        if(self.thread is not None):
+            self.thread.join()
+            self.thread = None
+        for fd in (self.slave, self.master):
+            if(fd is not None):
+                os.close(fd)
+        self.master = self.slave = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def failNext(self, code, count=1):
+        """Answers the next count commands with error code instead of executing them"""
+        with self.lock:
+            self._failNext.extend([code]*count)
+
+    def resetStats(self):
+        self.bytesIn = self.bytesOut = self.framesIn = self.framesOut = 0
+
+    def _byteTime(self):
+        return 10.0/self.baudrate if self.baudrate else 0.0
+
+    def _at(self, when, fn, *args):
+        self._seq += 1
+        heapq.heappush(self._events, (when, self._seq, fn, args))
+
+    def _run(self):
+        while self.running:
+            now = time.monotonic()
+            while self._events and self._events[0][0] <= now:
+                _, _, fn, args = heapq.heappop(self._events)
+                with self.lock:
+                    fn(*args)
+            timeout = 0.05
+            if(self._events):
+                timeout = min(timeout, max(0.0, self._events[0][0] - time.monotonic()))
+            ready, _, _ = select.select([self.master], [], [], timeout)
+            if(ready):
+                try:
+                    data = os.read(self.master, 4096)
+                except OSError:
+                    continue
+                self._receiveBytes(data, time.monotonic())
+
+    def hostBaud(self):
+        """Speed the host side of the pseudo-terminal is set to, None if unknown"""
+        try:
+            return _speeds.get(termios.tcgetattr(self.master)[4])
+        except termios.error:
+            return None
+
+    def _speedMatch(self):
+        if(not self.baudrate):
+            return True
+        host = self.hostBaud()
+        return host is None or host == self.baudrate
+
+    def _receiveBytes(self, data, now):
+        self.bytesIn += len(data)
+        if(not self._speedMatch()):
+            return
+        self._pending += data
+        while True:
+            end = self._pending.find(b'\xff')
+            if(end == -1):
+                break
+            frame = self._pending[:end + 1]
+            self._pending = self._pending[end + 1:]
+            #The frame is only complete once its last byte has crossed the wire
+            self._rxFree = max(now, self._rxFree) + len(frame)*self._byteTime()
+            self._at(self._rxFree, self._handle, frame)
+
+    def _write(self, frame):
+        now = time.monotonic()
+        self._txFree = max(now, self._txFree) + len(frame)*self._byteTime()
+        self._at(self._txFree, self._emit, frame)
+
+    def _emit(self, frame):
+        if(not self._speedMatch()):
+            return
+        try:
+            os.write(self.master, frame)
+        except OSError:
+            return
+        self.bytesOut += len(frame)
+        self.framesOut += 1
+
+    def _reply(self, body):
+        self.line._write(bytes(((self.address + 8) << 4,)) + body + b'\xff')
+
+    def _error(self, socket, code):
+        self._reply(bytes((0x60 | socket, code)))
+
+    # --------------------------------------------------------------- protocol
+    def _handle(self, frame):
+        self.framesIn += 1
+        if(len(frame) < 3):
+            return
+        head, body = frame[0], frame[1:-1]
+
+        if(body[0] == 0x30):
+            #Address_Set: each camera takes p and passes p + 1 down the chain,
+            #the last one sends the next free address back to the host
+            p = body[1] if len(body) > 1 else 1
+            for unit in self.units:
+                unit.address = p
+                p += 1
+            self._write(b'\x88\x30' + bytes((p,)) + b'\xff')
+            return
+        for unit in self.units:
+            if(head == 0x88 or head == (0x80 | unit.address)):
+                unit._handleUnit(body)
+
+    def _handleUnit(self, body):
+        self._advance()
+        if(len(body) > MAX_MESSAGE):
+            self._error(0, err_length)
+            return
+        if(self._failNext):
+            self._error(0, self._failNext.pop(0))
+            return
+        if(body[0] == 0x09):
+            self._inquiry(body[1:])
+        elif(body[0] == 0x01):
+            self._command(body[1:])
+        else:
+            self._error(0, err_syntax)
+
+    def _advance(self):
+        now = time.monotonic()
+        dt = now - self._moved
+        self._moved = now
+        for axis in (self.pan, self.tilt, self.zoom, self.focus):
+            axis.advance(dt)
+
+    def _accept(self, duration):
+        """Takes a socket for a command running duration seconds, None if full"""
+        free = [s for s in range(1, self.buffers + 1) if s not in self.sockets]
+        if(not free):
+            return None
+        socket = free[0]
+        if(self.ack):
+            self._reply(bytes((0x40 | socket,)))
+        done = time.monotonic() + duration
+        self.sockets[socket] = done
+        self.line._at(done, self._complete, socket, done)
+        return socket
+
+    def _afterReply(self, fn, *args):
+        """Runs fn once the completion just scheduled by _done is on the wire"""
+        #Same time as the completion but queued after it, so _txFree is final
+        line = self.line
+        line._at(time.monotonic(), lambda : line._at(line._txFree, fn, *args))
+
+    def _complete(self, socket, done):
+        if(self.sockets.get(socket) != done):
+            return     #Cancelled in the meantime
+        del self.sockets[socket]
+        self._advance()
+        #A single socket camera always reports socket 0
+        self._reply(bytes((0x50 | (socket if self.ack else 0),)))
+
+    def _done(self, duration=0.0):
+        if(self._accept(duration) is None):
+            self._error(0, err_buffer_full)
+
+    def _command(self, c):
+        regs = self.regs
+        setters = {
+            b'\x04\x00' : 'power',
+            b'\x04\x35' : 'wbMode',
+            b'\x04\x39' : 'aeMode',
+            b'\x04\x33' : 'backlight',
+            b'\x04\x61' : 'mirror',
+            b'\x04\x66' : 'flip',
+            b'\x04\x51' : 'gMode',
+            b'\x04\x38' : 'fMode',
+            b'\x33\x01' : 'callLed',
+            b'\x33\x02' : 'pwrLed',
+            b'\x50\x30' : 'mmDetect',
+        }
+        tables = {
+            b'\x04\x75' : 'wbTable',
+            b'\x04\x4b' : 'iris',
+            b'\x04\x4c' : 'gain',
+            b'\x04\x52' : 'gTable',
+        }
+        key = c[:2]
+
+        if(c == b'\x00\x01'):
+            #IF_Clear cancels everything in progress
+            for socket in list(self.sockets):
+                del self.sockets[socket]
+                self._error(socket if self.ack else 0, err_cancelled)
+            for axis in (self.pan, self.tilt, self.zoom, self.focus):
+                axis.drive(0)
+            self._reply(b'\x50')
+        elif(key in setters and len(c) == 3):
+            value = c[2]
+            if(key == b'\x33\x01'):
+                value = {0: 3, 1: 2, 2: 4}.get(value, 3)
+            elif(key == b'\x33\x02'):
+                value = {0: 3, 1: 2}.get(value, 2)
+            regs[setters[key]] = value
+            duration = 0.0
+            if(key == b'\x04\x00'):
+                #Power on/off stores and resets zoom and focus
+                duration = max(self.zoom.moveTo(0), self.focus.moveTo(0))
+            self._done(duration)
+        elif(key in tables and len(c) == 6):
+            regs[tables[key]] = fromNibbles(c[2:6])
+            self._done()
+        elif(c[0] == 0x35 and len(c) == 4):
+            if(regs['dip'] != 9):
+                self._error(0, err_not_exec)
+                return
+            regs['vidFormat'] = c[2]
+            self._done()
+        elif(key == b'\x06\x01' and len(c) == 6):
+            self._steer(c[2], c[3], c[4], c[5])
+        elif(key == b'\x06\x02' and len(c) == 12):
+            duration = max(self.pan.moveTo(fromNibbles(c[4:8]), c[2]/15.0),
+                           self.tilt.moveTo(fromNibbles(c[8:12]), c[3]/15.0))
+            self._done(duration)
+        elif(key == b'\x06\x20' and len(c) == 18):
+            duration = max(self.pan.moveTo(fromNibbles(c[2:6])),
+                           self.tilt.moveTo(fromNibbles(c[6:10])),
+                           self.zoom.moveTo(fromNibbles(c[10:14])),
+                           self.focus.moveTo(fromNibbles(c[14:18])))
+            self._done(duration)
+        elif(key == b'\x06\x05' and len(c) == 2):
+            duration = max(self.pan.moveTo(PAN_CENTER), self.tilt.moveTo(TILT_CENTER))
+            self._done(duration)
+        elif(key == b'\x04\x07' and len(c) == 3):
+            self._drive(self.zoom, c[2])
+        elif(key == b'\x04\x08' and len(c) == 3):
+            self._drive(self.focus, c[2])
+        elif(key == b'\x04\x47' and len(c) in (6, 10)):
+            duration = self.zoom.moveTo(fromNibbles(c[2:6]))
+            if(len(c) == 10):
+                duration = max(duration, self.focus.moveTo(fromNibbles(c[6:10])))
+            self._done(duration)
+        elif(key == b'\x04\x48' and len(c) == 6):
+            self._done(self.focus.moveTo(fromNibbles(c[2:6])))
+        elif(key == b'\x50\x60' and len(c) == 4):
+            regs['bestView'] = c[2]*10 + c[3]
+            self._done()
+        elif(c[0] == 0x34 and len(c) == 2):
+            #Reply goes out at the old speed, then the line switches
+            self._done()
+            self._afterReply(self._setBaud, 115200 if c[1] else 9600)
+        elif(c == b'\x42'):
+            self._done()
+            self._afterReply(self._reboot)
+        else:
+            self._error(0, err_syntax)
+
+    def _steer(self, panSpeed, tiltSpeed, panDir, tiltDir):
+        direction = {1: -1, 2: 1, 3: 0}
+        if(panDir not in direction or tiltDir not in direction):
+            self._error(0, err_syntax)
+            return
+        self.pan.drive(direction[panDir], panSpeed/15.0)
+        self.tilt.drive(-direction[tiltDir], tiltSpeed/15.0)
+        self._done()
+
+    def _drive(self, axis, value):
+        #0x2p = tele/far, 0x3p = wide/near, 0x00 = stop; p = a (low), b (high)
+        scale = 1.0 if (value & 0x0f) == 0x0b else 0.5
+        if(value == 0):
+            axis.drive(0)
+        elif(value >> 4 == 2):
+            axis.drive(1, scale)
+        elif(value >> 4 == 3):
+            axis.drive(-1, scale)
+        else:
+            self._error(0, err_syntax)
+            return
+        self._done()
+
+    def _setBaud(self, baudrate):
+        if(self.line.baudrate):
+            self.line.baudrate = baudrate
+
+    def _reboot(self):
+        self._setBaud(9600)
+        self.reset_state()
+
+    def _inquiry(self, q):
+        regs = self.regs
+        single = {
+            b'\x04\x00'     : 'power',
+            b'\x04\x38'     : 'fMode',
+            b'\x04\x35'     : 'wbMode',
+            b'\x04\x39'     : 'aeMode',
+            b'\x04\x33'     : 'backlight',
+            b'\x04\x61'     : 'mirror',
+            b'\x04\x66'     : 'flip',
+            b'\x04\x51'     : 'gMode',
+            b'\x01\x33\x01' : 'callLed',
+            b'\x01\x33\x02' : 'pwrLed',
+            b'\x50\x70'     : 'invert',
+        }
+        if(q in single):
+            self._reply(b'\x50' + bytes((regs[single[q]],)))
+        elif(q == b'\x04\x22'):
+            self._reply(b'\x50\x50\x00\x00\x00')
+        elif(q == b'\x04\x47'):
+            self._reply(b'\x50' + toNibbles(int(round(self.zoom.pos))))
+        elif(q == b'\x04\x48'):
+            self._reply(b'\x50' + toNibbles(int(round(self.focus.pos))))
+        elif(q == b'\x06\x12'):
+            self._reply(b'\x50' + toNibbles(int(round(self.pan.pos))) + toNibbles(int(round(self.tilt.pos))))
+        elif(q == b'\x04\x75'):
+            self._reply(b'\x50' + toNibbles(regs['wbTable']))
+        elif(q == b'\x04\x52'):
+            self._reply(b'\x50' + toNibbles(regs['gTable']))
+        elif(q == b'\x06\x23'):
+            self._reply(b'\x50' + toNibbles(regs['vidFormat']))
+        elif(q == b'\x06\x24'):
+            self._reply(b'\x50' + toNibbles(regs['dip']))
+        elif(q in (b'\x50\x50', b'\x50\x51', b'\x50\x52', b'\x50\x53')):
+            self._reply(b'\x50' + toNibbles(0x1000 + q[1], 8))
+        elif(q == b'\x50\x60'):
+            self._reply(b'\x50' + toNibbles(regs['bestView'] << 8))
+        else:
+            self._error(0, err_syntax)
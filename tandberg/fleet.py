@@ -0,0 +1,219 @@
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from .metrics import Metrics, prometheus
+from .tandberg import Controller, stat_OK, stat_FAIL
+
+# Many cameras, each on its own serial port, driven concurrently from a
+# bounded pool of worker threads:
+#
+#   fleet = Fleet(["/dev/ttyUSB0", "/dev/ttyUSB1", ...], workers=8)
+#   fleet.connect()
+#   results = fleet.ptzf([408, 135, 0, 0])
+#   for port, r in results.items():
+#       print(port, r.status, r.elapsed)
+#
+# A camera that fails, raises or times out only affects its own Result.
+# Its deadline (timeout) starts when a worker picks it up, not while it waits
+# for one; deadline bounds the whole operation, and cameras that have not
+# started by then are cancelled and never see the command.
+
+class Result(object):
+    __slots__ = ('port', 'status', 'elapsed', 'error', 'value')
+
+    def __init__(self, port, status, elapsed, error=None, value=None):
+        self.port       = port
+        self.status     = status
+        #Seconds spent on the operation
+        self.elapsed    = elapsed
+        self.error      = error
+        #Decoded inquiry reply, see visca.parse
+        self.value      = value
+
+    @property
+    def ok(self):
+        return self.status == stat_OK
+
+    def __repr__(self):
+        return "Result(%s, status=%d, elapsed=%.3f, error=%r, value=%r)" % (self.port, self.status, self.elapsed, self.error, self.value)
+
+class Fleet(object):
+    def __init__(self, ports=(), workers=8, timeout=5, deadline=None, read_timeout=None,
+                 controller=Controller, metrics=False):
+        #Seconds a camera gets per operation, from when a worker starts on it
+        self.timeout    = timeout
+        #Seconds for a whole operation over the fleet, None for no limit
+        self.deadline   = deadline
+        #Serial read timeout given to every camera, None keeps the controller's
+        self.read_timeout = read_timeout
+        self.controller = controller
+        #Give every camera a metrics.Metrics labelled with its port
+        self.metrics    = metrics
+        self.pool       = ThreadPoolExecutor(max_workers=workers)
+        #port -> Controller
+        self.cameras    = {}
+        #port -> lock held while an operation runs on that camera
+        self._busy      = {}
+        for port in ports:
+            self.add(port)
+
+    def add(self, port):
+        if(port not in self.cameras):
+            camera = self.cameras[port] = self.controller()
+            if(self.metrics):
+                camera.metrics = Metrics({"port" : port})
+            self._busy[port] = threading.Lock()
+        return self.cameras[port]
+
+    def remove(self, port):
+        camera = self.cameras.pop(port, None)
+        self._busy.pop(port, None)
+        if(camera is not None):
+            camera.disconnect()
+
+    def __len__(self):
+        return len(self.cameras)
+
+    def _call(self, port, fn, started):
+        started[port] = time.monotonic()
+        lock = self._busy[port]
+        if(not lock.acquire(blocking=False)):
+            return Result(port, stat_FAIL, 0.0, "busy")
+        start = time.perf_counter()
+        try:
+            status = fn(self.cameras[port], port)
+            value = None
+            if(isinstance(status, tuple)):
+                #(status, value) from an inquiry
+                status, value = status
+            if(status is None):
+                status = stat_OK
+            return Result(port, status, time.perf_counter() - start, value=value)
+        except Exception as error:
+            return Result(port, stat_FAIL, time.perf_counter() - start, repr(error))
+        finally:
+            lock.release()
+
+    def map(self, fn, ports=None):
+        """Runs fn(controller, port) on every camera concurrently, returns port -> Result"""
+        ports = list(self.cameras) if ports is None else ports
+        started = {}
+        futures = {self.pool.submit(self._call, port, fn, started): port for port in ports}
+        return self._gather(futures, started)
+
+    def _gather(self, futures, started):
+        """Waits for future -> port, each camera until timeout after its
+        started[port], all until deadline. Returns port -> Result"""
+        end = None if self.deadline is None else time.monotonic() + self.deadline
+        results = {}
+        pending = set(futures)
+        while pending:
+            now = time.monotonic()
+            expiries = [started[futures[f]] + self.timeout for f in pending if futures[f] in started]
+            wake = min(expiries) if expiries else None
+            if(end is not None):
+                wake = end if wake is None else min(wake, end)
+            timeout = None if wake is None else max(wake - now, 0)
+            if(len(expiries) < len(pending)):
+                #Queued cameras start when a worker frees up, look again soon
+                timeout = 0.05 if timeout is None else min(timeout, 0.05)
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                if(not future.cancelled()):
+                    result = future.result()
+                    results[result.port] = result
+
+            now = time.monotonic()
+            for future in list(pending):
+                port = futures[future]
+                overall = end is not None and now >= end
+                if(port not in started and overall and future.cancel()):
+                    pending.discard(future)
+                    results[port] = Result(port, stat_FAIL, 0.0, "not started")
+                elif(port in started and (overall or now >= started[port] + self.timeout)):
+                    #Still running in its worker; reported now, the camera stays busy
+                    pending.discard(future)
+                    results[port] = Result(port, stat_FAIL, now - started[port], "timeout")
+        return results
+
+    def run(self, method, *args, ports=None):
+        """Calls Controller.method(*args) on every camera"""
+        return self.map(lambda cam, port : getattr(cam, method)(*args), ports)
+
+    def _open(self, cam, port):
+        status = cam.connect(port)
+        if(status == stat_OK and self.read_timeout is not None):
+            cam.timeout = self.read_timeout
+        return status
+
+    def connect(self, ports=None):
+        return self.map(self._open, ports)
+
+    def disconnect(self):
+        return self.run("disconnect")
+
+    def close(self):
+        self.disconnect()
+        self.pool.shutdown(wait=False)
+
+    def ptzf(self, inp, ports=None):
+        return self.run("ptzf", inp, ports=ports)
+
+    def power(self, inp, ports=None):
+        return self.run("power", inp, ports=ports)
+
+    def vid_format(self, inp, ports=None):
+        return self.run("vid_format", inp, ports=ports)
+
+    @staticmethod
+    def _inquire(cam, name):
+        value = cam.inquire(name)
+        return (stat_FAIL if value is None else stat_OK), value
+
+    def qCmd(self, inp, ports=None):
+        """Runs inquiry inp[0] on every camera, decoded replies in Result.value"""
+        return self.map(lambda cam, port : self._inquire(cam, inp[0]), ports)
+
+    def health(self):
+        """Sweeps every camera with a power inquiry, returns port -> Result"""
+        def probe(cam, port):
+            if(cam.ser is None or not cam.ser.is_open):
+                if(self._open(cam, port) != stat_OK):
+                    return stat_FAIL
+            return self._inquire(cam, "q_pwr")
+        return self.map(probe)
+
+    def discover(self):
+        """Probes the serial ports found by Controller.getPorts that are not in
+        the fleet, returns port -> Result. They are not added: add() the
+        cameras wanted, anything else on a port is left alone afterwards"""
+        ports = [port for port in Controller.getPorts() if port not in self.cameras]
+
+        def probe(port):
+            started[port] = time.monotonic()
+            cam = self.controller()
+            start = time.perf_counter()
+            try:
+                if(self._open(cam, port) != stat_OK):
+                    return Result(port, stat_FAIL, time.perf_counter() - start, "no camera")
+                status, value = self._inquire(cam, "q_pwr")
+                return Result(port, status, time.perf_counter() - start, value=value)
+            except Exception as error:
+                return Result(port, stat_FAIL, time.perf_counter() - start, repr(error))
+            finally:
+                cam.disconnect()
+
+        started = {}
+        futures = {self.pool.submit(probe, port): port for port in ports}
+        return self._gather(futures, started)
+
+    def prometheus(self):
+        """Prometheus text of every camera's metrics, see metrics.py"""
+        return prometheus([cam.metrics for cam in self.cameras.values() if cam.metrics is not None])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,344 @@
+import json
+import socketserver
+import threading
+from collections import deque
+
+from . import visca
+from .metrics import commandName
+from .tandberg import stat_OK, stat_FAIL
+from .visca import toNibbles
+
+# Shares one camera between many programs over TCP:
+#
+#   cam = PipelinedController(); cam.connect("/dev/ttyUSB0")
+#   gateway = Gateway(cam, ("0.0.0.0", 5678), priorities={"10.0.0.5" : 10})
+#   gateway.start()
+#
+# Clients speak either protocol, told apart by their first byte:
+#   raw VISCA   frames 8x .. FF as to the camera itself; every frame is
+#               answered in order with one final frame 90 5y ..FF or
+#               90 6y code FF (no ACKs, like the PrecisionHD). A request
+#               that got no reply at all is answered 90 60 41 FF
+#   JSON        one object per line, answered by one line with the same id
+#       {"id": 1, "cmd": "ptzf", "args": [408, 135, 0, 0]}
+#       {"id": 2, "cmd": "q_pt"}
+#       {"id": 3, "hex": "8101040002ff"}          any message, address optional
+#       {"priority": 10}                            changes this client's priority
+#     -> {"id": 2, "status": 0, "reply": "50..", "value": [...], "local": false}
+#
+# The link serves one request at a time, the most urgent first: the
+# highest priority with anything queued, round robin between the clients
+# at that priority. Inquiries the shadow state (state.py) can answer, and
+# setters the camera is already in, are answered here without the link.
+# That is decided when the request's turn comes, after the client's earlier
+# requests, so replies keep their order and see the state those left.
+
+#Inquiry message -> name
+_inquiry_names = {msg : name for name, (msg, fields) in visca.inquiries.items()}
+
+_modes  = {True : 2, False : 3}
+_leds   = {'on' : 2, 'off' : 3, 'blink' : 4}
+
+#Inquiry name -> (state keys, fn(*values) -> reply), the inverse of visca.parse
+_cached_replies = {
+    "q_pt"          : (("pan", "tilt"), lambda p, t : b'\x50' + toNibbles(p) + toNibbles(t)),
+    "q_zoompos"     : (("zoom",), lambda v : b'\x50' + toNibbles(v)),
+    "q_fPos"        : (("focus",), lambda v : b'\x50' + toNibbles(v)),
+    "q_wbTable"     : (("wbTable",), lambda v : b'\x50' + toNibbles(v)),
+    "q_gTable"      : (("gTable",), lambda v : b'\x50' + toNibbles(v)),
+    "q_fMode"       : (("fMode",), lambda v : bytes((0x50, _modes[v]))),
+    "q_blacklight"  : (("backlight",), lambda v : bytes((0x50, _modes[v]))),
+    "q_mirror"      : (("mirror",), lambda v : bytes((0x50, _modes[v]))),
+    "q_flip"        : (("flip",), lambda v : bytes((0x50, _modes[v]))),
+    "q_gMode"       : (("gMode",), lambda v : bytes((0x50, _modes[v]))),
+    "q_wbMode"      : (("wbMode",), lambda v : bytes((0x50, 0 if v else 6))),
+    "q_aeMode"      : (("aeMode",), lambda v : bytes((0x50, 0 if v else 3))),
+    "q_callLed"     : (("callLed",), lambda v : bytes((0x50, _leds[v]))),
+    "q_pwrLed"      : (("pwrLed",), lambda v : bytes((0x50, _leds[v]))),
+    "q_vidSys"      : (("vidFormat",), lambda v : b'\x50' + toNibbles(visca.VIDEO_FORMATS[v])),
+}
+
+def cachedReply(state, name):
+    """Reply to inquiry name built from state, None if state does not know it"""
+    entry = _cached_replies.get(name)
+    if(entry is None):
+        return None
+    keys, build = entry
+    values = [state.get(key) for key in keys]
+    if(None in values):
+        return None
+    return build(*values)
+
+class _Client(object):
+    def __init__(self, sock, address, priority):
+        self.sock       = sock
+        self.address    = address
+        self.priority   = priority
+        #(message, respond) waiting for the link
+        self.queue      = deque()
+        self.forwarded  = 0
+        self.local      = 0
+        #A request of this client is being answered by the link
+        self.busy       = False
+        self._wlock     = threading.Lock()
+
+    def write(self, data):
+        with self._wlock:
+            try:
+                self.sock.sendall(data)
+            except OSError:
+                pass
+
+class _Handler(socketserver.BaseRequestHandler):
+    def handle(self):
+        self.server.gateway._serve(self.request, self.client_address)
+
+class _Server(socketserver.ThreadingTCPServer):
+    daemon_threads      = True
+    allow_reuse_address = True
+
+class Gateway(object):
+    def __init__(self, camera, address=("0.0.0.0", 5678), priorities=None, default_priority=0):
+        self.camera             = camera
+        #Client host -> priority, higher goes first
+        self.priorities         = dict(priorities or {})
+        self.default_priority   = default_priority
+        #Requests sent to the camera / answered here
+        self.forwarded          = 0
+        self.local              = 0
+        #Reply frame header, 90 for camera 1
+        self.header             = bytes((((camera.address[0] & 0x07) + 8) << 4,))
+
+        self.clients            = []
+        self._turn              = 0
+        self._queued            = 0
+        self._cond              = threading.Condition()
+        self._running           = False
+        self._worker            = None
+        self._server            = _Server(address, _Handler)
+        self._server.gateway    = self
+        self._listener          = None
+
+    @property
+    def address(self):
+        """(host, port) listened on, the real port when 0 was asked for"""
+        return self._server.server_address
+
+    def start(self):
+        if(self._worker is None):
+            self._running = True
+            self._worker = threading.Thread(target=self._run, daemon=True)
+            self._worker.start()
+            self._listener = threading.Thread(target=self._server.serve_forever, daemon=True)
+            self._listener.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        if(self._worker is not None):
+            self._worker.join()
+            self._worker = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "clients"   : len(self.clients),
+                "forwarded" : self.forwarded,
+                "local"     : self.local,
+                "queued"    : self._queued,
+            }
+
+    # ---------------------------------------------------------------- clients
+    def _serve(self, sock, address):
+        client = _Client(sock, address, self.priorities.get(address[0], self.default_priority))
+        with self._cond:
+            self.clients.append(client)
+        try:
+            first = sock.recv(4096)
+            if(first[:1] == b'{'):
+                self._serveJson(client, first)
+            elif(first):
+                self._serveRaw(client, first)
+        except OSError:
+            pass
+        finally:
+            with self._cond:
+                #Whatever it still had queued goes nowhere
+                self._queued -= len(client.queue)
+                client.queue.clear()
+                self.clients.remove(client)
+
+    def _serveRaw(self, client, data):
+        buf = bytearray()
+        while data:
+            buf += data
+            while b'\xff' in buf:
+                end = buf.index(b'\xff')
+                frame = bytes(buf[:end + 1])
+                del buf[:end + 1]
+                if(len(frame) >= 3 and frame[0] & 0xf0 == 0x80):
+                    self._request(client, frame[1:-1], self._rawReply(client))
+            data = client.sock.recv(4096)
+
+    def _rawReply(self, client):
+        def respond(status, reply, local):
+            if(not reply):
+                #Nothing came back, the closest VISCA has is "not executable"
+                reply = b'\x60\x41'
+            client.write(self.header + reply + b'\xff')
+        return respond
+
+    def _serveJson(self, client, data):
+        buf = bytearray()
+        while data:
+            buf += data
+            while b'\n' in buf:
+                end = buf.index(b'\n')
+                line = bytes(buf[:end]).strip()
+                del buf[:end + 1]
+                if(line):
+                    self._jsonRequest(client, line)
+            data = client.sock.recv(4096)
+
+    def _jsonRequest(self, client, line):
+        ident = None
+        try:
+            request = json.loads(line)
+            ident = request.get("id")
+            if("priority" in request and "cmd" not in request and "hex" not in request):
+                with self._cond:
+                    client.priority = int(request["priority"])
+                self._jsonWrite(client, {"id" : ident, "status" : stat_OK})
+                return
+            name = None
+            if("hex" in request):
+                msg = bytes.fromhex(request["hex"])
+                if(msg[:1] and msg[0] & 0xf0 == 0x80):
+                    msg = msg[1:]
+                if(msg.endswith(b'\xff')):
+                    msg = msg[:-1]
+            else:
+                name = request["cmd"]
+                msg = visca.message(name, *request.get("args", ()))
+        except Exception as error:
+            self._jsonWrite(client, {"id" : ident, "status" : stat_FAIL, "error" : repr(error)})
+            return
+        if(name is None):
+            name = _inquiry_names.get(msg)
+
+        def respond(status, reply, local):
+            out = {"id" : ident, "status" : status, "reply" : reply.hex() if reply else None, "local" : local}
+            if(name in visca.inquiries and status == stat_OK):
+                value = visca.parse(name, reply)
+                out["value"] = value._asdict() if hasattr(value, "_asdict") else value
+            self._jsonWrite(client, out)
+        self._request(client, msg, respond)
+
+    def _jsonWrite(self, client, obj):
+        client.write(json.dumps(obj).encode("utf-8") + b'\n')
+
+    # ------------------------------------------------------------------- link
+    def _cached(self, msg):
+        """Reply to msg from the shadow state, None if it needs the link"""
+        camera = self.camera
+        if(msg[:1] == b'\x09'):
+            name = _inquiry_names.get(msg)
+            return None if name is None else cachedReply(camera.state, name)
+        if(camera.shadow and camera.state.current(msg)):
+            return b'\x50'
+        return None
+
+    def _request(self, client, msg, respond):
+        """Answers msg here if the client waits for nothing else and the shadow
+        state can, else queues it behind the client's other requests"""
+        with self._cond:
+            idle = not client.queue and not client.busy
+        reply = self._cached(msg) if idle else None
+        if(reply is not None):
+            with self._cond:
+                self.local += 1
+                client.local += 1
+            respond(stat_OK, reply, True)
+            return
+        with self._cond:
+            client.queue.append((msg, respond))
+            self._queued += 1
+            self._cond.notify()
+
+    def _next(self):
+        """Oldest request of the next client in turn at the highest waiting priority"""
+        clients = self.clients
+        waiting = [c.priority for c in clients if c.queue]
+        top = max(waiting)
+        count = len(clients)
+        for k in range(count):
+            index = (self._turn + k) % count
+            client = clients[index]
+            if(client.queue and client.priority == top):
+                self._turn = index + 1
+                self._queued -= 1
+                client.busy = True
+                return client, client.queue.popleft()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._running and not self._queued:
+                    self._cond.wait()
+                if(not self._running):
+                    break
+                client, (msg, respond) = self._next()
+
+            try:
+                status, reply, local = self._forward(msg)
+            except Exception as error:
+                #Serial error or closed port: this request fails, the gateway goes on
+                print("Gateway request failed: %r" % (error,))
+                status, reply, local = stat_FAIL, None, False
+            with self._cond:
+                if(local):
+                    self.local += 1
+                    client.local += 1
+                else:
+                    self.forwarded += 1
+                    client.forwarded += 1
+            try:
+                respond(status, reply, local)
+            except Exception as error:
+                print("Gateway reply failed: %r" % (error,))
+            finally:
+                with self._cond:
+                    client.busy = False
+
+    def _forward(self, msg):
+        """Answers msg from the cache or over the link, returns (status, reply, local)"""
+        camera = self.camera
+        #Earlier requests of this client are done, the state is as they left it
+        reply = self._cached(msg)
+        if(reply is not None):
+            return stat_OK, reply, True
+        if(msg[:1] == b'\x09'):
+            status, reply = camera.transact(msg)
+            if(camera.recovery is not None):
+                camera.recovery.record(camera, status)
+            name = _inquiry_names.get(msg)
+            if(status == stat_OK and name is not None):
+                camera.state.seed(name, visca.parse(name, reply))
+            return status, reply, False
+        #Shadow state, retries and speed changes as for the camera's own methods
+        replies = []
+        status = camera._execute([(msg, "Gateway " + commandName(msg))], replies=replies)
+        reply = replies[0] if replies else None
+        if(status == stat_OK and not reply):
+            reply = b'\x50'
+        return status, reply, False
@@ -0,0 +1,208 @@
+import json
+import os
+import threading
+from bisect import bisect_left
+
+from . import visca
+
+# Link instrumentation. Off by default; a Controller records into it once
+# one is attached:
+#
+#   cam.metrics = Metrics({"port": "/dev/ttyUSB0"})
+#   ...
+#   cam.metrics.write("/var/lib/node_exporter/camera.prom")   # Prometheus text
+#   cam.metrics.write("camera.json")                          # JSON snapshot
+#
+# Per command type (named after visca.commands / visca.inquiries): a
+# latency histogram from write to final reply, and counts of completions,
+# errors and timeouts. Per link: bytes written and read, and the VISCA error
+# codes the camera answered with. Several cameras go into one exposition
+# with prometheus([cam.metrics for cam in ...]).
+
+#Histogram bucket upper bounds in seconds, +Inf is implied
+BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0, 10.0, 20.0)
+
+#VISCA error code -> label
+ERROR_NAMES = {
+    0x01 : "length",
+    0x02 : "syntax",
+    0x03 : "buffer_full",
+    0x04 : "cancelled",
+    0x05 : "no_socket",
+    0x41 : "not_executable",
+}
+
+#Fixed message -> name, (prefix, length) of parameterised messages -> name
+_fixed_names = {}
+_param_names = {}
+for _name, (_prefix, _types, _suffix) in visca.commands.items():
+    if(_types):
+        _size = len(_prefix) + sum(visca._width[t] for t in _types) + len(_suffix)
+        _param_names[(_prefix, _size)] = _name
+    else:
+        _fixed_names[_prefix + _suffix] = _name
+for _name, (_msg, _fields) in visca.inquiries.items():
+    _fixed_names[_msg] = _name
+_prefix_sizes = sorted({len(p) for p, s in _param_names}, reverse=True)
+
+def commandName(msg):
+    """Name of the command or inquiry msg is, "other" if it is none of them"""
+    name = _fixed_names.get(msg)
+    if(name is None):
+        size = len(msg)
+        for n in _prefix_sizes:
+            name = _param_names.get((msg[:n], size))
+            if(name is not None):
+                break
+    return name or "other"
+
+class Histogram(object):
+    __slots__ = ('counts', 'sum', 'count')
+
+    def __init__(self):
+        #Per bucket, the last one is +Inf; cumulated on export
+        self.counts     = [0]*(len(BUCKETS) + 1)
+        self.sum        = 0.0
+        self.count      = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """Upper bucket bound below which fraction q of the values are"""
+        rank = q*self.count
+        total = 0
+        for bound, n in zip(BUCKETS + (float("inf"),), self.counts):
+            total += n
+            if(total >= rank and total > 0):
+                return bound
+        return float("nan")
+
+class Metrics(object):
+    def __init__(self, labels=None):
+        #Constant labels of every series, e.g. {"port": "/dev/ttyUSB0"}
+        self.labels         = dict(labels or {})
+        self.latency        = {}    #command -> Histogram
+        self.outcomes       = {}    #command -> [ok, error, timeout]
+        self.errors         = dict.fromkeys(list(ERROR_NAMES.values()) + ["other"], 0)
+        self.bytes_sent     = 0
+        self.bytes_received = 0
+        self._lock          = threading.Lock()
+
+    def observe(self, msg, seconds, reply):
+        """Records one finished request: msg as sent, reply without address
+        and terminator, None after a timeout"""
+        name = commandName(msg)
+        with self._lock:
+            hist = self.latency.get(name)
+            if(hist is None):
+                hist = self.latency[name] = Histogram()
+                self.outcomes[name] = [0, 0, 0]
+            hist.observe(seconds)
+            if(reply is None):
+                self.outcomes[name][2] += 1
+            elif(reply and reply[0] & 0xf0 == 0x50):
+                self.outcomes[name][0] += 1
+            else:
+                self.outcomes[name][1] += 1
+                code = reply[1] if len(reply) > 1 and reply[0] & 0xf0 == 0x60 else None
+                self.errors[ERROR_NAMES.get(code, "other")] += 1
+
+    def traffic(self, sent=0, received=0):
+        with self._lock:
+            self.bytes_sent += sent
+            self.bytes_received += received
+
+    def reset(self):
+        with self._lock:
+            self.latency.clear()
+            self.outcomes.clear()
+            self.errors = dict.fromkeys(self.errors, 0)
+            self.bytes_sent = self.bytes_received = 0
+
+    # ------------------------------------------------------------------ export
+    def snapshot(self):
+        """Everything as plain dicts, latencies in seconds"""
+        with self._lock:
+            commands = {}
+            for name, hist in self.latency.items():
+                ok, error, timeout = self.outcomes[name]
+                commands[name] = {
+                    "count"     : hist.count,
+                    "ok"        : ok,
+                    "error"     : error,
+                    "timeout"   : timeout,
+                    "sum"       : hist.sum,
+                    "mean"      : hist.sum/hist.count,
+                    "p50"       : hist.quantile(0.5),
+                    "p99"       : hist.quantile(0.99),
+                    "buckets"   : dict(zip([str(b) for b in BUCKETS] + ["+Inf"], hist.counts)),
+                }
+            return {
+                "labels"            : self.labels,
+                "commands"          : commands,
+                "errors"            : dict(self.errors),
+                "bytes_sent"        : self.bytes_sent,
+                "bytes_received"    : self.bytes_received,
+            }
+
+    def prometheus(self):
+        return prometheus([self])
+
+    def write(self, path):
+        """Writes a JSON snapshot (.json) or Prometheus text (anything else)"""
+        if(path.endswith(".json")):
+            text = json.dumps(self.snapshot(), indent=4)
+        else:
+            text = self.prometheus()
+        #Renamed into place, so a scraper never reads half a file
+        temp = path + ".tmp"
+        with open(temp, "w") as f:
+            f.write(text)
+        os.replace(temp, path)
+
+def _labels(base, **extra):
+    pairs = dict(base, **extra)
+    if(not pairs):
+        return ""
+    text = ",".join('%s="%s"' % (k, str(v).replace("\\", "\\\\").replace('"', '\\"')) for k, v in pairs.items())
+    return "{" + text + "}"
+
+def prometheus(metrics):
+    """Prometheus text exposition of several Metrics, told apart by their labels"""
+    snaps = [m.snapshot() for m in metrics]
+    out = []
+
+    out.append("# HELP tandberg_command_latency_seconds Time from write to final reply")
+    out.append("# TYPE tandberg_command_latency_seconds histogram")
+    for snap in snaps:
+        for name, cmd in sorted(snap["commands"].items()):
+            total = 0
+            for bound, n in cmd["buckets"].items():
+                total += n
+                out.append("tandberg_command_latency_seconds_bucket%s %d" %
+                           (_labels(snap["labels"], command=name, le=bound), total))
+            out.append("tandberg_command_latency_seconds_sum%s %r" % (_labels(snap["labels"], command=name), cmd["sum"]))
+            out.append("tandberg_command_latency_seconds_count%s %d" % (_labels(snap["labels"], command=name), cmd["count"]))
+
+    out.append("# HELP tandberg_commands_total Finished requests by outcome")
+    out.append("# TYPE tandberg_commands_total counter")
+    for snap in snaps:
+        for name, cmd in sorted(snap["commands"].items()):
+            for outcome in ("ok", "error", "timeout"):
+                out.append("tandberg_commands_total%s %d" % (_labels(snap["labels"], command=name, outcome=outcome), cmd[outcome]))
+
+    out.append("# HELP tandberg_errors_total Error replies by VISCA error code")
+    out.append("# TYPE tandberg_errors_total counter")
+    for snap in snaps:
+        for code, n in snap["errors"].items():
+            out.append("tandberg_errors_total%s %d" % (_labels(snap["labels"], code=code), n))
+
+    for key, text in (("bytes_sent", "Bytes written to the camera"), ("bytes_received", "Bytes read from the camera")):
+        out.append("# HELP tandberg_%s_total %s" % (key, text))
+        out.append("# TYPE tandberg_%s_total counter" % key)
+        for snap in snaps:
+            out.append("tandberg_%s_total%s %d" % (key, _labels(snap["labels"]), snap[key]))
+    return "\n".join(out) + "\n"
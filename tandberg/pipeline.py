@@ -0,0 +1,226 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+from .tandberg import Controller, replyStatus, stat_OK, stat_FAIL
+from .visca import fixed
+
+# Pipelined command execution. A reader thread matches every reply to the
+# command it belongs to, so up to two commands can be in the camera's
+# buffers while inquiries keep flowing.
+#
+# Reply matching:
+#   4y        ACK, the oldest unacknowledged command now runs in socket y
+#   5y        completion of the command in socket y. A camera without ACKs
+#             (the PrecisionHD, always y = 0) completes commands in order
+#   50 data   inquiry reply, inquiries are answered in order
+#   6y code   error for socket y, or for the newest unacknowledged request
+#             when y = 0: such errors are raised as soon as a request
+#             arrives, so they belong to the one written last (on the
+#             PrecisionHD, without ACKs, every request is unacknowledged)
+
+class _Request(object):
+    __slots__ = ('cmd', 'future', 'inquiry', 'socket', 'sent')
+
+    def __init__(self, cmd, future):
+        self.cmd        = cmd
+        self.future     = future
+        self.inquiry    = cmd[0] == 9
+        self.socket     = None
+        #time.perf_counter() of the write, only kept for metrics
+        self.sent       = None
+
+class SocketTracker(object):
+    """Matches camera replies to the outstanding requests of one camera"""
+    def __init__(self):
+        self.pending = deque()
+
+    def add(self, request):
+        self.pending.append(request)
+
+    def __len__(self):
+        return len(self.pending)
+
+    def _take(self, match, newest=False):
+        for request in (reversed(self.pending) if newest else self.pending):
+            if(match(request)):
+                self.pending.remove(request)
+                return request
+        return None
+
+    def dispatch(self, resp):
+        """Routes one reply, returns the finished request or None"""
+        kind    = resp[0] & 0xf0
+        socket  = resp[0] & 0x0f
+
+        if(kind == 0x40):
+            for request in self.pending:
+                if(not request.inquiry and request.socket is None):
+                    request.socket = socket
+                    break
+            return None
+
+        if(kind == 0x50):
+            if(len(resp) > 1):
+                return self._take(lambda r : r.inquiry)
+            if(socket != 0):
+                request = self._take(lambda r : r.socket == socket)
+                if(request is not None):
+                    return request
+            return self._take(lambda r : not r.inquiry)
+
+        if(kind == 0x60):
+            if(socket != 0):
+                request = self._take(lambda r : r.socket == socket)
+                if(request is not None):
+                    return request
+            return self._take(lambda r : r.socket is None, newest=True)
+
+        return None
+
+    def discard(self, future):
+        """Drops the request of future, e.g. after giving up on it"""
+        request = self._take(lambda r : r.future is future)
+        if(request is not None and not request.future.done()):
+            request.future.set_result(stat_FAIL)
+
+    def failAll(self):
+        while self.pending:
+            request = self.pending.popleft()
+            if(not request.future.done()):
+                request.future.set_result(stat_FAIL)
+
+class PipelinedController(Controller):
+    def __init__(self, max_inflight=2, timeout=20):
+        super().__init__()
+        #Commands allowed in the camera at once (VISCA gives two buffers)
+        self.max_inflight   = max_inflight
+        #How long send() waits for a completion
+        self.timeout        = timeout
+
+        self.tracker        = SocketTracker()
+        self._slots         = threading.BoundedSemaphore(max_inflight)
+        self._lock          = threading.Lock()
+        self._reader        = None
+        self._running       = False
+
+    def connect(self, inp):
+        status = self._open(inp)
+        if(status == stat_OK):
+            #Short read timeout so the reader notices disconnect
+            self.ser.timeout = 0.1
+            self._running = True
+            self._reader = threading.Thread(target=self._readLoop, daemon=True)
+            self._reader.start()
+            #Needs the reader running
+            self.sync()
+        return status
+
+    def disconnect(self):
+        self._running = False
+        if(self._reader is not None):
+            self._reader.join()
+            self._reader = None
+        with self._lock:
+            self.tracker.failAll()
+        return super().disconnect()
+
+    def submit(self, cmd, callback=None):
+        """Sends cmd without waiting, the returned Future resolves to its status
+
+        The reply bytes (address and terminator stripped) are left in
+        future.reply. callback, if given, is called with the future when done.
+        """
+        future = Future()
+        future.reply = None
+        if(callback is not None):
+            future.add_done_callback(callback)
+        if(self.ser is None):
+            future.set_result(stat_FAIL)
+            return future
+
+        request = _Request(cmd, future)
+        if(not request.inquiry):
+            #Blocks while both command buffers are taken
+            self._slots.acquire()
+            future.add_done_callback(lambda f : self._slots.release())
+
+        metrics = self.metrics
+        if(metrics is not None):
+            request.sent = time.perf_counter()
+        with self._lock:
+            self.tracker.add(request)
+            frame = self.address + cmd + b'\xff'
+            self.ser.write(frame)
+        if(metrics is not None):
+            metrics.traffic(sent=len(frame))
+        return future
+
+    def send(self, cmd):
+        """Sends a command and waits for its completion, returns the success code"""
+        status, reply = self.transact(cmd)
+        return status
+
+    def transact(self, cmd):
+        """Sends a command, returns its status and reply (address and terminator stripped)"""
+        future = self.submit(cmd)
+        try:
+            status = future.result(self.timeout)
+        except Exception:
+            print("Receive timeout")
+            #A late reply must not be matched to the next request
+            with self._lock:
+                self.tracker.discard(future)
+            if(self.metrics is not None):
+                self.metrics.observe(cmd, self.timeout, None)
+            return stat_FAIL, None
+        return status, future.reply
+
+    def probe(self, timeout=0.25):
+        """True if the camera answers a power inquiry within timeout seconds"""
+        future = self.submit(fixed["q_pwr"])
+        try:
+            status = future.result(timeout)
+        except Exception:
+            with self._lock:
+                self.tracker.discard(future)
+            return False
+        reply = future.reply
+        return status == stat_OK and reply is not None and len(reply) == 2
+
+    def idle(self):
+        """True if an inquiry would not queue behind other requests.
+        Running commands do not count, the camera answers inquiries meanwhile"""
+        with self._lock:
+            pending = self.tracker.pending
+            if(len(pending) >= self.max_inflight):
+                return False
+            return not any(r.inquiry for r in pending)
+
+    def _readLoop(self):
+        while self._running:
+            try:
+                frame = self.readFrame()
+            except Exception as error:
+                if(self._running):
+                    print("Reader stopped: %r" % error)
+                    with self._lock:
+                        self.tracker.failAll()
+                break
+            if(frame is not None and len(frame) >= 3):
+                self._dispatch(frame)
+
+    def _dispatch(self, frame):
+        """Completes the request a reply frame belongs to"""
+        resp = frame[1:-1]
+        with self._lock:
+            request = self.tracker.dispatch(resp)
+        if(request is None):
+            return
+        if(request.inquiry and self.debug):
+            print([frame[i:i + 1].hex() for i in range(len(frame))])
+        if(request.sent is not None and self.metrics is not None):
+            self.metrics.observe(request.cmd, time.perf_counter() - request.sent, resp)
+        request.future.reply = resp
+        request.future.set_result(replyStatus(resp))
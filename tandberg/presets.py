@@ -0,0 +1,208 @@
+import json
+import os
+import struct
+
+from .pipeline import PipelinedController
+from .tandberg import stat_OK, stat_FAIL
+from .visca import encoders, fixed
+
+# Named camera setups, position and picture together:
+#
+#   library = PresetLibrary.load("studio.presets")     # empty if it does not exist yet
+#   library.save(cam, "wide")                           # reads the camera and stores it
+#   library.recall(cam, "wide")
+#
+# A preset keeps the state the camera reported (state keys as in
+# state.CameraState) and the messages that restore it, encoded once when the
+# preset is made. Recall sends only those messages that would change the
+# cached camera state, all at once on a PipelinedController.
+#
+# AE iris and gain have no inquiry; they are stored when the shadow state
+# knows them from an earlier ae_auto.
+#
+# File layout, all lengths unsigned and big endian:
+#   "TBPS" version(1) count(2)
+#   per preset: name length(1) name, state length(2) state JSON,
+#               message count(1), per message: length(1) message
+
+#Inquiries that read a preset back from the camera
+CAPTURE_INQUIRIES = (
+    "q_pt", "q_zoompos", "q_fPos", "q_fMode", "q_wbMode", "q_wbTable", "q_aeMode",
+    "q_blacklight", "q_mirror", "q_flip", "q_gMode", "q_gTable",
+)
+
+#State keys kept in a preset
+PRESET_KEYS = (
+    "pan", "tilt", "zoom", "focus", "fMode", "wbMode", "wbTable", "aeMode", "iris", "gain",
+    "gMode", "gTable", "backlight", "mirror", "flip",
+)
+
+_MAGIC      = b'TBPS'
+_VERSION    = 1
+
+def compileState(state):
+    """Messages that bring the camera to state, in the order they must run"""
+    get = state.get
+    out = []
+    #Tables and levels go in before switching to manual, like Controller does
+    for mode, table, kind, encoder in (("wbMode", "wbTable", "wb", "wb_table"),
+                                       ("gMode", "gTable", "gamma", "gamma_table")):
+        if(get(mode) is False and get(table) is not None):
+            out.append(encoders[encoder](get(table)))
+        if(get(mode) is not None):
+            out.append(fixed[kind + ("_auto" if get(mode) else "_manual")])
+    if(get("aeMode") is False):
+        for key in ("iris", "gain"):
+            if(get(key) is not None):
+                out.append(encoders[key](get(key)))
+    if(get("aeMode") is not None):
+        out.append(fixed["ae_auto" if get("aeMode") else "ae_manual"])
+    for key in ("backlight", "mirror", "flip"):
+        if(get(key) is not None):
+            out.append(fixed[key + ("_on" if get(key) else "_off")])
+
+    #Focus mode first, a manual focus position is only taken with autofocus off
+    if(get("fMode") is not None):
+        out.append(fixed["focus_auto_" + ("on" if get("fMode") else "off")])
+    if(None not in (get("pan"), get("tilt"))):
+        if(get("fMode") is False and None not in (get("zoom"), get("focus"))):
+            out.append(encoders["ptzf"](get("pan"), get("tilt"), get("zoom"), get("focus")))
+        else:
+            out.append(encoders["pt_direct"](0x0f, 0x0f, get("pan"), get("tilt")))
+            if(get("zoom") is not None):
+                out.append(encoders["zoom_direct"](get("zoom")))
+    return out
+
+class Preset(object):
+    __slots__ = ('name', 'state', 'messages')
+
+    def __init__(self, name, state, messages=None):
+        self.name       = name
+        self.state      = state
+        self.messages   = compileState(state) if messages is None else messages
+
+    def __repr__(self):
+        return "Preset(%r, %r)" % (self.name, self.state)
+
+class PresetLibrary(object):
+    def __init__(self, path=None):
+        #File written after every change, None keeps the library in memory
+        self.path       = path
+        self.presets    = {}
+
+    def __len__(self):
+        return len(self.presets)
+
+    def __contains__(self, name):
+        return name in self.presets
+
+    def __getitem__(self, name):
+        return self.presets[name]
+
+    def names(self):
+        return sorted(self.presets)
+
+    # ----------------------------------------------------------------- camera
+    def save(self, camera, name):
+        """Reads the camera's current setup into preset name, returns the success code"""
+        for inquiry in CAPTURE_INQUIRIES:
+            #inquire() seeds camera.state, which the preset is taken from
+            if(camera.inquire(inquiry) is None):
+                print("Preset save : FAILED")
+                return stat_FAIL
+        state = {}
+        for key in PRESET_KEYS:
+            value = camera.state.get(key)
+            if(value is not None):
+                state[key] = value
+        self.add(Preset(name, state))
+        return stat_OK
+
+    def recall(self, camera, name):
+        """Brings the camera to preset name, returns the success code"""
+        preset = self.presets.get(name)
+        if(preset is None):
+            print("No preset " + name)
+            return stat_FAIL
+        #Only what differs from the cached camera state goes out. With shadow on,
+        #_execute checks that itself; checking here too would count it twice
+        pipelined = isinstance(camera, PipelinedController)
+        if(pipelined or not camera.shadow):
+            todo = [msg for msg in preset.messages if not camera.state.current(msg)]
+        else:
+            todo = preset.messages
+        if(not pipelined):
+            return camera._execute([(msg, "Preset status") for msg in todo])
+
+        futures = [(msg, camera.submit(msg)) for msg in todo]
+        status = stat_OK
+        for msg, future in futures:
+            try:
+                ok = future.result(camera.timeout) == stat_OK
+            except Exception:
+                ok = False
+            if(ok):
+                camera.state.update(msg)
+            else:
+                camera.state.forget(msg)
+                status = stat_FAIL
+        if(status != stat_OK):
+            print("Preset status : FAILED")
+        return status
+
+    # ----------------------------------------------------------------- storage
+    def add(self, preset):
+        self.presets[preset.name] = preset
+        if(self.path is not None):
+            self.write()
+
+    def delete(self, name):
+        if(self.presets.pop(name, None) is not None and self.path is not None):
+            self.write()
+
+    def write(self, path=None):
+        path = path or self.path
+        out = [_MAGIC, struct.pack(">BH", _VERSION, len(self.presets))]
+        for preset in self.presets.values():
+            name = preset.name.encode("utf-8")
+            state = json.dumps(preset.state, separators=(",", ":")).encode("utf-8")
+            out.append(struct.pack(">B", len(name)) + name)
+            out.append(struct.pack(">H", len(state)) + state)
+            out.append(struct.pack(">B", len(preset.messages)))
+            for msg in preset.messages:
+                out.append(struct.pack(">B", len(msg)) + msg)
+        #Written aside and renamed, so a crash never leaves half a library
+        temp = path + ".tmp"
+        with open(temp, "wb") as f:
+            f.write(b"".join(out))
+        os.replace(temp, path)
+
+    @classmethod
+    def load(cls, path):
+        """Library stored at path, empty if there is no file yet"""
+        library = cls(path)
+        if(not os.path.exists(path)):
+            return library
+        with open(path, "rb") as f:
+            data = f.read()
+        if(data[:4] != _MAGIC):
+            raise ValueError(path + " is not a preset library")
+        version, count = struct.unpack_from(">BH", data, 4)
+        if(version != _VERSION):
+            raise ValueError("Unknown preset library version %d" % version)
+        pos = 7
+        for k in range(count):
+            size = data[pos]
+            name = data[pos + 1:pos + 1 + size].decode("utf-8")
+            pos += 1 + size
+            size, = struct.unpack_from(">H", data, pos)
+            state = json.loads(data[pos + 2:pos + 2 + size])
+            pos += 2 + size
+            messages = []
+            pos += 1
+            for m in range(data[pos - 1]):
+                size = data[pos]
+                messages.append(data[pos + 1:pos + 1 + size])
+                pos += 1 + size
+            library.presets[name] = Preset(name, state, messages)
+        return library
@@ -0,0 +1,75 @@
+import time
+
+from .tandberg import stat_OK, stat_FAIL
+
+# Opt-in escalation for a camera that keeps failing. The camera sometimes
+# refuses to move until it is rebooted, so after threshold failed commands
+# in a row the policy tries the next step:
+#
+#   clear   IF_Clear, cancels whatever the camera is stuck on
+#   reset   pan/tilt reset, recalibrates the motors
+#   reboot  reboot, then reconnect (connect re-detects the baud rate)
+#
+# Any successful command drops back to the first step.
+#
+#   cam.recovery = RecoveryPolicy(threshold=3)
+
+STEPS = ("clear", "reset", "reboot")
+
+class RecoveryPolicy(object):
+    def __init__(self, threshold=3, reboot_timeout=60):
+        #Consecutive failures before the next step is taken
+        self.threshold      = threshold
+        #Seconds a rebooted camera gets to answer again
+        self.reboot_timeout = reboot_timeout
+        self.failures       = 0
+        #Index of the next step
+        self.level          = 0
+        #(time.monotonic(), step, status) of every step taken
+        self.log            = []
+        self._active        = False
+
+    def record(self, camera, status):
+        """Called by Controller._execute and Controller.inquire with the final
+        status of every command and inquiry"""
+        if(self._active):
+            #Commands sent by a recovery step itself
+            return
+        if(status == stat_OK):
+            self.failures = 0
+            self.level = 0
+            return
+
+        self.failures += 1
+        if(self.failures < self.threshold):
+            return
+        self.failures = 0
+        step = STEPS[min(self.level, len(STEPS) - 1)]
+        self.level += 1
+
+        print("Camera keeps failing, trying " + step)
+        self._active = True
+        try:
+            status = getattr(self, "_" + step)(camera)
+        finally:
+            self._active = False
+        self.log.append((time.monotonic(), step, status))
+
+    def _clear(self, camera):
+        return camera.clear()
+
+    def _reset(self, camera):
+        return camera.reset()
+
+    def _reboot(self, camera):
+        interface = camera.interface
+        camera.reboot()
+        camera.disconnect()
+        deadline = time.monotonic() + self.reboot_timeout
+        while time.monotonic() < deadline:
+            if(camera.connect(interface) == stat_OK and camera.baudrate is not None):
+                return stat_OK
+            camera.disconnect()
+            time.sleep(1)
+        print("Reconnect after reboot : FAILED")
+        return stat_FAIL
@@ -0,0 +1,244 @@
+import time
+
+from . import visca
+from .pipeline import PipelinedController
+from .tandberg import Controller, _speed_changes, stat_OK, stat_FAIL
+
+# Batch runs of the command lines typed in tests/basic_test.py:
+#
+#   script = Script.load("room_setup.txt")     # ValueError lists every bad line
+#   print(script.dump())                        # dry run, the frames each line sends
+#   results, total = script.run(cam)
+#
+# Script lines, one per line, '#' starts a comment:
+#   ptzf 408 135 0 0            any command of COMMANDS with its arguments
+#   query q_pt
+#   wait 1.5                    pause for 1.5 seconds
+#   sync                        wait until everything sent so far completed
+#
+# Every line is checked and encoded when the script is loaded, by running
+# the Controller method on an encoder that records messages instead of
+# sending them, so nothing goes out unless the whole script is valid.
+# Toggles are resolved then too, against the camera state given to load().
+#
+# On a PipelinedController the lines go out back to back, the camera
+# buffering up to two commands; on a Controller each waits for its
+# completion. Speed changes and reboots always wait for the link to empty.
+
+#Command name -> fn(camera, args), as in the typed mode of basic_test
+COMMANDS = {
+    "stop"          : lambda c, x : c.steer(["stop"]),
+    "steer"         : lambda c, x : c.steer(x),
+    "clear"         : lambda c, x : c.clear(),
+    "address_set"   : lambda c, x : c.address_set(x),
+    "power"         : lambda c, x : c.power(x),
+    "vid_format"    : lambda c, x : c.vid_format(x),
+    "wb_auto"       : lambda c, x : c.wb_auto(x),
+    "ae_auto"       : lambda c, x : c.ae_auto(x),
+    "backlight"     : lambda c, x : c.backlight(x),
+    "mirror"        : lambda c, x : c.mirror(x),
+    "flip"          : lambda c, x : c.flip(x),
+    "gamma_auto"    : lambda c, x : c.gamma_auto(x),
+    "mm_detect"     : lambda c, x : c.mm_detect(x),
+    "call_led"      : lambda c, x : c.call_led(x),
+    "pwr_led"       : lambda c, x : c.pwr_led(x),
+    "bestView"      : lambda c, x : c.bestView(x),
+    "zoomSpeed"     : lambda c, x : c.setZoomSpeed(x),
+    "focusSpeed"    : lambda c, x : c.setFocusSpeed(x),
+    "zoom"          : lambda c, x : c.zoomFocus(["zoom"] + x),
+    "focus"         : lambda c, x : c.zoomFocus(["focus"] + x),
+    "zf"            : lambda c, x : c.zoomFocus_direct(x),
+    "focus_auto"    : lambda c, x : c.focus_auto(x),
+    "reset"         : lambda c, x : c.reset(),
+    "reboot"        : lambda c, x : c.reboot(),
+    "serialSpeed"   : lambda c, x : c.serialSpeed(x),
+    "pt"            : lambda c, x : c.pt_direct(x),
+    "ptzf"          : lambda c, x : c.ptzf(x),
+    "query"         : lambda c, x : c.qCmd(x),
+}
+
+class _Encoder(Controller):
+    """Controller that collects (message, name, inquiry name) steps instead of sending"""
+    def __init__(self, values=None):
+        super().__init__()
+        self.state.values.update(values or {})
+        self.steps = []
+
+    def _execute(self, steps, delay=0):
+        for msg, name in steps:
+            self.steps.append((msg, name, None))
+            #Later toggles in the script see this one
+            self.state.update(msg)
+        return stat_OK
+
+    def inquire(self, name):
+        self.steps.append((visca.inquiries[name][0], name, name))
+        return None
+
+class Line(object):
+    __slots__ = ('number', 'text', 'kind', 'steps', 'seconds')
+
+    def __init__(self, number, text, kind, steps=(), seconds=0.0):
+        self.number     = number
+        self.text       = text
+        #"command", "wait" or "sync"
+        self.kind       = kind
+        #(message, name, inquiry name or None)
+        self.steps      = list(steps)
+        self.seconds    = seconds
+
+class Result(object):
+    __slots__ = ('line', 'status', 'latency', 'value')
+
+    def __init__(self, line, status=stat_OK, latency=0.0, value=None):
+        self.line       = line
+        self.status     = status
+        #Seconds from the first write of the line to its last completion
+        self.latency    = latency
+        #Decoded reply of a query line, see visca.parse
+        self.value      = value
+
+    @property
+    def ok(self):
+        return self.status == stat_OK
+
+    def __repr__(self):
+        return "Result(%d %r, status=%d, latency=%.3f, value=%r)" % (self.line.number, self.line.text, self.status, self.latency, self.value)
+
+class Script(object):
+    def __init__(self, lines):
+        self.lines = lines
+
+    @classmethod
+    def parse(cls, text, state=None):
+        """Script of text; state, e.g. camera.state.values, resolves toggles"""
+        encoder = _Encoder(state)
+        lines = []
+        errors = []
+        for number, raw in enumerate(text.splitlines(), 1):
+            words = raw.split("#", 1)[0].split()
+            if(not words):
+                continue
+            cmd, args = words[0], words[1:]
+            try:
+                if(cmd == "wait"):
+                    seconds = float(args[0])
+                    if(seconds < 0):
+                        raise ValueError("negative wait")
+                    lines.append(Line(number, raw.strip(), "wait", seconds=seconds))
+                elif(cmd == "sync"):
+                    lines.append(Line(number, raw.strip(), "sync"))
+                elif(cmd not in COMMANDS):
+                    raise ValueError("unknown command " + cmd)
+                else:
+                    encoder.steps = []
+                    COMMANDS[cmd](encoder, args)
+                    lines.append(Line(number, raw.strip(), "command", encoder.steps))
+            except Exception as error:
+                errors.append("line %d: %s (%s)" % (number, raw.strip(), error))
+        if(errors):
+            raise ValueError("\n".join(errors))
+        return cls(lines)
+
+    @classmethod
+    def load(cls, path, state=None):
+        with open(path) as f:
+            return cls.parse(f.read(), state)
+
+    def dump(self, address=b'\x81'):
+        """What a run would do, line by line with the frames it writes"""
+        out = []
+        for line in self.lines:
+            frames = " ".join((address + msg + b'\xff').hex() for msg, name, inquiry in line.steps)
+            out.append("%4d  %-32s %s" % (line.number, line.text, frames if line.kind == "command" else ""))
+        return "\n".join(out)
+
+    # ------------------------------------------------------------------- run
+    def run(self, camera):
+        """Runs every line, returns ([Result per command line], total seconds)"""
+        pipelined = isinstance(camera, PipelinedController)
+        results = []
+        pending = []
+        start = time.perf_counter()
+        for line in self.lines:
+            if(line.kind == "wait"):
+                time.sleep(line.seconds)
+                continue
+            if(line.kind == "sync"):
+                self._finish(camera, pending)
+                continue
+            result = Result(line)
+            results.append(result)
+            if(pipelined and not any(msg in _speed_changes for msg, name, inquiry in line.steps)):
+                pending.append((result, time.perf_counter(), self._submit(camera, line)))
+            else:
+                self._finish(camera, pending)
+                self._execute(camera, line, result)
+        self._finish(camera, pending)
+        return results, time.perf_counter() - start
+
+    def _execute(self, camera, line, result):
+        """One line on a blocking link, steps in order until one fails"""
+        begin = time.perf_counter()
+        for msg, name, inquiry in line.steps:
+            if(inquiry):
+                status, reply = camera.transact(msg)
+                if(status == stat_OK):
+                    result.value = visca.parse(inquiry, reply)
+                    if(result.value is None):
+                        #Completed, but the reply does not decode
+                        status = stat_FAIL
+                    else:
+                        camera.state.seed(inquiry, result.value)
+                if(camera.recovery is not None):
+                    camera.recovery.record(camera, status)
+            else:
+                #Shadow state, retries and speed changes as in the Controller methods
+                status = camera._execute([(msg, name)])
+            if(status != stat_OK):
+                result.status = stat_FAIL
+                break
+        result.latency = time.perf_counter() - begin
+
+    def _submit(self, camera, line):
+        futures = []
+        for msg, name, inquiry in line.steps:
+            if(not inquiry):
+                if(camera.shadow and camera.state.current(msg)):
+                    continue
+                #Later lines are checked against this one before it completes,
+                #_finish forgets it again if it fails
+                camera.state.update(msg)
+            future = camera.submit(msg)
+            #Completion time, for the line's latency
+            future.add_done_callback(lambda f : setattr(f, "finished", time.perf_counter()))
+            futures.append((msg, name, inquiry, future))
+        return futures
+
+    def _finish(self, camera, pending):
+        """Waits for the submitted lines and fills in their results"""
+        for result, begin, futures in pending:
+            end = begin
+            for msg, name, inquiry, future in futures:
+                try:
+                    ok = future.result(camera.timeout) == stat_OK
+                except Exception:
+                    ok = False
+                if(ok and inquiry):
+                    result.value = visca.parse(inquiry, future.reply)
+                    #Completed, but the reply does not decode
+                    ok = result.value is not None
+                if(ok):
+                    end = max(end, future.finished)
+                    if(inquiry):
+                        camera.state.seed(inquiry, result.value)
+                    else:
+                        camera.state.update(msg)
+                else:
+                    end = time.perf_counter()
+                    if(not inquiry):
+                        camera.state.forget(msg)
+                    print(name + " : FAILED")
+                    result.status = stat_FAIL
+            result.latency = end - begin
+        del pending[:]
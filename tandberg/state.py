@@ -0,0 +1,170 @@
+import threading
+
+from . import visca
+from .visca import fixed, fromNibbles
+
+# Shadow model of the camera. Controller._execute looks every outgoing
+# message up here: a setter whose target equals the cached value completes
+# without touching the link, a successful one updates the cache, a failed
+# one forgets the value. Inquiries refresh it, and Controller.sync() seeds
+# it with one bulk inquiry at connect.
+#
+# Only what the camera reported or acknowledged is cached; anything not
+# known is simply sent.
+
+#Fixed command -> (state key, value)
+_fixed_effects = {}
+for _kind, _key in (("wb", "wbMode"), ("ae", "aeMode"), ("gamma", "gMode")):
+    _fixed_effects[fixed[_kind + "_auto"]]      = ((_key, True),)
+    _fixed_effects[fixed[_kind + "_manual"]]    = ((_key, False),)
+for _kind, _key in (("backlight", "backlight"), ("mirror", "mirror"), ("flip", "flip"),
+                    ("focus_auto", "fMode"), ("mm_detect", "mmDetect")):
+    _fixed_effects[fixed[_kind + "_on"]]        = ((_key, True),)
+    _fixed_effects[fixed[_kind + "_off"]]       = ((_key, False),)
+for _mode in ("on", "off", "blink"):
+    _fixed_effects[fixed["call_led_" + _mode]]  = (("callLed", _mode),)
+for _mode in ("on", "off"):
+    _fixed_effects[fixed["pwr_led_" + _mode]]   = (("pwrLed", _mode),)
+for _baud in (9600, 115200):
+    _fixed_effects[fixed["speed_%d" % _baud]]   = (("baud", _baud),)
+
+def _n4(msg, offset):
+    return fromNibbles(msg[offset:offset + 4])
+
+#(message prefix, message length) -> fn(msg) returning ((state key, value), ..)
+_param_effects = {
+    (b'\x01\x04\x75', 7)    : lambda m : (("wbTable", _n4(m, 3)),),
+    (b'\x01\x04\x52', 7)    : lambda m : (("gTable", _n4(m, 3)),),
+    (b'\x01\x04\x4B', 7)    : lambda m : (("iris", _n4(m, 3)),),
+    (b'\x01\x04\x4C', 7)    : lambda m : (("gain", _n4(m, 3)),),
+    (b'\x01\x35\x00', 5)    : lambda m : (("vidFormat", visca.VIDEO_NAMES.get(m[3])),),
+    (b'\x01\x06\x20', 19)   : lambda m : (("pan", _n4(m, 3)), ("tilt", _n4(m, 7)),
+                                          ("zoom", _n4(m, 11)), ("focus", _n4(m, 15))),
+    (b'\x01\x06\x02', 13)   : lambda m : (("pan", _n4(m, 5)), ("tilt", _n4(m, 9))),
+    (b'\x01\x04\x47', 7)    : lambda m : (("zoom", _n4(m, 3)),),
+    (b'\x01\x04\x47', 11)   : lambda m : (("zoom", _n4(m, 3)), ("focus", _n4(m, 7))),
+    (b'\x01\x04\x48', 7)    : lambda m : (("focus", _n4(m, 3)),),
+}
+
+POSITIONS = ("pan", "tilt", "zoom", "focus")
+
+#Message prefix -> state keys the command makes unknown
+_invalidates = {
+    b'\x01\x06\x01' : ("pan", "tilt"),                  #steer, pt_stop
+    b'\x01\x06\x05' : ("pan", "tilt"),                  #pt_reset
+    b'\x01\x04\x00' : POSITIONS,                        #power on/off resets the motors
+    b'\x01\x04\x07' : ("zoom",),                        #zoom tele/wide/stop
+    b'\x01\x04\x08' : ("focus",),                       #focus far/near/stop
+    b'\x01\x04\x38' : ("focus",),                       #autofocus on/off
+    b'\x01\x50\x30' : POSITIONS,                        #motor moved detection on/off
+    b'\x01\x50\x60' : POSITIONS,                        #best view moves the camera
+}
+
+#Inquiries run by Controller.sync(), in order
+SEED_INQUIRIES = (
+    "q_wbMode", "q_wbTable", "q_aeMode", "q_blacklight", "q_mirror", "q_flip",
+    "q_gMode", "q_gTable", "q_fMode", "q_callLed", "q_pwrLed", "q_vidSys",
+    "q_pt", "q_zoompos", "q_fPos",
+)
+
+#Inquiry -> state key of its (single) decoded value
+_inquiry_keys = {
+    "q_wbMode"      : "wbMode",
+    "q_wbTable"     : "wbTable",
+    "q_aeMode"      : "aeMode",
+    "q_blacklight"  : "backlight",
+    "q_mirror"      : "mirror",
+    "q_flip"        : "flip",
+    "q_gMode"       : "gMode",
+    "q_gTable"      : "gTable",
+    "q_fMode"       : "fMode",
+    "q_callLed"     : "callLed",
+    "q_pwrLed"      : "pwrLed",
+    "q_vidSys"      : "vidFormat",
+    "q_zoompos"     : "zoom",
+    "q_fPos"        : "focus",
+}
+
+def effects(msg):
+    """((state key, value), ..) a message sets, None if it sets no cached state"""
+    found = _fixed_effects.get(msg)
+    if(found is None):
+        fn = _param_effects.get((msg[:3], len(msg)))
+        if(fn is not None):
+            found = fn(msg)
+    return found
+
+class CameraState(object):
+    def __init__(self):
+        self.values     = {}
+        self.lock       = threading.Lock()
+        #Setters answered from the cache instead of the link
+        self.suppressed = 0
+
+    def get(self, key, default=None):
+        return self.values.get(key, default)
+
+    def set(self, key, value):
+        with self.lock:
+            self.values[key] = value
+
+    def clear(self):
+        """Forgets everything, e.g. after a reboot"""
+        with self.lock:
+            self.values.clear()
+
+    def invalidate(self, keys):
+        with self.lock:
+            for key in keys:
+                self.values.pop(key, None)
+
+    def current(self, msg):
+        """True if msg would not change the camera, counted as suppressed"""
+        found = effects(msg)
+        if(found is None):
+            return False
+        values = self.values
+        #With motor moved detection on, the camera may recalibrate by itself
+        if(values.get("mmDetect") is not False and any(k in POSITIONS for k, v in found)):
+            return False
+        with self.lock:
+            if(all(k in values and values[k] == v for k, v in found)):
+                self.suppressed += 1
+                return True
+        return False
+
+    def update(self, msg):
+        """Records the effect of msg after the camera completed it"""
+        if(msg == fixed["reboot"]):
+            #Everything back to power-on defaults, including 9600 baud
+            with self.lock:
+                self.values.clear()
+                self.values["baud"] = 9600
+            return
+        stale = _invalidates.get(msg[:3])
+        if(stale is not None):
+            self.invalidate(stale)
+        found = effects(msg)
+        if(found is not None):
+            with self.lock:
+                self.values.update(found)
+
+    def forget(self, msg):
+        """msg failed, so whatever it touches is no longer known"""
+        found = effects(msg)
+        if(found is not None):
+            self.invalidate([k for k, v in found])
+        stale = _invalidates.get(msg[:3])
+        if(stale is not None):
+            self.invalidate(stale)
+
+    def seed(self, name, value):
+        """Stores the decoded reply of inquiry name"""
+        if(value is None):
+            return
+        with self.lock:
+            if(name == "q_pt"):
+                self.values["pan"] = value.pan
+                self.values["tilt"] = value.tilt
+            elif(name in _inquiry_keys):
+                self.values[_inquiry_keys[name]] = value
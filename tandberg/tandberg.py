@@ -1,8 +1,13 @@
 import serial
 import logging
+import threading
 import time
 from serial.tools import list_ports
 
+from . import visca
+from .visca import fixed, encoders
+from .state import CameraState, SEED_INQUIRIES
+
 stat_OK = 0
 stat_FAIL = 1
 
@@ -11,6 +16,50 @@ stat_FAIL = 1
 # Tilt : -25 to +15 deg : 7-212 values  # value = deg*5.125 + 135.125
 # Zoom : 0-2850 values ?
 
+#'on'/'off' messages of the auto/manual mode commands
+_auto_manual = {
+    kind : {'on' : fixed[kind + "_auto"], 'off' : fixed[kind + "_manual"]}
+    for kind in ("wb", "ae", "gamma")
+}
+
+#Messages after which the camera talks at another speed:
+#message -> (baudrate, wait until the camera answers again)
+_speed_changes = {
+    fixed["speed_9600"]     : (9600, True),
+    fixed["speed_115200"]   : (115200, True),
+    #Reboot always comes back at 9600, and takes its time
+    fixed["reboot"]         : (9600, False),
+}
+
+error_stat = {
+    1 : "Message length error (>14bytes)",
+    2 : "Syntax error",
+    3 : "Command buffer full",
+    4 : "Command cancelled",
+    5 : "No socket",
+    65 : "Command not executable",
+}
+
+def bufferFull(resp):
+    """True for a 'Command buffer full' (6y 03) reply, worth sending again later"""
+    return resp is not None and len(resp) >= 2 and resp[0] & 0xf0 == 0x60 and resp[1] == 3
+
+def replyStatus(resp):
+    """Status of a completion (5y) or error (6y .. ) reply, address and terminator stripped.
+    Buffer full is not printed here, the caller may still retry: see reportBufferFull"""
+    if(resp[0] & 0xf0 != 0x50):
+        if(resp[0] & 0xf0 != 0x60 or len(resp) < 2):
+            print("Incorrect socket")
+        elif(resp[1] != 3):
+            print(error_stat.get(resp[1], "Unknown error %d" % resp[1]))
+        return stat_FAIL
+    return stat_OK
+
+def reportBufferFull(resp):
+    """Prints 'Command buffer full' for a final reply, once no retry is left"""
+    if(bufferFull(resp)):
+        print(error_stat[3])
+
 # Important note: The response to commands depends on the camera's mood.
 # It can decide that it doesnt want to move away from a particular spot. 
 # Reboot in this case.
@@ -35,26 +84,148 @@ class Controller(object):
         #The communication port
         self.port           = None
         self.ser            = None
-
+        #Bytes read past the last reply terminator, kept for the next reply
+        self._rxbuf         = bytearray()
+        #Last reply, address and terminator stripped
+        self.reply          = None
+        #Held for a whole command/reply exchange, so several threads can share the camera
+        self.linkLock       = threading.RLock()
+        #Seconds a command may take from write to completion
+        self.timeout        = 20
+        #Resends of a command the camera had no buffer for, waiting backoff, 2*backoff, ..
+        self.retries        = 3
+        self.backoff        = 0.05
+        #Optional RecoveryPolicy, called with the outcome of every command
+        self.recovery       = None
+        #Bytes dropped while resynchronising on a frame start
+        self.garbage        = 0
+        #A reply may still be on its way after a timeout
+        self._stale         = False
+        #Speeds connect probes in order; the first is kept if nothing answers
+        self.baudrates      = (9600, 115200)
+        #Switch the camera to 115200 baud at connect
+        self.upgradeBaud    = False
+        #Seconds to wait for the camera after a speed change
+        self.baudTimeout    = 20
+        #Speed the camera answered at, None if it did not
+        self.baudrate       = None
+        #Print raw inquiry replies
+        self.debug          = False
+        #Optional metrics.Metrics, records latency, errors and bytes of every exchange
+        self.metrics        = None
+        #Optional wire.Recorder, logs every byte written and read from connect on
+        self.recorder       = None
+
+        #Shadow of the camera state, see state.py
+        self.state          = CameraState()
+        #Skip setters the camera is already in and seed the state at connect
+        self.shadow         = True
+
+        #Toggle fallbacks while the camera state is not known
         self.flipState       = False
         self.mirrorState     = False
         self.backlightState  = False
 
     def connect(self, inp):
+        status = self._open(inp)
+        if(status == stat_OK):
+            self.sync()
+        return status
+
+    def _open(self, inp):
+        """Opens the port and finds the camera's speed, returns the success code"""
+        status = self._openPort(inp)
+        if(status == stat_OK):
+            status = self._negotiate()
+            if(status != stat_OK):
+                self._closePort()
+        return status
+
+    def _openPort(self, inp):
         #9600 baud, 8N1, no flow control.
         interface   = inp
         status      = 0
         try:
-            self.ser = serial.Serial(interface, timeout=20)
+            #Short read timeout, receive() keeps its own per command deadline
+            self.ser = serial.Serial(interface, baudrate=self.baudrates[0], timeout=0.1)
+            if(self.recorder is not None):
+                self.ser = self.recorder.wrap(self.ser)
             self.interface = interface
+            self._rxbuf.clear()
         except Exception as error:
             print("Exception when connecting to device.")
             self.interface = None
             status = 1
         return status
 
+    def _closePort(self):
+        """Closes the port after a failed connect, nothing is connected afterwards"""
+        try:
+            self.ser.close()
+        except Exception:
+            pass
+        self.ser = None
+        self.interface = None
+
+    def _negotiate(self):
+        """Finds the speed the camera is at and, with upgradeBaud, moves it to 115200"""
+        #Runs before any reader thread, so the plain Controller exchange is used
+        probe = lambda : Controller.probe(self)
+        self.baudrate = self.detectBaud(probe)
+        if(self.baudrate is None):
+            print("Baud detection : FAILED")
+            return stat_FAIL
+        if(self.upgradeBaud and self.baudrate != 115200):
+            if(Controller.send(self, fixed["speed_115200"]) != stat_OK):
+                print("Update serial speed status : FAILED")
+                return stat_FAIL
+            #Controller's own, a subclass may have made _followBaud a coroutine
+            return Controller._followBaud(self, 115200, probe)
+        return stat_OK
+
+    def detectBaud(self, probe=None):
+        """Tries every speed in self.baudrates, leaves the port at the one the
+        camera answers at and returns it. None (port at the first) if none"""
+        probe = probe or self.probe
+        for baudrate in self.baudrates:
+            self.ser.baudrate = baudrate
+            if(probe()):
+                return baudrate
+        self.ser.baudrate = self.baudrates[0]
+        return None
+
+    def probe(self, timeout=0.25):
+        """True if the camera answers a power inquiry within timeout seconds"""
+        if(self.ser is None):
+            return False
+        with self.linkLock:
+            #Drop anything received at the old speed
+            self.ser.reset_input_buffer()
+            self._rxbuf.clear()
+            self.ser.write(self.address + fixed["q_pwr"] + b'\xff')
+            frame = self.readFrame(time.monotonic() + timeout)
+        return frame is not None and len(frame) == 4 and frame[1] == 0x50
+
+    def _followBaud(self, baudrate, probe=None):
+        """Moves the port to the camera's new speed, then polls with probe
+        until the camera answers instead of sleeping the worst case"""
+        self.ser.baudrate = baudrate
+        self.baudrate = baudrate
+        self.state.set("baud", baudrate)
+        if(probe is None):
+            return stat_OK
+        deadline = time.monotonic() + self.baudTimeout
+        while time.monotonic() < deadline:
+            if(probe()):
+                return stat_OK
+        print("Camera not answering at %d baud" % baudrate)
+        return stat_FAIL
+
     def disconnect(self):
         status = 0
+        self.state.clear()
+        if(self.recorder is not None):
+            self.recorder.flush()
         try:
             if(self.ser != None):
                 self.ser.close()
@@ -68,250 +239,135 @@ class Controller(object):
     def clear(self):
         #TODO: FIX
         """Stops any current operation"""
-        msg     = b'\x01\x00\x01'
-        status  = self.send(msg)
-
-        if(status != stat_OK):
-            print("Clear : FAILED")
-        return status
+        return self._execute([(fixed["clear"], "Clear")])
 
     def address_set(self, inp):
         """Sets address of camera """
         address = int(inp[0])
         #If broadcast i.e \x81, increase address with 1 before sending to chain
         #Assuming address 0-9. ?Is A-F allowed
-        msg = b'\x30'
-        msg += address.to_bytes(1,'big')
-        status = self.send(msg)
-
-        if(status != stat_OK):
-            print("SetAddress : FAILED")
-        return status
+        msg = encoders["address_set"](address)
+        return self._execute([(msg, "SetAddress")])
 
     def power(self, inp):
         #The command doesnt power on/off the camera. Only reset motors
         cmd = inp[0]
-        lookup = {
-            'on' : b'\x01\x04\x00\x02',
-            'off': b'\x01\x04\x00\x03',
-        }
-        status = self.send(lookup[cmd])
-
-        if(status != stat_OK):
-            print("Power status : FAILED")
-        return status
+        return self._execute([(fixed["power_" + cmd], "Power status")])
 
     def vid_format(self, inp):
         """Sets the video format"""
         cmd = inp[0]
         #Only functions if the video mode DIP is set to SW
         #If DIP is changed during runtime, camera must be rebooted
-        lookup = {
-            "1080p25"   : b'\x00',
-            "1080p30"   : b'\x01',
-            "1080p50"   : b'\x02',
-            "1080p60"   : b'\x03',
-            "720p25"    : b'\x04',
-            "720p30"    : b'\x05',
-            "720p50"    : b'\x06',
-            "720p60"    : b'\x07'
-        }
-
-        msg = b'\x01\x35\x00'
-        msg += lookup[cmd]
-        msg += b'\x00'  #Used in PrecisionHD 720p camera
-
-        status = self.send(msg)
-
-        if(status != stat_OK):
-            print("Video format status : FAILED")
-        return status
+        #Trailing \x00 is used in PrecisionHD 720p camera
+        msg = encoders["vid_format"](visca.VIDEO_FORMATS[cmd])
+        return self._execute([(msg, "Video format status")])
 
     def wb_auto(self, inp):
         """Sets White balance to auto/manual and to value if manual"""
         cmd = inp[0]
-        lookup = {
-            'on' : b'\x01\x04\x35\x00',
-            'off': b'\x01\x04\x35\x06',
-        }
+        lookup = _auto_manual["wb"]
 
+        steps = []
         if(cmd == 'off'):
             #Update table index before switching to manual mode
-            msg = b'\x01\x04\x75' + self.__toVisca2b(int(inp[1]))
-            status = self.send(msg)
+            msg = encoders["wb_table"](int(inp[1]))
+            steps.append((msg, "Update WB Table status"))
 
-            if(status != stat_OK):
-                print("Update WB Table status : FAILED")
-
-        status = self.send(lookup[cmd])
-
-        if(status != stat_OK):
-            print("WB status : FAILED")
-        return status
+        steps.append((lookup[cmd], "WB status"))
+        return self._execute(steps)
 
     def ae_auto(self, inp):
         """Sets Auto Exposure to auto/manual and to value if manual"""
         cmd = inp[0]
+        lookup = _auto_manual["ae"]
 
-        lookup = {
-            'on' : b'\x01\x04\x39\x00',
-            'off': b'\x01\x04\x39\x03',
-        }
-
+        steps = []
         if(cmd == 'off'):
             #Update iris position before switching to manual mode, range = 0..50
-            msg = b'\x01\x04\x4B' + self.__toVisca2b(int(inp[1]))
-            status = self.send(msg)
-
-            if(status != stat_OK):
-                print("Update iris status : FAILED")
+            msg = encoders["iris"](int(inp[1]))
+            steps.append((msg, "Update iris status"))
 
             #Update gain position before switching to manual mode, range = 12-21 dB
-            msg = b'\x01\x04\x4C' + self.__toVisca2b(int(inp[2]))
-            status = self.send(msg)
-
-            if(status != stat_OK):
-                print("Update gain status : FAILED")
+            msg = encoders["gain"](int(inp[2]))
+            steps.append((msg, "Update gain status"))
 
-        status = self.send(lookup[cmd])
-
-        if(status != stat_OK):
-            print("AE status : FAILED")
-        return status
+        steps.append((lookup[cmd], "AE status"))
+        return self._execute(steps)
 
     def backlight(self, inp):
         """Turns backlight compensation on or off"""
         cmd = inp[0]
-        lookup = {
-            'on' : b'\x01\x04\x33\x02',
-            'off': b'\x01\x04\x33\x03',
-        }
 
         if(cmd == "toggle"):
-            if(self.backlightState == False):
+            if(self.state.get("backlight", self.backlightState) == False):
                 self.backlightState = True
                 cmd = "on"
             else:
                 self.backlightState = False
                 cmd = "off"
 
-        status = self.send(lookup[cmd])
-
-        if(status != stat_OK):
-            print("Backlight status : FAILED")
-        return status
+        return self._execute([(fixed["backlight_" + cmd], "Backlight status")])
 
     def mirror(self, inp):
         """Turns mirror on or off"""
         cmd = inp[0]
-        lookup = {
-            'on' : b'\x01\x04\x61\x02',
-            'off': b'\x01\x04\x61\x03',
-        }
 
         if(cmd == "toggle"):
-            if(self.mirrorState == False):
+            if(self.state.get("mirror", self.mirrorState) == False):
                 self.mirrorState = True
                 cmd = "on"
             else:
                 self.mirrorState = False
                 cmd = "off"
 
-        status = self.send(lookup[cmd])
-
-        if(status != stat_OK):
-            print("Mirror status : FAILED")
-        return status
+        return self._execute([(fixed["mirror_" + cmd], "Mirror status")])
 
     def flip(self, inp):
         """Turns flip on or off"""
         cmd = inp[0]
-        lookup = {
-            'on' : b'\x01\x04\x66\x02',
-            'off': b'\x01\x04\x66\x03',
-        }
 
         if(cmd == "toggle"):
-            if(self.flipState == False):
+            if(self.state.get("flip", self.flipState) == False):
                 self.flipState = True
                 cmd = "on"
             else:
                 self.flipState = False
                 cmd = "off"
 
-        status = self.send(lookup[cmd])
-
-        if(status != stat_OK):
-            print("Flip status : FAILED")
-        return status
+        return self._execute([(fixed["flip_" + cmd], "Flip status")])
 
     def gamma_auto(self, inp):
         """Sets Gamma to auto/manual and to value if manual"""
         cmd = inp[0]
         # Default - table 4
-        lookup = {
-            'on' : b'\x01\x04\x51\x02',
-            'off': b'\x01\x04\x51\x03',
-        }
+        lookup = _auto_manual["gamma"]
 
+        steps = []
         if(cmd == 'off'):
             #Update table before switching to manual mode range = 0..7
-            msg = b'\x01\x04\x52' + self.__toVisca2b(int(inp[1]))
-            status = self.send(msg)
-
-            if(status != stat_OK):
-                print("Update Gamma Table status : FAILED")
+            msg = encoders["gamma_table"](int(inp[1]))
+            steps.append((msg, "Update Gamma Table status"))
 
-        status = self.send(lookup[cmd])
-
-        if(status != stat_OK):
-            print("Gamma status : FAILED")
-        return status
+        steps.append((lookup[cmd], "Gamma status"))
+        return self._execute(steps)
 
     def mm_detect(self, inp):
         # Works irregularly
         """Turns Motor moved detection on or off"""
         cmd = inp[0]
         #Camera recalibrates if MMD is on and is touched
-        lookup = {
-            'on' : b'\x01\x50\x30\x01',
-            'off': b'\x01\x50\x30\x00',
-        }
-
-        status = self.send(lookup[cmd])
-
-        if(status != stat_OK):
-            print("MM status : FAILED")
-        return status
+        return self._execute([(fixed["mm_detect_" + cmd], "MM status")])
 
     def call_led(self, inp):
-        """Turns call LED on or off"""
+        """Turns call LED on, off or blinking"""
         cmd = inp[0]
-        lookup = {
-            'on' : b'\x01\x33\x01\x01',
-            'off': b'\x01\x33\x01\x00',
-            'blink': b'\x01\x33\x01\x02',
-        }
-
-        status = self.send(lookup[cmd])
-
-        if(status != stat_OK):
-            print("Call LED status : FAILED")
-        return status
+        return self._execute([(fixed["call_led_" + cmd], "Call LED status")])
 
     def pwr_led(self, inp):
-        cmd = inp[0]
         """Turns power LED on or off"""
-        lookup = {
-            'on' : b'\x01\x33\x02\x01',
-            'off': b'\x01\x33\x02\x00',
-        }
-
-        status = self.send(lookup[cmd])
-
-        if(status != stat_OK):
-            print("Power LED status : FAILED")
-        return status
+        cmd = inp[0]
+        return self._execute([(fixed["pwr_led_" + cmd], "Power LED status")])
 
     def bestView(self, inp):
         # Untested
@@ -320,17 +376,8 @@ class Controller(object):
         time    = int(inp[1])
         #time < 100s
         #time = 0 stops operation
-        msg = b'\x01\x50\x60'
-        temp = int(time/10)
-        msg += temp.to_bytes(1,"big")
-        temp = time%10
-        msg += temp.to_bytes(1,"big")
-
-        status = self.send(msg)
-
-        if(status != stat_OK):
-            print("Best view status : FAILED")
-        return status
+        msg = encoders["best_view"](time//10, time%10)
+        return self._execute([(msg, "Best view status")])
 
     def setZoomSpeed(self, inp):
         cmd = inp[0]
@@ -338,6 +385,7 @@ class Controller(object):
             self.zoomSpeed = 11
         else:
             self.zoomSpeed = 10
+        return self._execute([])
 
     def setFocusSpeed(self, inp):
         cmd = inp[0]
@@ -345,18 +393,16 @@ class Controller(object):
             self.focusSpeed = 11
         else:
             self.focusSpeed = 10
+        return self._execute([])
 
     def zoomFocus(self, inp):
         """Sets the Zoom/Focus"""
         fn  = inp[0]
         cmd = inp[1]
-        msg = b'\x01\x04'
 
-        speed = self.zoomSpeed
         if(fn == "zoom"):
-            msg+= b'\x07'
-        elif(fn == "focus"):
-            msg += b'\x08'
+            speed = self.zoomSpeed
+        else:
             speed = self.focusSpeed
 
         if(cmd == "stop"):
@@ -365,13 +411,9 @@ class Controller(object):
             temp = 32 + speed   #32 - 0x20
         elif(cmd == "out" or cmd == "near"):
             temp = 48 + speed   #48 - 0x30
-        msg += temp.to_bytes(1,"big")
+        msg = encoders[fn + "_drive"](temp)
 
-        status = self.send(msg)
-
-        if(status != stat_OK):
-            print("Zoom/Focus status : FAILED")
-        return status
+        return self._execute([(msg, "Zoom/Focus status")])
 
     def zoomFocus_direct(self, inp):
         # Fails but ptzf works so use that directly
@@ -381,101 +423,49 @@ class Controller(object):
         """Sets Zoom/Focus to specified position directly"""
         #Set zoom/focus arguments to -1 if functions are not used
         #Zoom/Focus = PQRS, not sure what these stand for
+        #Anything else out of range raises ValueError in the encoder
 
-        msg = b'\x01\x04'
         if(zoom == -1 and focus != -1):
-            msg += b'\x48'
-            msg += self.__toVisca2b(focus)
-
-        elif(zoom != -1):
-            msg += b'\x47'
-            msg += self.__toVisca2b(zoom)
-            if(focus != -1):
-                msg += self.__toVisca2b(focus)
+            msg = encoders["focus_direct"](focus)
+        elif(focus == -1):
+            msg = encoders["zoom_direct"](zoom)
+        else:
+            msg = encoders["zoomfocus_direct"](zoom, focus)
 
-        status = self.send(msg)
-
-        if(status != stat_OK):
-            print("Zoom/Focus direct status : FAILED")
-        return status
+        return self._execute([(msg, "Zoom/Focus direct status")])
 
     def focus_auto(self, inp):
-        cmd = inp[0]
         """Turns autofocus on or off"""
-        lookup = {
-            'on': b'\x01\x04\x38\x02',
-            'off': b'\x01\x04\x38\x03',
-        }
-
-        status = self.send(lookup[cmd])
-
-        if(status != stat_OK):
-            print("Auto focus status : FAILED")
-        return status
+        cmd = inp[0]
+        return self._execute([(fixed["focus_auto_" + cmd], "Auto focus status")])
 
     def steer(self, inp):
         """Steer in a direction"""
         cmd = inp[0]
-        #Stop is not added
-        lookup = {
-            'up'        : b'\x03\x01',
-            'down'      : b'\x03\x02',
-            'left'      : b'\x01\x03',
-            'right'     : b'\x02\x03',
-            'upleft'    : b'\x01\x01',
-            'upright'   : b'\x02\x01',
-            'downleft'  : b'\x01\x02',
-            'downright' : b'\x02\x02',
-            'stop'      : b'\x03\x03',
-        }
-        msg = b'\x01\x06\x01'
-        if(cmd != 'stop'):
-            msg += self.panSpeed
-            msg += self.tiltSpeed
+        if(cmd == 'stop'):
+            msg = fixed["pt_stop"]
         else:
-            msg += b'\x03\x03'
-        msg += lookup[cmd]
+            pan, tilt = visca.STEER_DIRECTIONS[cmd]
+            msg = visca.steer_messages[self.panSpeed[0], self.tiltSpeed[0], pan, tilt]
 
-        status = self.send(msg)
-
-        if(status != stat_OK):
-            print("Operation status : FAILED")
-        return status
+        return self._execute([(msg, "Operation status")])
 
     def reset(self):
         """Resets the motors only"""
-        msg = b'\x01\x06\x05'
-        status = self.send(msg)
-
-        if(status != stat_OK):
-            print("Reset motor status : FAILED")
-        return status
+        return self._execute([(fixed["pt_reset"], "Reset motor status")])
 
     def reboot(self):
         """Reboots the camera"""
         #Resets serial to 9600 baud
-        msg = b'\x01\x42'
-        status = self.send(msg)
-
-        if(status != stat_OK):
-            print("Reboot status : FAILED")
-        return status
+        return self._execute([(fixed["reboot"], "Reboot status")])
 
     def pt_direct(self, inp):
         """Sets Pan/Tilt directly to positions"""
         pan     = int(inp[0])
         tilt    = int(inp[1])
 
-        msg = b'\x01\x06\x02'
-        msg += self.panSpeed
-        msg += self.tiltSpeed
-        msg += self.__toVisca2b(pan)
-        msg += self.__toVisca2b(tilt)
-
-        status = self.send(msg)
-
-        if(status != stat_OK):
-            print("PT direct status : FAILED")
+        msg = encoders["pt_direct"](self.panSpeed[0], self.tiltSpeed[0], pan, tilt)
+        return self._execute([(msg, "PT direct status")])
 
     def ptzf(self, inp):
         # Focus cannot be controlled if auto focus is disabled
@@ -486,106 +476,166 @@ class Controller(object):
         zoom    = int(inp[2])
         focus   = int(inp[3])
 
-        msg = b'\x01\x06\x20'
-        msg += self.__toVisca2b(pan)
-        msg += self.__toVisca2b(tilt)
-        msg += self.__toVisca2b(zoom)
-        msg += self.__toVisca2b(focus)
-
-        status = self.send(msg)
-
-        if(status != stat_OK):
-            print("PTZF direct status : FAILED")
-        return status
+        msg = encoders["ptzf"](pan, tilt, zoom, focus)
+        return self._execute([(msg, "PTZF direct status")])
 
     def serialSpeed(self, inp):
         """Update serial communication speed"""
-        speed = inp[0]
-        #Requires a delay of 20s before next command
+        speed = int(inp[0])
         #9600 baud/115200 baud
-        lookup = {
-            9600 : b'\x01\x34\x00',
-            115200 : b'\x01\x34\x01'
-        }
-        status = self.send(lookup[speed])
-
-        if(status != stat_OK):
-            print("Update serial speed status : FAILED")
-        else:
-            time.sleep(20)
-        return status
+        #The camera needs a moment before the next command, _execute
+        #switches the port and polls until it answers
+        msg = fixed["speed_%d" % speed]
+        return self._execute([(msg, "Update serial speed status")])
 
     #Inquiry commands:
     def qCmd(self, inp):
+        """Runs an inquiry, returns its decoded value (see visca.parse) or None"""
         query = inp[0]
-        print(query)
-        qDict = {
-            "q_camid"       : b'\x09\x04\x22',
-            "q_zoompos"     : b'\x09\x04\x47',
-            "q_fPos"        : b'\x09\x04\x48',
-            "q_fMode"       : b'\x09\x04\x38',
-            "q_pt"          : b'\x09\x06\x12',
-            "q_pwr"         : b'\x09\x04\x00',
-            "q_wbMode"      : b'\x09\x04\x35',
-            "q_wbTable"     : b'\x09\x04\x75',
-            "q_aeMode"      : b'\x09\x04\x39',
-            "q_blacklight"  : b'\x09\x04\x33',
-            "q_mirror"      : b'\x09\x04\x61',
-            "q_flip"        : b'\x09\x04\x66',
-            "q_gMode"       : b'\x09\x04\x51',
-            "q_gTable"      : b'\x09\x04\x52',
-            "q_callLed"     : b'\x09\x01\x33\x01',
-            "q_pwrLed"      : b'\x09\x01\x33\x02',
-            "q_vidSW"       : b'\x09\x06\x24',
-            "q_alsRGain"    : b'\x09\x50\x50',
-            "q_alsBGain"    : b'\x09\x50\x51',
-            "q_alsGGain"    : b'\x09\x50\x52',
-            "q_alsGGain"    : b'\x09\x50\x53',
-            "q_bestView"    : b'\x09\x50\x60',
-            "q_invert"      : b'\x09\x50\x70',
-        }
-
-        msg     = qDict[query]
-        status  = self.send(msg)
+        if(self.debug):
+            print(query)
+        return self.inquire(query)
+
+    def inquire(self, name):
+        """Sends inquiry name and returns the decoded reply, None on failure"""
+        status, reply = self.transact(visca.inquiries[name][0])
+        reportBufferFull(reply)
+        value = visca.parse(name, reply) if status == stat_OK else None
+        if(value is None):
+            #Completed with a reply that does not decode
+            status = stat_FAIL
+        if(self.recovery is not None):
+            #A camera that is only polled counts towards recovery too
+            self.recovery.record(self, status)
 
         if(status != stat_OK):
             print("Query status : FAILED")
+            return None
+        self.state.seed(name, value)
+        return value
+
+    def sync(self):
+        """Seeds the shadow state with a bulk inquiry, returns the success code"""
+        self.state.clear()
+        if(self.baudrate is None):
+            #Nothing answered at connect
+            return stat_FAIL
+        self.state.set("baud", self.baudrate)
+        if(not self.shadow):
+            return stat_OK
+        for name in SEED_INQUIRIES:
+            #Stop at the first failure rather than wait out every timeout
+            if(self.inquire(name) is None):
+                return stat_FAIL
+        return stat_OK
+
+    def transact(self, cmd):
+        """Sends a command, returns its status and reply (address and terminator stripped)"""
+        with self.linkLock:
+            self.reply = None
+            status = self.send(cmd)
+            return status, self.reply
+
+    def idle(self):
+        """True if no command is waiting on the link"""
+        if(not self.linkLock.acquire(blocking=False)):
+            return False
+        self.linkLock.release()
+        return True
+
+    def _execute(self, steps, delay=0, replies=None):
+        """Sends (message, name) steps in order and returns the status of the last one.
+        replies, a list, gets the final reply of every step, None if it was not sent"""
+        status = stat_OK
+        sent = False
+        for msg, name in steps:
+            if(self.shadow and self.state.current(msg)):
+                #Camera is already there
+                status = stat_OK
+                if(replies is not None):
+                    replies.append(None)
+                continue
+            status, reply = self.transact(msg)
+            sent = True
+            for attempt in range(self.retries):
+                if(status == stat_OK or not bufferFull(reply)):
+                    break
+                time.sleep(self.backoff * 2**attempt)
+                status, reply = self.transact(msg)
+            if(replies is not None):
+                replies.append(reply)
+
+            if(status != stat_OK):
+                reportBufferFull(reply)
+                self.state.forget(msg)
+                print(name + " : FAILED")
+            else:
+                self.state.update(msg)
+                if(msg in _speed_changes):
+                    baudrate, wait = _speed_changes[msg]
+                    status = self._followBaud(baudrate, self.probe if wait else None)
+            if(self.recovery is not None):
+                self.recovery.record(self, status)
+
+        if(status == stat_OK and delay and sent):
+            time.sleep(delay)
         return status
 
+    def readFrame(self, deadline=None):
+        """Reads one reply frame (address .. 0xFF) from the camera. None once
+        deadline (time.monotonic()) has passed, or after one read timeout without"""
+        buf = self._rxbuf
+        while True:
+            end = buf.find(b'\xff')
+            if(end != -1):
+                #Parameter bytes are all < 0x80, so the last other byte >= 0x80
+                #before the terminator is the address. Anything ahead of it is noise
+                start = end - 1
+                while(start >= 0 and buf[start] < 0x80):
+                    start -= 1
+                if(start < 0 or end - start < 2):
+                    self.garbage += end + 1
+                    del buf[:end + 1]
+                    continue
+                self.garbage += start
+                frame = bytes(buf[start:end + 1])
+                del buf[:end + 1]
+                return frame
+
+            #Block for at least one byte, then take whatever else is buffered
+            chunk = self.ser.read(self.ser.in_waiting or 1)
+            if(self.metrics is not None):
+                self.metrics.traffic(received=len(chunk))
+            if(not chunk):
+                if(deadline is None or time.monotonic() >= deadline):
+                    return None
+                continue
+            buf += chunk
+
     def receive(self, query_stat):
-        # TODO: Parse data nicely
-        resp        = b''
-        rcvd_byte   = None
-        hex_str     = []
-        while rcvd_byte != b'\xff':
-            rcvd_byte = self.ser.read()
-            resp += rcvd_byte
-            hex_str.append(rcvd_byte.hex())
-
-        # Strip off first byte (address) and last (terminator)
-        # We leave the reponse as bytes instead of hex
-        resp = resp[1:-1]
-
-        if(query_stat == True):
-            print(hex_str)
-
-        error_stat = {
-            1 : "Message length error (>14bytes)",
-            2 : "Syntax error",
-            3 : "Command buffer full",
-            4 : "Command cancelled",
-            5 : "No socket",
-            65 : "Command not executable",
-        }
-
-        if(resp[0] != 80):  #\x50=80 decimal
-            if(resp[0] != 96):  #\x60=96d
+        deadline = time.monotonic() + self.timeout
+        while True:
+            frame = self.readFrame(deadline)
+            if(frame is None):
+                print("Receive timeout")
+                self._stale = True
+                return 1
+
+            if(query_stat == True and self.debug):
+                print([frame[i:i + 1].hex() for i in range(len(frame))])
+
+            # Strip off first byte (address) and last (terminator)
+            # We leave the reponse as bytes instead of hex
+            resp = frame[1:-1]
+            self.reply = resp
+            if(not resp):
                 print("Incorrect socket")
-            else:
-                print(error_stat[resp[1]])
-            return 1
-        return 0
+                return 1
 
+            # An ACK (\x4y) only says the command went into socket y,
+            # the completion or error for it follows
+            if(resp[0] & 0xf0 != 0x40):
+                return replyStatus(resp)
 
     def send(self, cmd):
         """Sends a command to the camera and returns the success code"""
@@ -597,14 +647,25 @@ class Controller(object):
         if(cmd[0] == 9):
             inq = True
 
-        msg = self.address
-        msg += cmd
-        msg += b'\xff'
-
-        #Write to camera
-        self.ser.write(msg)
-
-        status = self.receive(inq)
+        with self.linkLock:
+            if(self._stale):
+                #Whatever belonged to the command that timed out is useless now
+                self.ser.reset_input_buffer()
+                self._rxbuf.clear()
+                self._stale = False
+            #Write to camera
+            frame = self.address + cmd + b'\xff'
+            self.ser.write(frame)
+
+            metrics = self.metrics
+            if(metrics is None):
+                status = self.receive(inq)
+            else:
+                start = time.perf_counter()
+                status = self.receive(inq)
+                #receive() marks the link stale on a timeout
+                metrics.observe(cmd, time.perf_counter() - start, None if self._stale else self.reply)
+                metrics.traffic(sent=len(frame))
         return status
 
 
@@ -613,15 +674,3 @@ class Controller(object):
         """Gets a list of available serial ports"""
         ports = list_ports.comports()
         return [x.device for x in ports]
-
-    @staticmethod
-    def __toVisca2b(value):
-        """Converts an integer to the weird VISCA 2-byte number representation, in hex for convenience."""
-        # The VISCA format in question looks like 0i:0j:0k:0l where ijkl are
-        # nibbles of the two-byte number.
-        b = value.to_bytes(2, 'big')
-        nib_1 = b[0] >> 4
-        nib_2 = b[0] & 0x0f
-        nib_3 = b[1] >> 4
-        nib_4 = b[1] & 0x0f
-        return bytes((nib_1, nib_2, nib_3, nib_4))
\ No newline at end of file
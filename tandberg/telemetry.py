@@ -0,0 +1,136 @@
+import math
+import threading
+import time
+from array import array
+from collections import namedtuple
+
+# Background pan/tilt/zoom/focus sampling:
+#
+#   telemetry = Telemetry(cam, rate=10, size=4096)
+#   telemetry.start()
+#   ...
+#   telemetry.latest()                      # Sample(t, pan, tilt, zoom, focus)
+#   telemetry.window(time.monotonic() - 5)  # the last five seconds
+#
+# A sample is only started while the link is idle (Controller.idle), so the
+# inquiries fill gaps between commands instead of queueing in front of them.
+# While the link stays busy the interval doubles up to max_interval, and it
+# drops back to 1/rate once samples go through again.
+#
+# Samples live in one flat array of doubles, FIELDS per row, overwritten in
+# a ring once size rows are stored. Values the camera did not report are NaN.
+
+Sample = namedtuple("Sample", "t pan tilt zoom focus")
+FIELDS = len(Sample._fields)
+
+class Telemetry(object):
+    def __init__(self, camera, rate=10, size=4096, max_interval=1.0):
+        self.camera         = camera
+        #Samples per second while the link is idle
+        self.rate           = rate
+        self.max_interval   = max_interval
+        #Current sampling interval, grows while the link is busy
+        self.interval       = 1.0/rate
+        self.size           = size
+        #Samples taken / skipped because the link was busy
+        self.taken          = 0
+        self.skipped        = 0
+
+        self._data          = array('d', bytes(8*FIELDS*size))
+        self._next          = 0     #Row the next sample goes into
+        self._count         = 0
+        self._lock          = threading.Lock()
+        self._thread        = None
+        self._stop          = threading.Event()
+
+    def start(self):
+        if(self._thread is None):
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if(self._thread is not None):
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def __len__(self):
+        return self._count
+
+    def _run(self):
+        base = 1.0/self.rate
+        while not self._stop.wait(self.interval):
+            if(not self.camera.idle()):
+                self.skipped += 1
+                self.interval = min(self.interval*2, self.max_interval)
+                continue
+            if(self.sample() is not None):
+                self.interval = max(base, self.interval/2)
+
+    def sample(self):
+        """Reads the camera position now and stores it, returns the Sample or None"""
+        camera = self.camera
+        pt = camera.inquire("q_pt")
+        t = time.monotonic()
+        zoom = camera.inquire("q_zoompos")
+        focus = camera.inquire("q_fPos")
+        if(pt is None and zoom is None and focus is None):
+            return None
+
+        nan = math.nan
+        row = Sample(t,
+                     nan if pt is None else pt.pan,
+                     nan if pt is None else pt.tilt,
+                     nan if zoom is None else zoom,
+                     nan if focus is None else focus)
+        self.append(row)
+        return row
+
+    def append(self, row):
+        """Stores a (t, pan, tilt, zoom, focus) row"""
+        with self._lock:
+            i = self._next*FIELDS
+            self._data[i:i + FIELDS] = array('d', row)
+            self._next = (self._next + 1) % self.size
+            self._count = min(self._count + 1, self.size)
+            self.taken += 1
+
+    def _row(self, n):
+        #n-th oldest stored row
+        i = ((self._next - self._count + n) % self.size)*FIELDS
+        return Sample(*self._data[i:i + FIELDS])
+
+    def latest(self):
+        """Newest Sample, None before the first one"""
+        with self._lock:
+            if(self._count == 0):
+                return None
+            return self._row(self._count - 1)
+
+    def window(self, start, end=None):
+        """Samples with start <= t <= end (monotonic clock), oldest first"""
+        with self._lock:
+            count = self._count
+            #Timestamps only grow, so bisect for the first row in the window
+            lo, hi = 0, count
+            while lo < hi:
+                mid = (lo + hi)//2
+                if(self._data[((self._next - count + mid) % self.size)*FIELDS] < start):
+                    lo = mid + 1
+                else:
+                    hi = mid
+            rows = []
+            for n in range(lo, count):
+                row = self._row(n)
+                if(end is not None and row.t > end):
+                    break
+                rows.append(row)
+            return rows
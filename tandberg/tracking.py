@@ -0,0 +1,469 @@
+import math
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+from .coords import Calibration
+from .visca import encoders, fixed, steer_messages
+from .tandberg import stat_OK
+from .trajectory import MAX_SPEED
+
+# Closed-loop tracking: keeps the camera pointed at whatever the detector
+# finds in the video.
+#
+#   capture = cv2.VideoCapture(0)
+#   tracker = Tracker(cam, capture, BallDetector())
+#   with tracker:
+#       ...
+#       print(tracker.stats())
+#
+# Three threads, joined by single-slot handoffs:
+#   capture     reads frames as fast as the source delivers them
+#   detect      runs the detector on the newest frame only
+#   control     turns the newest detection into a camera command
+# A slot only holds the newest item: whatever a slower stage did not get to
+# is dropped (and counted), so no stage ever works on an old frame.
+#
+# The centroid's offset from the image centre, as a fraction of half the
+# image, goes through one PID per axis:
+#   "steer"     output -> steer speed byte and direction, sent when they change
+#   "direct"    output -> fraction of the way to the pixel's pan/tilt
+#               (Calibration.pixelTarget), sent as pt_direct
+# Inside deadband the axis stops. Without a detection for lost_after seconds
+# the camera stops.
+#
+# PredictiveTracker (steer only) aims at where the target will be instead.
+# The camera direction is dead reckoned from the steers sent, so every
+# detection gives the target's direction in degrees. A constant velocity
+# Kalman filter over those extrapolates by the age of the frame plus the
+# measured command latency, and the target's speed is fed forward into the
+# steer. An axis whose predicted offset is inside deadband keeps its running
+# steer, and a steer is only replaced once a speed changes by hysteresis or
+# more, which saves link time.
+
+#Speed bytes accepted by steer and pt_direct
+SPEED_MIN   = 0x01
+SPEED_MAX   = 0x0f
+
+class Latest(object):
+    """Single-slot handoff between two threads, newer items replace older ones"""
+    def __init__(self):
+        self.item       = None
+        self.dropped    = 0
+        self._cond      = threading.Condition()
+
+    def put(self, item):
+        with self._cond:
+            if(self.item is not None):
+                self.dropped += 1
+            self.item = item
+            self._cond.notify()
+
+    def get(self, timeout=None):
+        """Takes the newest item, waits up to timeout for one. None if there is none"""
+        with self._cond:
+            if(self.item is None):
+                self._cond.wait(timeout)
+            item, self.item = self.item, None
+            return item
+
+class PID(object):
+    def __init__(self, kp=1.0, ki=0.0, kd=0.0, limit=1.0):
+        self.kp         = kp
+        self.ki         = ki
+        self.kd         = kd
+        #Output and integral clamp
+        self.limit      = limit
+        self.integral   = 0.0
+        self.last       = None
+
+    def reset(self):
+        self.integral = 0.0
+        self.last = None
+
+    def update(self, error, dt):
+        """Controller output for error, dt seconds after the last update"""
+        deriv = 0.0
+        if(self.last is not None and dt > 0):
+            deriv = (error - self.last)/dt
+        self.last = error
+        if(self.ki):
+            self.integral = max(-self.limit, min(self.limit, self.integral + error*dt*self.ki))
+        out = self.kp*error + self.integral + self.kd*deriv
+        return max(-self.limit, min(self.limit, out))
+
+class Stage(object):
+    """Latency and throughput of one pipeline stage"""
+    def __init__(self, size=120):
+        self.latency    = deque(maxlen=size)   #Seconds from capture to the end of the stage
+        self.stamps     = deque(maxlen=size)   #time.monotonic() the stage finished
+        self.count      = 0
+
+    def record(self, captured, now):
+        self.latency.append(now - captured)
+        self.stamps.append(now)
+        self.count += 1
+
+    def report(self):
+        latency = sorted(self.latency)
+        stamps = self.stamps
+        fps = 0.0
+        if(len(stamps) > 1 and stamps[-1] > stamps[0]):
+            fps = (len(stamps) - 1)/(stamps[-1] - stamps[0])
+        return {
+            "count"     : self.count,
+            "fps"       : fps,
+            "mean_ms"   : 1000*sum(latency)/len(latency) if latency else 0.0,
+            "p50_ms"    : 1000*latency[len(latency)//2] if latency else 0.0,
+            "max_ms"    : 1000*latency[-1] if latency else 0.0,
+        }
+
+class Tracker(object):
+    def __init__(self, camera, capture, detector, mode="steer", calibration=None,
+                 kp=1.0, ki=0.0, kd=0.05, deadband=0.05, lost_after=0.5):
+        """capture: anything with read() -> (ok, frame), e.g. cv2.VideoCapture.
+        detector: fn(frame) -> (x, y, radius) in pixels or None. Without a
+        detector, capture already delivers detections through get(timeout),
+        like a vision.VisionPool"""
+        if(mode not in ("steer", "direct")):
+            raise ValueError("mode must be 'steer' or 'direct'")
+        self.camera         = camera
+        self.capture        = capture
+        self.detector       = detector
+        self.mode           = mode
+        self.calibration    = calibration or Calibration()
+        self.pan            = PID(kp, ki, kd)
+        self.tilt           = PID(kp, ki, kd)
+        #Centre offset (fraction of half the image) inside which an axis holds still
+        self.deadband       = deadband
+        self.lost_after     = lost_after
+
+        self.capture_stage  = Stage()
+        self.detect_stage   = Stage()
+        self.control_stage  = Stage()
+        #Latency of the camera command alone, fps is commands per second
+        self.command_stage  = Stage()
+        #Newest detection, (captured, x, y, radius) or None
+        self.target         = None
+        self.failed         = 0
+
+        self._frames        = Latest()
+        self._detections    = Latest()
+        self._threads       = []
+        self._stop          = threading.Event()
+        self._last_msg      = None
+
+    def start(self):
+        if(not self._threads):
+            self._stop.clear()
+            loops = (self._captureLoop, self._detectLoop)
+            if(self.detector is None):
+                loops = (self._sourceLoop,)
+            for fn in loops + (self._controlLoop,):
+                thread = threading.Thread(target=fn, daemon=True)
+                thread.start()
+                self._threads.append(thread)
+        return self
+
+    def stop(self):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        self._send(fixed["pt_stop"])
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    # ----------------------------------------------------------------- threads
+    def _captureLoop(self):
+        while not self._stop.is_set():
+            start = time.monotonic()
+            ok, frame = self.capture.read()
+            if(not ok):
+                time.sleep(0.01)
+                continue
+            now = time.monotonic()
+            #Capture latency is the time read() blocked
+            self.capture_stage.record(start, now)
+            self._frames.put((now, frame))
+
+    def _detectLoop(self):
+        while not self._stop.is_set():
+            item = self._frames.get(0.1)
+            if(item is None):
+                continue
+            captured, frame = item
+            found = self.detector(frame)
+            self.detect_stage.record(captured, time.monotonic())
+            height, width = frame.shape[:2]
+            self._detections.put((captured, found, width, height))
+
+    def _sourceLoop(self):
+        #Detections made elsewhere, (captured, found, width, height)
+        while not self._stop.is_set():
+            item = self.capture.get(0.1)
+            if(item is None):
+                continue
+            self.detect_stage.record(item[0], time.monotonic())
+            self._detections.put(item)
+
+    def _controlLoop(self):
+        last_seen = time.monotonic()
+        last_update = None
+        while not self._stop.is_set():
+            item = self._detections.get(0.1)
+            now = time.monotonic()
+            if(item is None or item[1] is None):
+                if(now - last_seen > self.lost_after and self._last_msg != fixed["pt_stop"]):
+                    self._lost()
+                continue
+            captured, (x, y, radius), width, height = item
+            last_seen = now
+            self.target = (captured, x, y, radius)
+
+            dt = 0.0 if last_update is None else now - last_update
+            last_update = now
+            x, y = self._aim(captured, x, y, width, height, now)
+            #Right and down positive, as fractions of half the image
+            ex = (x - width/2)/(width/2)
+            ey = (y - height/2)/(height/2)
+            ux, uy = self._control(ex, ey, dt, width, height)
+
+            if(self.mode == "steer"):
+                msg = self._steer(ux, uy)
+            else:
+                msg = self._direct(x, y, ux, uy, width, height)
+            if(msg is not None):
+                self._send(msg)
+            self.control_stage.record(captured, time.monotonic())
+
+    # ----------------------------------------------------------------- control
+    def _aim(self, captured, x, y, width, height, now):
+        """Pixel to steer for, given the detection at x, y"""
+        return x, y
+
+    def _lost(self):
+        self.target = None
+        self.pan.reset()
+        self.tilt.reset()
+        self._send(fixed["pt_stop"])
+
+    def _control(self, ex, ey, dt, width, height):
+        """Pan and tilt outputs (-1 .. 1) for the centre offsets ex, ey"""
+        return self._axis(self.pan, ex, dt), self._axis(self.tilt, ey, dt)
+
+    def _axis(self, pid, error, dt):
+        if(abs(error) < self.deadband):
+            pid.reset()
+            return 0.0
+        return pid.update(error, dt)
+
+    @staticmethod
+    def _speed(u):
+        return max(SPEED_MIN, min(SPEED_MAX, int(round(abs(u)*SPEED_MAX))))
+
+    def _steer(self, ux, uy):
+        #Pan 1 left, 2 right; tilt 1 up, 2 down; 3 holds the axis
+        panDir = 3 if ux == 0 else (2 if ux > 0 else 1)
+        tiltDir = 3 if uy == 0 else (2 if uy > 0 else 1)
+        if(panDir == 3 and tiltDir == 3):
+            return fixed["pt_stop"]
+        return steer_messages[self._speed(ux), self._speed(uy), panDir, tiltDir]
+
+    def _direct(self, x, y, ux, uy, width, height):
+        if(ux == 0 and uy == 0):
+            return None
+        pt = self.camera.inquire("q_pt")
+        zoom = self.camera.state.get("zoom")
+        if(zoom is None):
+            zoom = self.camera.inquire("q_zoompos")
+        if(pt is None or zoom is None):
+            return None
+        #Pixels scaled to the resolution the calibration was made at
+        cal = self.calibration
+        x = x*cal.width/width
+        y = y*cal.height/height
+        pan, tilt = cal.pixelTarget(x, y, pt.pan, pt.tilt, zoom)
+        pan = pt.pan + abs(ux)*(float(pan) - pt.pan)
+        tilt = pt.tilt + abs(uy)*(float(tilt) - pt.tilt)
+        return encoders["pt_direct"](self._speed(ux), self._speed(uy), int(round(pan)), int(round(tilt)))
+
+    def _send(self, msg):
+        #The same steer twice changes nothing, pt_direct always goes out
+        if(msg == self._last_msg and self.mode == "steer"):
+            return
+        self._last_msg = msg
+        start = time.monotonic()
+        if(self.camera._execute([(msg, "Tracking status")]) != stat_OK):
+            self.failed += 1
+        self.command_stage.record(start, time.monotonic())
+
+    def stats(self):
+        """Per-stage fps and latency from capture, in milliseconds, plus dropped frames.
+        "command" is the camera command alone, its fps the commands per second"""
+        return {
+            "capture"           : self.capture_stage.report(),
+            "detect"            : self.detect_stage.report(),
+            "control"           : self.control_stage.report(),
+            "command"           : self.command_stage.report(),
+            "dropped_frames"    : self._frames.dropped,
+            "dropped_detections": self._detections.dropped,
+            "failed"            : self.failed,
+        }
+
+class Kalman(object):
+    """Constant velocity Kalman filter, one independent filter per axis"""
+    def __init__(self, accel=60.0, noise=0.2):
+        #Standard deviation of the target's acceleration and of a measurement
+        self.accel      = accel
+        self.noise      = noise
+        #(axes, 2) position and velocity, (axes, 2, 2) covariance, time of the estimate
+        self.x          = None
+        self.P          = None
+        self.t          = None
+
+    def reset(self):
+        self.x = self.P = self.t = None
+
+    def update(self, t, z):
+        """Adds measurement z (one value per axis) taken at time t"""
+        z = np.asarray(z, dtype=float)
+        if(self.x is None):
+            #Position as measured, velocity unknown
+            self.x = np.stack([z, np.zeros_like(z)], axis=1)
+            self.P = np.tile(np.diag([self.noise**2, 1e4]), (len(z), 1, 1))
+            self.t = t
+            return
+        dt = max(t - self.t, 0.0)
+        self.t = max(t, self.t)
+        F = np.array([[1.0, dt], [0.0, 1.0]])
+        Q = self.accel**2*np.array([[dt**4/4, dt**3/2], [dt**3/2, dt**2]])
+        x = self.x @ F.T
+        P = F @ self.P @ F.T + Q
+        #Only the position is measured
+        S = P[:, 0, 0] + self.noise**2
+        K = P[:, :, 0]/S[:, None]
+        self.x = x + K*(z - x[:, 0])[:, None]
+        self.P = P - K[:, :, None]*P[:, None, 0, :]
+
+    def predict(self, t):
+        """Positions expected at time t"""
+        return self.x[:, 0] + self.x[:, 1]*(t - self.t)
+
+    @property
+    def velocity(self):
+        return self.x[:, 1]
+
+class PredictiveTracker(Tracker):
+    def __init__(self, camera, capture, detector, accel=60.0, noise=0.2, extra_latency=0.05,
+                 max_lookahead=0.5, hysteresis=2, **kwargs):
+        """accel (deg/s^2), noise (deg): Kalman tuning. extra_latency: seconds
+        between exposure and read() returning, which cannot be measured here"""
+        super().__init__(camera, capture, detector, **kwargs)
+        if(self.mode != "steer"):
+            raise ValueError("PredictiveTracker steers, mode must be 'steer'")
+        self.filter         = Kalman(accel, noise)
+        self.extra_latency  = extra_latency
+        self.max_lookahead  = max_lookahead
+        #Speed byte change below which a running steer is left alone
+        self.hysteresis     = hysteresis
+        #Seconds from exposure to the camera acting, used for the last prediction
+        self.lookahead      = 0.0
+        #Steers not sent thanks to the hysteresis
+        self.held           = 0
+
+        #Degrees per second of pan and tilt at full steer speed
+        cal = self.calibration
+        pan, tilt = cal.toCounts(0.0, 0.0)
+        pan_deg, tilt_deg = cal.toDegrees(pan + MAX_SPEED[0], tilt + MAX_SPEED[1])
+        self._rates         = np.array([abs(float(pan_deg)), abs(float(tilt_deg))])
+        #Dead reckoned camera direction: (since, degrees then, deg/s) per steer sent
+        self._motion        = deque([(0.0, np.zeros(2), np.zeros(2))], maxlen=64)
+
+    def _camera(self, t):
+        """Camera direction at time t, relative to where tracking started"""
+        for since, start, rate in reversed(self._motion):
+            if(t >= since):
+                return start + rate*(t - since)
+        return self._motion[0][1]
+
+    def _aim(self, captured, x, y, width, height, now):
+        cal = self.calibration
+        zoom = self.camera.state.get("zoom") or 0
+        #Target direction in the same frame as the dead reckoned camera
+        dx, dy = cal.pixelsToDegrees(x*cal.width/width, y*cal.height/height, zoom)
+        exposed = captured - self.extra_latency
+        self.filter.update(exposed, self._camera(exposed) + (float(dx), float(dy)))
+
+        #Where the target and the camera will be once the next command acts
+        link = self.command_stage.latency
+        acting = now + (sum(link)/len(link) if link else 0.0)
+        self.lookahead = min(self.max_lookahead, acting - exposed)
+        offset = self.filter.predict(exposed + self.lookahead) - self._camera(exposed + self.lookahead)
+        px, py = cal.degreesToPixels(offset[0], offset[1], zoom)
+        return float(px)*width/cal.width, float(py)*height/cal.height
+
+    def _control(self, ex, ey, dt, width, height):
+        ux, uy = super()._control(ex, ey, dt, width, height)
+        #Feed forward the target's own speed, so a moving target is matched
+        #instead of chased. Tilt output is positive downwards
+        ff = self.filter.velocity/self._rates
+        ff[1] = -ff[1]
+        running = self._rate(self._last_msg or b'')/self._rates
+        running[1] = -running[1]
+        out = []
+        for k, (u, error) in enumerate(((ux, ex), (uy, ey))):
+            if(abs(error) < self.deadband):
+                #Will be on target: the axis keeps what it is doing while
+                #that is about the target's speed, otherwise it just follows
+                u = running[k] if abs(running[k] - ff[k])*SPEED_MAX < self.hysteresis else ff[k]
+            else:
+                u = u + ff[k]
+            #Less than half the slowest speed rounds to standing still
+            out.append(0.0 if abs(u)*SPEED_MAX < 0.5 else max(-1.0, min(1.0, float(u))))
+        return out[0], out[1]
+
+    def _send(self, msg):
+        last = self._last_msg
+        super()._send(msg)
+        if(self._last_msg is not last):
+            #The new steer runs from now, as far as the camera model goes
+            now = time.monotonic()
+            self._motion.append((now, self._camera(now), self._rate(msg)))
+
+    def _rate(self, msg):
+        """Degrees per second (pan right, tilt up) of a steer message"""
+        if(len(msg) != 7 or msg[:3] != fixed["pt_stop"][:3]):
+            return np.zeros(2)
+        sign = {1: -1.0, 2: 1.0, 3: 0.0}
+        return self._rates*(sign[msg[5]]*msg[3], -sign[msg[6]]*msg[4])/SPEED_MAX
+
+    def _lost(self):
+        self.filter.reset()
+        super()._lost()
+
+    def _steer(self, ux, uy):
+        msg = super()._steer(ux, uy)
+        last = self._last_msg
+        #Same directions and nearly the same speeds: keep the running steer
+        if(last is not None and msg != last and len(msg) == len(last) == 7 and
+           last[:3] == msg[:3] and last[5:] == msg[5:] and
+           abs(last[3] - msg[3]) < self.hysteresis and abs(last[4] - msg[4]) < self.hysteresis):
+            self.held += 1
+            return None
+        return msg
+
+    def stats(self):
+        stats = super().stats()
+        stats["lookahead_ms"] = 1000*self.lookahead
+        stats["held"] = self.held
+        if(self.filter.x is not None):
+            #Target speed, pan and tilt in deg/s
+            stats["velocity"] = tuple(float(v) for v in self.filter.velocity)
+        return stats
@@ -0,0 +1,254 @@
+import time
+
+import numpy as np
+
+from .coords import Calibration
+from .visca import encoders, fixed
+from .pipeline import PipelinedController
+from .state import POSITIONS
+from .tandberg import stat_OK, stat_FAIL
+
+# Smooth pan/tilt(/zoom) moves through waypoints:
+#
+#   path = Trajectory([(0, 0), (40, 10), (-30, -5)], units="deg")
+#   schedule = path.compile(linkRate(cam))
+#   schedule.run(cam, feedback=telemetry)
+#
+# Every leg starts and ends at rest. The axis that needs longest sets the
+# duration of a leg and the others follow the same normalised profile, so
+# all axes arrive together. Velocity ramps are raised cosines: acceleration
+# is continuous and peaks at max_accel.
+#
+# compile() samples the path at the command rate and encodes every message
+# up front, so Schedule.run() only waits, compares and writes:
+#   "direct"    pt_direct to the next sample, speed byte scaled to the step
+#   "velocity"  steer with speed and direction of the current step, only
+#               sent when they change
+# Zoom, if given, follows as zoom_direct whenever its count changes. The last
+# tick always moves to the end point at full speed. A PipelinedController
+# keeps up with the schedule; a plain Controller waits for every completion.
+
+#Travel in counts/second at speed byte 0x0f, and acceleration limits
+MAX_SPEED   = (400.0, 200.0, 1140.0)
+MAX_ACCEL   = (800.0, 400.0, 2280.0)
+
+#Speed bytes accepted by pt_direct and steer
+SPEED_MIN   = 0x01
+SPEED_MAX   = 0x0f
+
+class Trajectory(object):
+    """Time-parameterised path through waypoints, positions in raw counts"""
+    def __init__(self, waypoints, units="counts", max_speed=MAX_SPEED, max_accel=MAX_ACCEL, dwell=0.0,
+                 calibration=None):
+        points = np.array(waypoints, dtype=float)
+        if(points.ndim != 2 or len(points) < 2 or points.shape[1] not in (2, 3)):
+            raise ValueError("Need at least two (pan, tilt) or (pan, tilt, zoom) waypoints")
+        if(units == "deg"):
+            #Degrees go through the camera's calibration, nominal if none is given
+            calibration = calibration or Calibration()
+            points[:, 0], points[:, 1] = calibration.toCounts(points[:, 0], points[:, 1])
+        elif(units != "counts"):
+            raise ValueError("units must be 'counts' or 'deg'")
+
+        axes = points.shape[1]
+        self.points     = points
+        self.delta      = np.diff(points, axis=0)
+        self.max_speed  = np.array(max_speed[:axes], dtype=float)
+        self.max_accel  = np.array(max_accel[:axes], dtype=float)
+
+        #Per leg and axis: time to cover the distance at rest-to-rest.
+        #A full ramp lasts ta and covers vmax*ta/2; shorter moves never reach vmax
+        dist    = np.abs(self.delta)
+        vmax    = self.max_speed
+        amax    = self.max_accel
+        ta      = np.pi*vmax/(2*amax)
+        full    = dist >= vmax*ta
+        vpeak   = np.sqrt(2*amax*dist/np.pi)
+        t_axis  = np.where(full, 2*ta + (dist - vmax*ta)/vmax, np.pi*vpeak/amax)
+        ramp    = np.where(full, ta, np.pi*vpeak/(2*amax))
+
+        lead = np.argmax(t_axis, axis=1)
+        legs = np.arange(len(lead))
+        #Leg duration and ramp time of its leading axis
+        self.durations  = t_axis[legs, lead]
+        self.ramps      = ramp[legs, lead]
+        self.dwell      = dwell
+        self.starts     = np.concatenate(([0.0], np.cumsum(self.durations + dwell)[:-1]))
+        self.duration   = float(self.starts[-1] + self.durations[-1])
+
+    def sample(self, t):
+        """Positions (len(t) x axes) at times t, in seconds from the start"""
+        t = np.clip(np.asarray(t, dtype=float), 0.0, self.duration)
+        leg = np.clip(np.searchsorted(self.starts, t, side='right') - 1, 0, len(self.durations) - 1)
+        T   = self.durations[leg]
+        Ta  = self.ramps[leg]
+        tau = np.minimum(t - self.starts[leg], T)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            #Cruise speed in leg fractions per second, same for full and short moves
+            v   = 1.0/(T - Ta)
+            rem = T - tau
+            up  = v/2*(tau - Ta/np.pi*np.sin(np.pi*tau/Ta))
+            mid = v*(tau - Ta/2)
+            dn  = 1.0 - v/2*(rem - Ta/np.pi*np.sin(np.pi*rem/Ta))
+            s = np.where(tau < Ta, up, np.where(rem < Ta, dn, mid))
+        s = np.where(T > 0, s, 1.0)
+        return self.points[leg] + s[:, None]*self.delta[leg]
+
+    def compile(self, rate, mode="direct"):
+        """Samples the path every 1/rate seconds and encodes the command for each tick"""
+        dt = 1.0/rate
+        t = np.append(np.arange(0.0, self.duration, dt), self.duration)
+        path = self.sample(t)
+        counts = np.rint(path).astype(int)
+
+        #Speed byte that covers each step within one tick
+        step = np.diff(path, axis=0)*rate
+        speed = np.ceil(np.abs(step)/self.max_speed*SPEED_MAX)
+        speed = np.clip(speed, SPEED_MIN, SPEED_MAX).astype(int)
+
+        pt_direct = encoders["pt_direct"]
+        zoom_direct = encoders["zoom_direct"]
+        zoom = self.points.shape[1] == 3
+
+        times, messages, targets, corrections = [], [], [], []
+        last_msg = None
+        last_zoom = counts[0, 2] if zoom else None
+        for k in range(len(t) - 1):
+            pan, tilt = int(counts[k + 1, 0]), int(counts[k + 1, 1])
+            if(mode == "direct"):
+                msg = pt_direct(int(speed[k, 0]), int(speed[k, 1]), pan, tilt)
+                if(counts[k + 1, 0] == counts[k, 0] and counts[k + 1, 1] == counts[k, 1]):
+                    msg = None
+            elif(mode == "velocity"):
+                panDir = 2 if step[k, 0] > 0.5 else (1 if step[k, 0] < -0.5 else 3)
+                tiltDir = 1 if step[k, 1] > 0.5 else (2 if step[k, 1] < -0.5 else 3)
+                msg = encoders["steer"](int(speed[k, 0]), int(speed[k, 1]), panDir, tiltDir)
+                if(panDir == 3 and tiltDir == 3):
+                    msg = fixed["pt_stop"]
+            else:
+                raise ValueError("mode must be 'direct' or 'velocity'")
+
+            tick = []
+            if(msg is not None and msg != last_msg):
+                tick.append(msg)
+                last_msg = msg
+            if(zoom and counts[k + 1, 2] != last_zoom):
+                last_zoom = counts[k + 1, 2]
+                tick.append(zoom_direct(int(last_zoom)))
+            if(tick):
+                times.append(float(t[k]))
+                messages.append(tuple(tick))
+                targets.append((pan, tilt))
+                corrections.append(pt_direct(SPEED_MAX, SPEED_MAX, pan, tilt))
+
+        #Settle exactly on the end point, whatever ticks were skipped on the way
+        end = (int(counts[-1, 0]), int(counts[-1, 1]))
+        tick = [pt_direct(SPEED_MAX, SPEED_MAX, *end)]
+        if(mode == "velocity"):
+            tick.insert(0, fixed["pt_stop"])
+        if(zoom):
+            tick.append(zoom_direct(int(counts[-1, 2])))
+        times.append(self.duration)
+        messages.append(tuple(tick))
+        targets.append(end)
+        corrections.append(tick[-1] if not zoom else tick[-2])
+        return Schedule(times, messages, targets, corrections, t, path[:, :2])
+
+class Schedule(object):
+    """Precomputed command stream of a Trajectory"""
+    def __init__(self, times, messages, targets, corrections, plan_times=None, plan=None):
+        #Send time of every tick, seconds from the start
+        self.times          = times
+        #Messages of every tick
+        self.messages       = messages
+        #(pan, tilt) counts the camera should be heading for at every tick
+        self.targets        = targets
+        #Full speed pt_direct to the target, sent instead when the camera drifted
+        self.corrections    = corrections
+        #Planned (pan, tilt) counts at plan_times, what feedback is compared with
+        self.plan_times     = plan_times
+        self.plan           = plan
+        #Ticks between position checks, and the drift (counts) that triggers a correction
+        self.check_every    = 5
+        self.tolerance      = 8
+        #Older feedback samples (seconds) are ignored
+        self.max_age        = 0.2
+
+        self.sent           = 0
+        self.skipped        = 0
+        self.corrected      = 0
+        self.failed         = 0
+
+    def __len__(self):
+        return len(self.times)
+
+    def run(self, camera, feedback=None):
+        """Streams the schedule to camera in real time, returns the success code.
+
+        feedback is anything with a latest() returning a sample with pan and
+        tilt counts (a running Telemetry); it is checked every check_every
+        ticks. Ticks the link could not keep up with are skipped.
+        """
+        self.sent = self.skipped = self.corrected = self.failed = 0
+        pipelined = isinstance(camera, PipelinedController)
+        futures = []
+
+        def send(msg):
+            if(pipelined):
+                #Only blocks while both command buffers are taken
+                futures.append(camera.submit(msg))
+            elif(camera.send(msg) != stat_OK):
+                self.failed += 1
+
+        #The moves bypass _execute, so the cached position is meaningless now
+        camera.state.invalidate(POSITIONS)
+        times = self.times
+        last = len(times) - 1
+        start = time.monotonic()
+        k = 0
+        while k <= last:
+            now = time.monotonic() - start
+            if(now < times[k]):
+                time.sleep(times[k] - now)
+            elif(k < last and now >= times[k + 1]):
+                self.skipped += 1
+                k += 1
+                continue
+
+            if(feedback is not None and k % self.check_every == 0 and self._drifted(feedback.latest(), start)):
+                    #Same target at full speed, instead of this tick's messages
+                    send(self.corrections[k])
+                    self.corrected += 1
+                    k += 1
+                    continue
+            for msg in self.messages[k]:
+                send(msg)
+            self.sent += 1
+            k += 1
+
+        for future in futures:
+            try:
+                if(future.result(camera.timeout) != stat_OK):
+                    self.failed += 1
+            except Exception:
+                self.failed += 1
+        camera.state.invalidate(POSITIONS)
+        return stat_OK if self.failed == 0 else stat_FAIL
+
+    def _drifted(self, sample, start):
+        """True if sample is off the path where the camera should have been when it was taken"""
+        if(sample is None or self.plan is None):
+            return False
+        t = sample.t - start
+        if(t < 0 or time.monotonic() - sample.t > self.max_age):
+            return False
+        pan = np.interp(t, self.plan_times, self.plan[:, 0])
+        tilt = np.interp(t, self.plan_times, self.plan[:, 1])
+        return abs(sample.pan - pan) > self.tolerance or abs(sample.tilt - tilt) > self.tolerance
+
+def linkRate(camera, headroom=0.8, limit=50.0):
+    """Commands per second the link carries: a pt_direct frame out, its completion back"""
+    baudrate = camera.baudrate or 9600
+    size = 1 + len(encoders["pt_direct"](1, 1, 0, 0)) + 1 + 3
+    return min(limit, headroom*baudrate/10.0/size)
@@ -0,0 +1,313 @@
+from collections import namedtuple
+
+# Declarative VISCA codec for the PrecisionHD 1080p. Every command and
+# inquiry the library uses is described once below; the lookup tables,
+# message encoders and reply decoders are generated from it at import time
+# so nothing is rebuilt per call.
+#
+# Messages here are the bytes between the address byte and the 0xFF
+# terminator, which is what Controller.send takes.
+#
+# Parameter / reply field types:
+#   'b'   one raw byte (speeds, directions, modes)
+#   'n2'  8 bit value as 2 nibbles  0p 0q
+#   'n4'  16 bit value as 4 nibbles 0p 0q 0r 0s
+#   'n8'  32 bit value as 8 nibbles
+
+#name : (message prefix, parameter types, message suffix)
+commands = {
+    "clear"             : (b'\x01\x00\x01', (), b''),
+    "address_set"       : (b'\x30', ('b',), b''),
+    "power_on"          : (b'\x01\x04\x00\x02', (), b''),
+    "power_off"         : (b'\x01\x04\x00\x03', (), b''),
+    "vid_format"        : (b'\x01\x35\x00', ('b',), b'\x00'),
+    "wb_auto"           : (b'\x01\x04\x35\x00', (), b''),
+    "wb_manual"         : (b'\x01\x04\x35\x06', (), b''),
+    "wb_table"          : (b'\x01\x04\x75', ('n4',), b''),
+    "ae_auto"           : (b'\x01\x04\x39\x00', (), b''),
+    "ae_manual"         : (b'\x01\x04\x39\x03', (), b''),
+    "iris"              : (b'\x01\x04\x4B', ('n4',), b''),
+    "gain"              : (b'\x01\x04\x4C', ('n4',), b''),
+    "backlight_on"      : (b'\x01\x04\x33\x02', (), b''),
+    "backlight_off"     : (b'\x01\x04\x33\x03', (), b''),
+    "mirror_on"         : (b'\x01\x04\x61\x02', (), b''),
+    "mirror_off"        : (b'\x01\x04\x61\x03', (), b''),
+    "flip_on"           : (b'\x01\x04\x66\x02', (), b''),
+    "flip_off"          : (b'\x01\x04\x66\x03', (), b''),
+    "gamma_auto"        : (b'\x01\x04\x51\x02', (), b''),
+    "gamma_manual"      : (b'\x01\x04\x51\x03', (), b''),
+    "gamma_table"       : (b'\x01\x04\x52', ('n4',), b''),
+    "mm_detect_on"      : (b'\x01\x50\x30\x01', (), b''),
+    "mm_detect_off"     : (b'\x01\x50\x30\x00', (), b''),
+    "call_led_on"       : (b'\x01\x33\x01\x01', (), b''),
+    "call_led_off"      : (b'\x01\x33\x01\x00', (), b''),
+    "call_led_blink"    : (b'\x01\x33\x01\x02', (), b''),
+    "pwr_led_on"        : (b'\x01\x33\x02\x01', (), b''),
+    "pwr_led_off"       : (b'\x01\x33\x02\x00', (), b''),
+    "best_view"         : (b'\x01\x50\x60', ('b', 'b'), b''),
+    "zoom_drive"        : (b'\x01\x04\x07', ('b',), b''),
+    "focus_drive"       : (b'\x01\x04\x08', ('b',), b''),
+    "zoom_direct"       : (b'\x01\x04\x47', ('n4',), b''),
+    "zoomfocus_direct"  : (b'\x01\x04\x47', ('n4', 'n4'), b''),
+    "focus_direct"      : (b'\x01\x04\x48', ('n4',), b''),
+    "focus_auto_on"     : (b'\x01\x04\x38\x02', (), b''),
+    "focus_auto_off"    : (b'\x01\x04\x38\x03', (), b''),
+    "steer"             : (b'\x01\x06\x01', ('b', 'b', 'b', 'b'), b''),
+    "pt_stop"           : (b'\x01\x06\x01\x03\x03\x03\x03', (), b''),
+    "pt_reset"          : (b'\x01\x06\x05', (), b''),
+    "pt_direct"         : (b'\x01\x06\x02', ('b', 'b', 'n4', 'n4'), b''),
+    "ptzf"              : (b'\x01\x06\x20', ('n4', 'n4', 'n4', 'n4'), b''),
+    "reboot"            : (b'\x01\x42', (), b''),
+    "speed_9600"        : (b'\x01\x34\x00', (), b''),
+    "speed_115200"      : (b'\x01\x34\x01', (), b''),
+}
+
+#name : (lo, hi) per parameter, None for the whole range of its type.
+#Positions are 12 bit; anything else would go out as a far off position
+limits = {
+    "zoom_direct"       : ((0, 0x0fff),),
+    "zoomfocus_direct"  : ((0, 0x0fff), (0, 0x0fff)),
+    "focus_direct"      : ((0, 0x0fff),),
+    "pt_direct"         : (None, None, (0, 0x0fff), (0, 0x0fff)),
+    "ptzf"              : ((0, 0x0fff), (0, 0x0fff), (0, 0x0fff), (0, 0x0fff)),
+}
+
+#name : (message, reply field types after the 0x50 completion byte)
+inquiries = {
+    "q_camid"       : (b'\x09\x04\x22', ('b', 'b', 'b', 'b')),
+    "q_zoompos"     : (b'\x09\x04\x47', ('n4',)),
+    "q_fPos"        : (b'\x09\x04\x48', ('n4',)),
+    "q_fMode"       : (b'\x09\x04\x38', ('b',)),
+    "q_pt"          : (b'\x09\x06\x12', ('n4', 'n4')),
+    "q_pwr"         : (b'\x09\x04\x00', ('b',)),
+    "q_wbMode"      : (b'\x09\x04\x35', ('b',)),
+    "q_wbTable"     : (b'\x09\x04\x75', ('n4',)),
+    "q_aeMode"      : (b'\x09\x04\x39', ('b',)),
+    "q_blacklight"  : (b'\x09\x04\x33', ('b',)),
+    "q_mirror"      : (b'\x09\x04\x61', ('b',)),
+    "q_flip"        : (b'\x09\x04\x66', ('b',)),
+    "q_gMode"       : (b'\x09\x04\x51', ('b',)),
+    "q_gTable"      : (b'\x09\x04\x52', ('n4',)),
+    "q_callLed"     : (b'\x09\x01\x33\x01', ('b',)),
+    "q_pwrLed"      : (b'\x09\x01\x33\x02', ('b',)),
+    "q_vidSys"      : (b'\x09\x06\x23', ('n4',)),
+    "q_vidSW"       : (b'\x09\x06\x24', ('n4',)),
+    "q_alsRGain"    : (b'\x09\x50\x50', ('n8',)),
+    "q_alsBGain"    : (b'\x09\x50\x51', ('n8',)),
+    "q_alsGGain"    : (b'\x09\x50\x52', ('n8',)),
+    "q_alsWGain"    : (b'\x09\x50\x53', ('n8',)),
+    "q_bestView"    : (b'\x09\x50\x60', ('n2', 'n2')),
+    "q_invert"      : (b'\x09\x50\x70', ('b',)),
+}
+
+#Argument tables used by the Controller methods
+VIDEO_FORMATS = {
+    "1080p25"   : 0x00,
+    "1080p30"   : 0x01,
+    "1080p50"   : 0x02,
+    "1080p60"   : 0x03,
+    "720p25"    : 0x04,
+    "720p30"    : 0x05,
+    "720p50"    : 0x06,
+    "720p60"    : 0x07,
+}
+
+#direction : (pan, tilt) byte
+STEER_DIRECTIONS = {
+    'up'        : (0x03, 0x01),
+    'down'      : (0x03, 0x02),
+    'left'      : (0x01, 0x03),
+    'right'     : (0x02, 0x03),
+    'upleft'    : (0x01, 0x01),
+    'upright'   : (0x02, 0x01),
+    'downleft'  : (0x01, 0x02),
+    'downright' : (0x02, 0x02),
+}
+
+#Field widths in message bytes
+_width = {'b': 1, 'n2': 2, 'n4': 4, 'n8': 8}
+
+def toNibbles(value, count=4):
+    """Encodes value as count nibbles, most significant first (0p 0q 0r 0s).
+    ValueError if it does not fit"""
+    if(not 0 <= value < 1 << 4*count):
+        raise ValueError("%d does not fit in %d nibbles" % (value, count))
+    return bytes((value >> (4*i)) & 0x0f for i in range(count - 1, -1, -1))
+
+def fromNibbles(data):
+    """Inverse of toNibbles"""
+    value = 0
+    for n in data:
+        value = (value << 4) | (n & 0x0f)
+    return value
+
+#Every 16 bit position the camera uses fits in 12 bits, so those are precomputed
+_N4 = [toNibbles(v) for v in range(0x1000)]
+
+def toVisca2b(value):
+    """16 bit value as 4 nibbles, table driven for the common range"""
+    if(0 <= value < 0x1000):
+        return _N4[value]
+    return toNibbles(value)
+
+_encoders_by_type = {
+    'b'     : lambda v : bytes((v,)),
+    'n2'    : lambda v : toNibbles(v, 2),
+    'n4'    : toVisca2b,
+    'n8'    : lambda v : toNibbles(v, 8),
+}
+
+def _compileEncoder(prefix, params, suffix):
+    #Only bytes and 16 bit values appear in practice, those get a direct path
+    if(all(p == 'b' for p in params)):
+        if(suffix):
+            def encode(*args):
+                return prefix + bytes(args) + suffix
+        else:
+            def encode(*args):
+                return prefix + bytes(args)
+    elif(all(p == 'n4' for p in params) and not suffix):
+        def encode(*args):
+            return prefix + b''.join(map(toVisca2b, args))
+    else:
+        fns = [_encoders_by_type[p] for p in params]
+        def encode(*args):
+            return b''.join((prefix, *[fn(a) for fn, a in zip(fns, args)], suffix))
+    return encode
+
+def _checkLimits(name, encode, bounds):
+    def check(*args):
+        for value, bound in zip(args, bounds):
+            if(bound is not None and not bound[0] <= value <= bound[1]):
+                raise ValueError("%s: %d outside %d..%d" % (name, value, bound[0], bound[1]))
+        return encode(*args)
+    return check
+
+def _fieldReader(kind, offset):
+    o = offset
+    if(kind == 'b'):
+        return lambda r : r[o]
+    if(kind == 'n2'):
+        return lambda r : (r[o] & 15) << 4 | (r[o+1] & 15)
+    if(kind == 'n4'):
+        return lambda r : (r[o] & 15) << 12 | (r[o+1] & 15) << 8 | (r[o+2] & 15) << 4 | (r[o+3] & 15)
+    return lambda r : fromNibbles(r[o:o + _width[kind]])
+
+def _compileDecoder(fields):
+    #Fields start after the 0x50 completion byte
+    readers = []
+    offset = 1
+    for kind in fields:
+        readers.append(_fieldReader(kind, offset))
+        offset += _width[kind]
+    size = offset
+
+    if(len(readers) == 1):
+        f0, = readers
+        def decode(resp):
+            return (f0(resp),) if len(resp) >= size else None
+    elif(len(readers) == 2):
+        f0, f1 = readers
+        def decode(resp):
+            return (f0(resp), f1(resp)) if len(resp) >= size else None
+    else:
+        def decode(resp):
+            return tuple([f(resp) for f in readers]) if len(resp) >= size else None
+    return decode
+
+#Complete messages of the commands without parameters
+fixed       = {}
+#name -> encoder(*args) for commands with parameters
+encoders    = {}
+#name -> decoder(resp) for inquiry replies, resp = bytes after the address
+decoders    = {}
+
+for _name, (_prefix, _params, _suffix) in commands.items():
+    if(_params):
+        encoders[_name] = _compileEncoder(_prefix, _params, _suffix)
+        if(_name in limits):
+            encoders[_name] = _checkLimits(_name, encoders[_name], limits[_name])
+    else:
+        fixed[_name] = _prefix + _suffix
+
+#(pan speed, tilt speed, pan direction, tilt direction) -> steer message,
+#every speed 0x01-0x0f; steering is the tracking hot path
+steer_messages = {(p, t, pd, td) : encoders["steer"](p, t, pd, td)
+                  for p in range(1, 0x10) for t in range(1, 0x10) for pd in (1, 2, 3) for td in (1, 2, 3)}
+
+for _name, (_msg, _fields) in inquiries.items():
+    fixed[_name] = _msg
+    decoders[_name] = _compileDecoder(_fields)
+
+def message(name, *args):
+    """Message bytes of command or inquiry name"""
+    if(name in fixed):
+        return fixed[name]
+    return encoders[name](*args)
+
+def decode(name, resp):
+    """Reply fields of inquiry name as a tuple, None if the reply is too short"""
+    return decoders[name](resp)
+
+# Typed inquiry results
+# Pan : -90 to +90 deg : 0-816 values   # value = deg*4.533 + 408
+# Tilt : -25 to +15 deg : 7-212 values  # value = deg*5.125 + 135.125
+PAN_PER_DEG     = 4.533
+PAN_CENTER      = 408
+TILT_PER_DEG    = 5.125
+TILT_CENTER     = 135.125
+
+PanTilt  = namedtuple("PanTilt", "pan tilt panDeg tiltDeg")
+BestView = namedtuple("BestView", "duration elapsed")
+
+def panTilt(pan, tilt):
+    """PanTilt from raw counts"""
+    return PanTilt(pan, tilt, (pan - PAN_CENTER)/PAN_PER_DEG, (tilt - TILT_CENTER)/TILT_PER_DEG)
+
+#Video format code -> name, as used by Controller.vid_format
+VIDEO_NAMES = {code : name for name, code in VIDEO_FORMATS.items()}
+
+#DIP switch bit pattern -> video mode
+DIP_MODES = {0 : "auto", 9 : "SW"}
+DIP_MODES.update({code + 1 : name for code, name in VIDEO_NAMES.items()})
+
+#On/off and auto/manual modes are True when on/auto
+_on_off     = {2 : True, 3 : False}
+_led        = {2 : 'on', 3 : 'off', 4 : 'blink'}
+
+_typed = {
+    "q_camid"       : lambda v : v[0],
+    "q_zoompos"     : lambda v : v[0],
+    "q_fPos"        : lambda v : v[0],
+    "q_fMode"       : lambda v : _on_off.get(v[0]),
+    "q_pt"          : lambda v : panTilt(*v),
+    "q_pwr"         : lambda v : _on_off.get(v[0]),
+    "q_wbMode"      : lambda v : {0 : True, 6 : False}.get(v[0]),
+    "q_wbTable"     : lambda v : v[0],
+    "q_aeMode"      : lambda v : {0 : True, 3 : False}.get(v[0]),
+    "q_blacklight"  : lambda v : _on_off.get(v[0]),
+    "q_mirror"      : lambda v : _on_off.get(v[0]),
+    "q_flip"        : lambda v : _on_off.get(v[0]),
+    "q_gMode"       : lambda v : _on_off.get(v[0]),
+    "q_gTable"      : lambda v : v[0],
+    "q_callLed"     : lambda v : _led.get(v[0]),
+    "q_pwrLed"      : lambda v : _led.get(v[0]),
+    "q_vidSys"      : lambda v : VIDEO_NAMES.get(v[0]),
+    "q_vidSW"       : lambda v : DIP_MODES.get(v[0]),
+    "q_alsRGain"    : lambda v : v[0],
+    "q_alsBGain"    : lambda v : v[0],
+    "q_alsGGain"    : lambda v : v[0],
+    "q_alsWGain"    : lambda v : v[0],
+    "q_bestView"    : lambda v : BestView(*v),
+    "q_invert"      : lambda v : bool(v[0]),
+}
+
+def parse(name, resp):
+    """Typed result of inquiry name: int position/table, bool mode, PanTilt,
+    LED or video mode name. None if the reply is missing or malformed"""
+    if(not resp or resp[0] != 0x50):
+        return None
+    fields = decoders[name](resp)
+    if(fields is None):
+        return None
+    return _typed[name](fields)
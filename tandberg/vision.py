@@ -0,0 +1,281 @@
+import heapq
+import multiprocessing
+import queue
+import threading
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from .tracking import Latest
+
+# Detection spread over processes, frames passed through shared memory:
+#
+#   pool = VisionPool(functools.partial(openCapture, 0), BallDetector, workers=3)
+#   with pool:
+#       tracker = Tracker(cam, pool, None)      # or pool.get() directly
+#
+# The capture process reads every frame straight into a slot of a ring in
+# shared memory and hands the slot number to an idle worker; frames that
+# find no idle worker are dropped. Workers look at the slot in place, so a
+# frame is never pickled or copied after capture. Only the small results go
+# back through a queue, where a thread of this process puts them in frame
+# order again and keeps the newest for get().
+#
+# A slot is reused slots frames later. A worker that is still busy with it
+# by then throws its result away (counted as torn).
+#
+# Processes are spawned, so source and detector must be picklable
+# factories (classes, functools.partial), and scripts need the usual
+# if __name__ == "__main__" guard.
+
+def openCapture(index=0, width=1920, height=1080):
+    """cv2.VideoCapture at a set resolution, as source: partial(openCapture, 0)"""
+    #Imported here so only the capture process needs OpenCV
+    import cv2
+    capture = cv2.VideoCapture(index)
+    capture.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+    capture.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+    return capture
+
+class FrameRing(object):
+    """Frames plus their bookkeeping in one shared memory block"""
+    def __init__(self, shape, slots, workers, name=None):
+        self.shape      = tuple(shape)
+        self.slots      = slots
+        self.workers    = workers
+        frame = int(np.prod(self.shape))
+        #int64 seq per slot, float64 capture time per slot, int64 current frame
+        #per worker (-1 idle), float64 busy seconds, frames and torn per worker
+        header = 8*(2*slots + 4*workers)
+        size = header + slots*frame
+        if(name is None):
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+            self.owner = True
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            self.owner = False
+
+        buf = self.shm.buf
+        offset = 0
+        def view(dtype, count):
+            nonlocal offset
+            arr = np.ndarray((count,), dtype=dtype, buffer=buf, offset=offset)
+            offset += 8*count
+            return arr
+        self.seq        = view(np.int64, slots)
+        self.stamp      = view(np.float64, slots)
+        self.current    = view(np.int64, workers)
+        self.busy       = view(np.float64, workers)
+        self.done       = view(np.float64, workers)
+        self.torn       = view(np.float64, workers)
+        self.frames     = np.ndarray((slots,) + self.shape, dtype=np.uint8, buffer=buf, offset=offset)
+        if(self.owner):
+            self.seq[:] = -1
+            self.current[:] = -1
+            self.busy[:] = self.done[:] = self.torn[:] = 0
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def close(self):
+        self.seq = self.stamp = self.current = self.busy = self.done = self.torn = self.frames = None
+        self.shm.close()
+        if(self.owner):
+            self.shm.unlink()
+
+def _captureMain(name, shape, slots, workers, source, inboxes, stop, counts):
+    ring = FrameRing(shape, slots, workers, name)
+    capture = source()
+    current = ring.current
+    view = frame = None
+    seq = 0
+    inplace = True
+    try:
+        while not stop.is_set():
+            slot = seq % slots
+            view = ring.frames[slot]
+            #Invalidate the slot first, a worker still on it sees the change
+            ring.seq[slot] = -1
+            if(inplace):
+                try:
+                    ok, frame = capture.read(view)
+                except TypeError:
+                    inplace = False
+                    continue
+            else:
+                ok, frame = capture.read()
+            if(not ok or frame is None):
+                time.sleep(0.01)
+                continue
+            if(not np.shares_memory(frame, view)):
+                if(frame.shape != ring.shape):
+                    counts[1] += 1
+                    continue
+                np.copyto(view, frame)
+            ring.stamp[slot] = time.monotonic()
+            ring.seq[slot] = seq
+            counts[0] += 1
+
+            idle = np.flatnonzero(current < 0)
+            if(len(idle)):
+                #Lowest numbered idle worker, so spare workers stay cold
+                worker = int(idle[0])
+                current[worker] = seq
+                inboxes[worker].put((seq, slot))
+            else:
+                counts[2] += 1
+            seq += 1
+    finally:
+        if(hasattr(capture, "release")):
+            capture.release()
+        #Our views must go before the block can be closed
+        view = frame = current = None
+        ring.close()
+
+def _workerMain(index, name, shape, slots, workers, detector, inbox, results, stop):
+    ring = FrameRing(shape, slots, workers, name)
+    detect = detector()
+    try:
+        while not stop.is_set():
+            try:
+                seq, slot = inbox.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            start = time.monotonic()
+            captured = float(ring.stamp[slot])
+            found = None
+            if(ring.seq[slot] == seq):
+                found = detect(ring.frames[slot])
+            ring.busy[index] += time.monotonic() - start
+            ring.done[index] += 1
+            if(ring.seq[slot] != seq):
+                #Overwritten while we looked at it
+                ring.torn[index] += 1
+                found = None
+                captured = -1.0
+            results.put((seq, index, captured, found))
+    finally:
+        ring.close()
+
+class VisionPool(object):
+    def __init__(self, source, detector, workers=3, shape=(1080, 1920, 3), slots=None):
+        """source: factory of a capture with read() -> (ok, frame), read(into) if it can.
+        detector: factory of fn(frame) -> (x, y, radius) or None"""
+        self.source         = source
+        self.detector       = detector
+        self.workers        = workers
+        self.shape          = tuple(shape)
+        self.slots          = slots or 2*workers + 4
+        #Results out of order that arrived after a newer one was released
+        self.late           = 0
+        self.released       = 0
+
+        self.ring           = None
+        self._ctx           = multiprocessing.get_context("spawn")
+        self._processes     = []
+        self._inboxes       = []
+        self._latest        = Latest()
+        self._reorder       = []
+        self._collector     = None
+        self._running       = False
+        self._started       = None
+
+    def start(self):
+        if(self.ring is not None):
+            return self
+        ctx = self._ctx
+        self.ring = FrameRing(self.shape, self.slots, self.workers)
+        self._stop = ctx.Event()
+        #captured, wrong shape, dropped for lack of an idle worker
+        self._counts = ctx.Array('q', 3, lock=False)
+        self._results = ctx.Queue()
+        #Kept here, the queues' semaphores go away with the last reference
+        self._inboxes = inboxes = [ctx.Queue() for k in range(self.workers)]
+        args = (self.ring.name, self.shape, self.slots, self.workers)
+        for k in range(self.workers):
+            self._processes.append(ctx.Process(target=_workerMain, daemon=True,
+                args=(k,) + args + (self.detector, inboxes[k], self._results, self._stop)))
+        self._processes.append(ctx.Process(target=_captureMain, daemon=True,
+            args=args + (self.source, inboxes, self._stop, self._counts)))
+        for process in self._processes:
+            process.start()
+
+        self._started = time.monotonic()
+        self._running = True
+        self._collector = threading.Thread(target=self._collect, daemon=True)
+        self._collector.start()
+        return self
+
+    def stop(self):
+        if(self.ring is None):
+            return
+        self._stop.set()
+        for process in self._processes:
+            process.join(5)
+            if(process.is_alive()):
+                process.terminate()
+        self._processes = []
+        self._inboxes = []
+        self._running = False
+        self._collector.join()
+        self.ring.close()
+        self.ring = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _collect(self):
+        current = self.ring.current
+        height, width = self.shape[:2]
+        last = -1
+        while self._running:
+            try:
+                seq, worker, captured, found = self._results.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            current[worker] = -1
+            if(seq <= last):
+                self.late += 1
+                continue
+            heapq.heappush(self._reorder, (seq, captured, found))
+
+            #Everything ahead of the oldest frame still being worked on is final
+            busy = current[current >= 0]
+            floor = busy.min() if len(busy) else float("inf")
+            while self._reorder and self._reorder[0][0] < floor:
+                seq, captured, found = heapq.heappop(self._reorder)
+                last = seq
+                if(captured < 0):
+                    continue
+                self.released += 1
+                self._latest.put((captured, found, width, height))
+
+    def get(self, timeout=None):
+        """Newest (captured, (x, y, radius) or None, width, height), None if nothing new"""
+        return self._latest.get(timeout)
+
+    def stats(self):
+        """Frame counts, queue depth and utilisation (busy fraction) of every worker"""
+        ring = self.ring
+        if(ring is None):
+            return {}
+        elapsed = max(time.monotonic() - self._started, 1e-9)
+        return {
+            "captured"      : self._counts[0],
+            "bad_shape"     : self._counts[1],
+            "dropped"       : self._counts[2],
+            "released"      : self.released,
+            "late"          : self.late,
+            "in_workers"    : int((ring.current >= 0).sum()),
+            "reorder_depth" : len(self._reorder),
+            "workers"       : [{
+                "frames"        : int(ring.done[k]),
+                "torn"          : int(ring.torn[k]),
+                "utilisation"   : float(ring.busy[k])/elapsed,
+            } for k in range(self.workers)],
+        }
@@ -0,0 +1,304 @@
+import os
+import struct
+import threading
+import time
+
+import numpy as np
+import serial
+
+# Wire traffic recording and replay.
+#
+#   cam.recorder = Recorder("camera1.wire")    # before connect, or Recorder.attach(cam)
+#   ...
+#   records = load("camera1.wire")              # numpy memmap, nothing is read up front
+#   exchanges(records)                          # per command: time, message, latency
+#
+#   replay(records, emu.port, speed=10)         # resend the commands to another camera
+#   cam.ser = ReplayPort(records)               # or let a Controller talk to the recording
+#
+# The file is append-only: a 16 byte header, then fixed 32 byte records
+#   t       int64   time.monotonic_ns()
+#   dir     uint8   OUT host -> camera, IN camera -> host, MARK session start
+#   len     uint8   bytes used in data
+#   data    22 bytes
+# Writes and reads are recorded as the serial port saw them; longer chunks
+# take several records with the same time. A MARK's data is time.time_ns()
+# at the start of the session, to place its monotonic times in wall time.
+
+MAGIC       = b'TBWIRE01'
+HEADER_SIZE = 16
+DATA_SIZE   = 22
+RECORD      = struct.Struct("<qBB%ds" % DATA_SIZE)
+DTYPE       = np.dtype([("t", "<i8"), ("dir", "u1"), ("len", "u1"), ("data", "S%d" % DATA_SIZE)])
+
+OUT         = 0
+IN          = 1
+MARK        = 2
+
+class Recorder(object):
+    def __init__(self, path, flush_every=64):
+        self.path           = path
+        #Records buffered at most before they go to the file; a reply frame
+        #coming in flushes at once, so a crash loses no finished exchange
+        self.flush_every    = flush_every
+        self.count          = 0
+        self._buffer        = []
+        self._lock          = threading.Lock()
+        new = not os.path.exists(path) or os.path.getsize(path) == 0
+        #Unbuffered, what _flush writes is in the file
+        self._file          = open(path, "ab", buffering=0)
+        if(new):
+            self._file.write(MAGIC.ljust(HEADER_SIZE, b'\x00'))
+        self.record(MARK, struct.pack("<q", time.time_ns()))
+        self.flush()
+
+    @classmethod
+    def attach(cls, camera, path):
+        """Starts recording a camera, connected or not"""
+        recorder = cls(path)
+        camera.recorder = recorder
+        if(camera.ser is not None):
+            camera.ser = recorder.wrap(camera.ser)
+        return recorder
+
+    def wrap(self, port):
+        """The serial port with every write and read recorded"""
+        if(isinstance(port, _RecordingPort)):
+            port = port.port
+        return _RecordingPort(port, self)
+
+    def record(self, direction, data):
+        t = time.monotonic_ns()
+        with self._lock:
+            for k in range(0, max(len(data), 1), DATA_SIZE):
+                chunk = data[k:k + DATA_SIZE]
+                self._buffer.append(RECORD.pack(t, direction, len(chunk), chunk))
+            self.count += 1
+            if(len(self._buffer) >= self.flush_every or direction == IN and b'\xff' in data):
+                self._flush()
+
+    def _flush(self):
+        if(self._buffer and not self._file.closed):
+            self._file.write(b"".join(self._buffer))
+            self._buffer = []
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def close(self):
+        with self._lock:
+            if(not self._file.closed):
+                self._flush()
+                self._file.close()
+
+class _RecordingPort(object):
+    """serial.Serial stand-in that records what goes through the real one"""
+    def __init__(self, port, recorder):
+        self.port       = port
+        self.recorder   = recorder
+
+    def write(self, data):
+        self.recorder.record(OUT, data)
+        return self.port.write(data)
+
+    def read(self, size=1):
+        data = self.port.read(size)
+        if(data):
+            self.recorder.record(IN, data)
+        return data
+
+    def close(self):
+        self.recorder.flush()
+        return self.port.close()
+
+    def __getattr__(self, name):
+        return getattr(self.port, name)
+
+    def __setattr__(self, name, value):
+        if(name in ("port", "recorder")):
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self.port, name, value)
+
+# ------------------------------------------------------------------ analysis
+def load(path):
+    """Records of a recording as a read-only numpy memmap of DTYPE"""
+    with open(path, "rb") as f:
+        if(f.read(len(MAGIC)) != MAGIC):
+            raise ValueError(path + " is not a wire recording")
+    count = (os.path.getsize(path) - HEADER_SIZE)//DTYPE.itemsize
+    return np.memmap(path, dtype=DTYPE, mode="r", offset=HEADER_SIZE, shape=(count,))
+
+def _chunks(records):
+    """(t, dir, bytes) per write/read, records of one chunk joined again"""
+    out = []
+    for t, direction, size, data in zip(records["t"].tolist(), records["dir"].tolist(),
+                                        records["len"].tolist(), records["data"].tolist()):
+        data = data.ljust(size, b'\x00')[:size]
+        if(out and out[-1][0] == t and out[-1][1] == direction and direction != MARK):
+            out[-1][2] += data
+        else:
+            out.append([t, direction, data])
+    return out
+
+def _final(frame):
+    """True for a reply that ends an exchange, anything but an ACK (4y)"""
+    return len(frame) >= 3 and frame[1] & 0xf0 != 0x40
+
+def exchanges(records):
+    """(t, message, latency) per command in the order written: message without
+    address and terminator, latency (seconds) until the first completion,
+    error or inquiry reply after it, None if none came. Assumes one command
+    on the link at a time, like Controller"""
+    out = []
+    pending = None
+    rx = bytearray()
+    for t, direction, data in _chunks(records):
+        if(direction == OUT):
+            if(pending is not None):
+                out.append((pending[0]/1e9, pending[1], None))
+            pending = (t, bytes(data[1:-1]))
+            rx.clear()
+        elif(direction == IN and pending is not None):
+            rx += data
+            while b'\xff' in rx:
+                end = rx.index(b'\xff')
+                frame, rx[:] = bytes(rx[:end + 1]), rx[end + 1:]
+                if(_final(frame)):
+                    out.append((pending[0]/1e9, pending[1], (t - pending[0])/1e9))
+                    pending = None
+                    break
+    if(pending is not None):
+        out.append((pending[0]/1e9, pending[1], None))
+    return out
+
+# -------------------------------------------------------------------- replay
+class ReplayPort(object):
+    """Stands in for the serial port of a Controller and answers with a recording.
+
+    Every write is matched to the next recorded write; the reads recorded
+    after it are delivered with their recorded delays divided by speed.
+    Writes that differ from the recording are counted in mismatches (strict
+    raises ValueError instead) and answered all the same."""
+    def __init__(self, records, speed=1.0, strict=False, timeout=0.1):
+        self.timeout        = timeout
+        self.baudrate       = 9600
+        self.is_open        = True
+        self.speed          = speed
+        self.strict         = strict
+        self.mismatches     = 0
+        #Recorded writes, each with the reads that followed it: (data, [(delay ns, data), ..])
+        self.script         = []
+        for t, direction, data in _chunks(records):
+            if(direction == OUT):
+                self.script.append((bytes(data), t, []))
+            elif(direction == IN and self.script):
+                self.script[-1][2].append((t - self.script[-1][1], bytes(data)))
+        self.position       = 0
+        self._rx            = []    #(due, data), in order
+        self._cond          = threading.Condition()
+
+    @property
+    def done(self):
+        return self.position >= len(self.script)
+
+    def write(self, data):
+        if(self.done):
+            return len(data)
+        expected, t, replies = self.script[self.position]
+        self.position += 1
+        if(bytes(data) != expected):
+            if(self.strict):
+                raise ValueError("Write %s, recording has %s" % (bytes(data).hex(), expected.hex()))
+            self.mismatches += 1
+        now = time.monotonic()
+        with self._cond:
+            for delay, reply in replies:
+                self._rx.append((now + delay/1e9/self.speed, reply))
+            self._cond.notify_all()
+        return len(data)
+
+    def _due(self):
+        now = time.monotonic()
+        n = 0
+        while n < len(self._rx) and self._rx[n][0] <= now:
+            n += 1
+        return n
+
+    @property
+    def in_waiting(self):
+        with self._cond:
+            return sum(len(data) for due, data in self._rx[:self._due()])
+
+    def read(self, size=1):
+        deadline = time.monotonic() + (self.timeout or 0)
+        with self._cond:
+            while not self._due():
+                now = time.monotonic()
+                if(now >= deadline):
+                    break
+                wait = deadline - now
+                if(self._rx):
+                    wait = min(wait, self._rx[0][0] - now)
+                self._cond.wait(max(wait, 0))
+            out = bytearray()
+            while self._rx and self._rx[0][0] <= time.monotonic() and len(out) < size:
+                due, data = self._rx.pop(0)
+                take = size - len(out)
+                out += data[:take]
+                if(len(data) > take):
+                    self._rx.insert(0, (due, data[take:]))
+            return bytes(out)
+
+    def reset_input_buffer(self):
+        with self._cond:
+            self._rx = [(due, data) for due, data in self._rx if due > time.monotonic()]
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.is_open = False
+
+def replay(records, port, speed=1.0, baudrate=9600, timeout=1.0, recorder=None):
+    """Sends the recorded commands to the camera on port, one at a time like
+    Controller: each waits for the final reply to the one before, then for
+    the recorded pause between that reply and the next write, divided by
+    speed. Returns (recorded, replayed) in the form of exchanges(); recorder,
+    if given, records the new traffic"""
+    #(data, pause ns before it)
+    writes = []
+    last = None
+    for t, direction, data in _chunks(records):
+        if(direction == OUT):
+            writes.append((bytes(data), 0 if last is None else t - last))
+            last = t
+        elif(direction == IN and last is not None and b'\xff' in data):
+            last = t
+    link = serial.Serial(port, baudrate=baudrate, timeout=0.01)
+    if(recorder is not None):
+        link = recorder.wrap(link)
+
+    result = []
+    rx = bytearray()
+    try:
+        for data, pause in writes:
+            if(pause > 0):
+                time.sleep(pause/1e9/speed)
+            sent = time.monotonic_ns()
+            link.write(data)
+            deadline = sent + timeout*1e9
+            latency = None
+            while latency is None and time.monotonic_ns() < deadline:
+                rx += link.read(link.in_waiting or 1)
+                while latency is None and b'\xff' in rx:
+                    end = rx.index(b'\xff')
+                    frame = bytes(rx[:end + 1])
+                    del rx[:end + 1]
+                    if(_final(frame)):
+                        latency = (time.monotonic_ns() - sent)/1e9
+            result.append((sent/1e9, data[1:-1], latency))
+    finally:
+        link.close()
+    return exchanges(records), result
@@ -0,0 +1,75 @@
+import argparse
+import functools
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from tandberg import tandberg as td
+from tandberg.coords import Calibration
+from tandberg.detector import BallDetector
+from tandberg.tracking import PredictiveTracker, Tracker
+from tandberg.vision import VisionPool, openCapture
+
+# Follows the yellow ball with the camera and prints fps and latency of
+# every stage once a second. Ctrl-C stops.
+# Usage: python ball_tracker.py /dev/ttyUSB0 [--video 0] [--mode steer|direct] [--kp 1.0] [--scale 0.5] [--workers 0] [--predict]
+
+parser = argparse.ArgumentParser()
+parser.add_argument("port")
+parser.add_argument("--video", type=int, default=0, help="capture device index")
+parser.add_argument("--mode", default="steer", choices=("steer", "direct"))
+parser.add_argument("--calibration", help="Calibration.save() file, nominal values without")
+parser.add_argument("--kp", type=float, default=1.0)
+parser.add_argument("--ki", type=float, default=0.0)
+parser.add_argument("--kd", type=float, default=0.05)
+parser.add_argument("--deadband", type=float, default=0.05)
+parser.add_argument("--predict", action="store_true", help="aim ahead of the ball (steer mode)")
+parser.add_argument("--workers", type=int, default=0, help="detection processes, 0 detects in a thread")
+parser.add_argument("--scale", type=float, default=0.5, help="detector processing resolution")
+
+def main():
+    args = parser.parse_args()
+
+    cam = td.Controller()
+    if(cam.connect(args.port) != td.stat_OK):
+        sys.exit(1)
+    cal = Calibration.load(args.calibration) if args.calibration else None
+
+    pool = None
+    if(args.workers):
+        #Capture and detection in their own processes
+        pool = VisionPool(functools.partial(openCapture, args.video),
+                          functools.partial(BallDetector, scale=args.scale), workers=args.workers)
+        source, detector = pool.start(), None
+    else:
+        source = openCapture(args.video)
+        detector = BallDetector(scale=args.scale)
+
+    kind = PredictiveTracker if args.predict else Tracker
+    tracker = kind(cam, source, detector, mode=args.mode, calibration=cal,
+                   kp=args.kp, ki=args.ki, kd=args.kd, deadband=args.deadband)
+    try:
+        with tracker:
+            while(True):
+                time.sleep(1)
+                stats = tracker.stats()
+                print("  ".join("%s %5.1f fps %6.1f ms" % (name, stats[name]["fps"], stats[name]["mean_ms"])
+                                for name in ("capture", "detect", "control")),
+                      " dropped %d" % stats["dropped_frames"])
+                if(pool is not None):
+                    print("    workers " + "  ".join("%3.0f%%" % (100*w["utilisation"])
+                                                    for w in pool.stats()["workers"]),
+                          " in workers %d" % pool.stats()["in_workers"])
+    except KeyboardInterrupt:
+        pass
+
+    if(pool is not None):
+        pool.stop()
+    else:
+        source.release()
+    cam.disconnect()
+
+#Worker processes import this file again
+if __name__ == "__main__":
+    main()
@@ -3,8 +3,8 @@ import sys
 
 sys.path.append("../tandberg/")
 from tandberg import tandberg as td
+from tandberg.console import KeyConsole
 import keyboard
-from time import sleep
 
 class clear(object):
     def __repr__(self):
@@ -60,7 +60,7 @@ imap = {
     "pt"            : lambda x : cam.pt_direct(x),
     "ptzf"          : lambda x : cam.ptzf(x),
     #Queries
-    "query"         : lambda x : cam.qCmd(x),
+    "query"         : lambda x : print(cam.qCmd(x)),
 }
 
 port = input("Enter port to connect:")
@@ -68,42 +68,54 @@ if(cam.connect(port)):
     run = False #Exit since connect failed
     print("Connection to port: FAILED")
 
+switchMode = False #Typed '+' goes straight to game mode
+
 while run:
     print(clear)
     print("Enter mode: Game(+) / Type(-)\nPress 0 to Quit")
 
-    while True:
-        if(keyboard.is_pressed("+")):
+    #Blocks until a key goes down, no polling
+    while not switchMode:
+        key = keyboard.read_event(suppress=False)
+        if(key.event_type != keyboard.KEY_DOWN):
+            continue
+        if(key.name == "+"):
             gameMode = True
             break
-        elif(keyboard.is_pressed("-")):
+        elif(key.name == "-"):
             gameMode = False
             break
-        elif(keyboard.is_pressed("0")):
+        elif(key.name == "0"):
             cam.disconnect()
             exit()
 
+    switchMode = False
+
+    if(gameMode):
+        #Hold a key to move, release it to stop. Esc goes back to the mode choice
+        print("WASD steer, Q/E zoom, Z/X focus, C/R/F/M/B clear/reset/flip/mirror/backlight, Esc back")
+        console = KeyConsole(cam).start()
+        hook = keyboard.hook(lambda e : console.key(e.name, e.event_type == keyboard.KEY_DOWN))
+        keyboard.wait("esc")
+        keyboard.unhook(hook)
+        console.stop()
+        continue
+
     while True:
-        if(gameMode):
-            inp = [0,0]
-            cmd = keyboard.read_key()
-        else:
-            inp = input(">>").split(' ')
-            cmd = inp[0]
+        inp = input(">>").split(' ')
+        cmd = inp[0]
 
         #Process input
         if cmd in imap:
             imap[cmd](inp[1:])
         elif cmd == '+':
             gameMode = True
-        elif cmd == '-':
-            gameMode = False
+            switchMode = True
+            break
         #Escape to mode choice / quit
         if(cmd == "Esc" or cmd == 'esc'):
             break
         elif cmd == "0":
             cam.disconnect()
             exit()
-        
-        sleep(0.1)  #To ensure keyboard presses are not excessive
 print("Exiting...")
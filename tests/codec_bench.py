@@ -0,0 +1,84 @@
+import os
+import sys
+import timeit
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from tandberg import visca
+
+# Encode/decode cost per message: the old per-call lookup dicts and piecewise
+# bytes concatenation versus the precompiled tables in tandberg.visca.
+# Usage: python codec_bench.py [loops]
+
+LOOPS = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+
+def legacy_toVisca2b(value):
+    b = value.to_bytes(2, 'big')
+    return bytes((b[0] >> 4, b[0] & 0x0f, b[1] >> 4, b[1] & 0x0f))
+
+def legacy_ptzf(pan, tilt, zoom, focus):
+    msg = b'\x01\x06\x20'
+    msg += legacy_toVisca2b(pan)
+    msg += legacy_toVisca2b(tilt)
+    msg += legacy_toVisca2b(zoom)
+    msg += legacy_toVisca2b(focus)
+    return msg
+
+def legacy_steer(cmd, panSpeed=b'\x0f', tiltSpeed=b'\x0f'):
+    lookup = {
+        'up'        : b'\x03\x01',
+        'down'      : b'\x03\x02',
+        'left'      : b'\x01\x03',
+        'right'     : b'\x02\x03',
+        'upleft'    : b'\x01\x01',
+        'upright'   : b'\x02\x01',
+        'downleft'  : b'\x01\x02',
+        'downright' : b'\x02\x02',
+        'stop'      : b'\x03\x03',
+    }
+    msg = b'\x01\x06\x01'
+    msg += panSpeed
+    msg += tiltSpeed
+    msg += lookup[cmd]
+    return msg
+
+def legacy_flip(cmd):
+    lookup = {
+        'on' : b'\x01\x04\x66\x02',
+        'off': b'\x01\x04\x66\x03',
+    }
+    return lookup[cmd]
+
+def legacy_decode_pt(frame):
+    hex_str = [frame[i:i + 1].hex() for i in range(len(frame))]
+    resp = frame[1:-1]
+    pan = int("".join(h[1] for h in hex_str[2:6]), 16)
+    tilt = int("".join(h[1] for h in hex_str[6:10]), 16)
+    return pan, tilt
+
+encode_ptzf = visca.encoders["ptzf"]
+encode_steer = visca.encoders["steer"]
+steer_messages = visca.steer_messages
+decode_pt = visca.decoders["q_pt"]
+pt_frame = b'\x90\x50' + visca.toNibbles(600) + visca.toNibbles(150) + b'\xff'
+assert legacy_ptzf(600, 150, 1200, 300) == encode_ptzf(600, 150, 1200, 300)
+assert legacy_steer('upleft') == steer_messages[(15, 15) + visca.STEER_DIRECTIONS['upleft']]
+assert legacy_decode_pt(pt_frame) == decode_pt(pt_frame[1:-1])
+
+cases = [
+    ("ptzf encode",     lambda : legacy_ptzf(600, 150, 1200, 300),
+                        lambda : encode_ptzf(600, 150, 1200, 300)),
+    ("steer encode",    lambda : legacy_steer('upleft'),
+                        lambda : encode_steer(15, 15, *visca.STEER_DIRECTIONS['upleft'])),
+    ("steer lookup",    lambda : legacy_steer('upleft'),
+                        lambda : steer_messages[(15, 15) + visca.STEER_DIRECTIONS['upleft']]),
+    ("flip lookup",     lambda : legacy_flip('on'),
+                        lambda : visca.fixed["flip_on"]),
+    ("q_pt decode",     lambda : legacy_decode_pt(pt_frame),
+                        lambda : decode_pt(pt_frame[1:-1])),
+]
+
+print("%-14s %12s %12s %8s" % ("", "legacy ns", "codec ns", "speedup"))
+for name, old, new in cases:
+    t_old = min(timeit.repeat(old, number=LOOPS, repeat=3))/LOOPS
+    t_new = min(timeit.repeat(new, number=LOOPS, repeat=3))/LOOPS
+    print("%-14s %12.0f %12.0f %7.1fx" % (name, t_old*1e9, t_new*1e9, t_old/t_new))
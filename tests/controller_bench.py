@@ -0,0 +1,117 @@
+import argparse
+import contextlib
+import io
+import os
+import sys
+import time
+import timeit
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from tandberg import tandberg as td
+from tandberg.emulator import Emulator
+from tandberg.metrics import Metrics
+
+# Throughput / latency / bytes-on-the-wire for every Controller method,
+# measured against the emulated camera.
+# Usage: python controller_bench.py [--rounds N] [--baud 9600|115200|0] [--shadow] [--metrics FILE] [--overhead]
+#   --overhead  times every call with metrics disabled (None) and enabled,
+#               alternating, and prints what recording costs; best with --baud 0
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--rounds", type=int, default=50)
+parser.add_argument("--baud", type=int, default=9600, help="0 disables serial timing")
+parser.add_argument("--shadow", action="store_true", help="skip setters the camera is already in")
+parser.add_argument("--metrics", help="record link metrics and write them here (.json or Prometheus text)")
+parser.add_argument("--overhead", action="store_true", help="compare metrics disabled and enabled")
+args = parser.parse_args()
+
+cases = [
+    ("clear"            , lambda c : c.clear()),
+    ("power"            , lambda c : c.power(["on"])),
+    ("vid_format"       , lambda c : c.vid_format(["1080p30"])),
+    ("wb_auto on"       , lambda c : c.wb_auto(["on"])),
+    ("wb_auto off"      , lambda c : c.wb_auto(["off", 3])),
+    ("ae_auto off"      , lambda c : c.ae_auto(["off", 20, 15])),
+    ("backlight"        , lambda c : c.backlight(["toggle"])),
+    ("mirror"           , lambda c : c.mirror(["toggle"])),
+    ("flip"             , lambda c : c.flip(["toggle"])),
+    ("gamma_auto off"   , lambda c : c.gamma_auto(["off", 4])),
+    ("mm_detect"        , lambda c : c.mm_detect(["on"])),
+    ("call_led"         , lambda c : c.call_led(["blink"])),
+    ("pwr_led"          , lambda c : c.pwr_led(["on"])),
+    ("bestView"         , lambda c : c.bestView(["on", 0])),
+    ("zoomFocus"        , lambda c : c.zoomFocus(["zoom", "stop"])),
+    ("zoomFocus_direct" , lambda c : c.zoomFocus_direct([0, -1])),
+    ("focus_auto"       , lambda c : c.focus_auto(["on"])),
+    ("steer"            , lambda c : c.steer(["stop"])),
+    ("pt_direct"        , lambda c : c.pt_direct([408, 135])),
+    ("ptzf"             , lambda c : c.ptzf([408, 135, 0, 0])),
+    ("qCmd q_pt"        , lambda c : c.qCmd(["q_pt"])),
+    ("qCmd q_zoompos"   , lambda c : c.qCmd(["q_zoompos"])),
+    ("qCmd q_camid"     , lambda c : c.qCmd(["q_camid"])),
+]
+
+emu = Emulator(baudrate=args.baud or None)
+cam = td.Controller()
+cam.shadow = args.shadow
+metrics = Metrics({"port" : "emulator"}) if args.metrics or args.overhead else None
+cam.metrics = metrics
+cam.connect(emu.start())
+
+def percentile(samples, q):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples)*q))]
+
+if(args.overhead):
+    print("%-18s %12s %12s %12s %12s" % ("method", "off p50 us", "on p50 us", "diff us", "off min us"))
+    for name, fn in cases:
+        with contextlib.redirect_stdout(io.StringIO()):
+            fn(cam)
+        time.sleep(0.5)
+        off, on = [], []
+        with contextlib.redirect_stdout(io.StringIO()):
+            for _ in range(args.rounds):
+                #Alternating, so drift in the emulator hits both the same
+                for enabled, samples in ((None, off), (metrics, on)):
+                    cam.metrics = enabled
+                    t0 = time.perf_counter()
+                    fn(cam)
+                    samples.append(time.perf_counter() - t0)
+        print("%-18s %12.1f %12.1f %12.1f %12.1f" % (name, percentile(off, 0.5)*1e6, percentile(on, 0.5)*1e6,
+              (percentile(on, 0.5) - percentile(off, 0.5))*1e6, min(off)*1e6))
+    #Disabled, send() and readFrame() each only test cam.metrics against None
+    cam.metrics = None
+    n = 1000000
+    guard = timeit.timeit("metrics = cam.metrics\nif(metrics is not None): pass", globals={"cam" : cam}, number=n)
+    empty = timeit.timeit("pass", number=n)
+    print("disabled: %.1f ns per check, one per exchange and one per serial read" % ((guard - empty)/n*1e9))
+    cam.disconnect()
+    emu.stop()
+    sys.exit(0)
+
+print("%-18s %10s %10s %10s %10s %10s" % ("method", "cmd/s", "p50 ms", "p99 ms", "B out", "B in"))
+for name, fn in cases:
+    #Warm up, and put the motors where the direct moves send them
+    with contextlib.redirect_stdout(io.StringIO()):
+        fn(cam)
+    time.sleep(0.5)
+    emu.resetStats()
+
+    samples = []
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(args.rounds):
+            t0 = time.perf_counter()
+            fn(cam)
+            samples.append(time.perf_counter() - t0)
+    total = time.perf_counter() - start
+
+    p50 = percentile(samples, 0.5)
+    p99 = percentile(samples, 0.99)
+    print("%-18s %10.1f %10.2f %10.2f %10.1f %10.1f" % (name, args.rounds/total, p50*1e3, p99*1e3,
+          emu.bytesIn/args.rounds, emu.bytesOut/args.rounds))
+
+if(args.metrics):
+    cam.metrics.write(args.metrics)
+cam.disconnect()
+emu.stop()
@@ -0,0 +1,71 @@
+import argparse
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from tandberg.detector import BallDetector, ylo_lower, ylo_upper
+
+# ms/frame of the ball detector on synthetic frames: a yellow ball moving
+# over a noisy background, at 720p and 1080p. "original" is the full frame
+# pipeline of ball_detector.py, allocating every step.
+# Usage: python detector_bench.py [--frames N]
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--frames", type=int, default=200)
+args = parser.parse_args()
+
+def frames(width, height, count, radius=30):
+    rng = np.random.default_rng(0)
+    background = rng.integers(0, 90, (height, width, 3), dtype=np.uint8)
+    out = []
+    for k in range(count):
+        frame = background.copy()
+        x = int(width/2 + width/3*np.sin(k/20.0))
+        y = int(height/2 + height/3*np.cos(k/31.0))
+        cv2.circle(frame, (x, y), radius, (0, 255, 255), -1)
+        out.append((frame, x, y))
+    return out
+
+def original(frame):
+    hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
+    mask = cv2.inRange(hsv, ylo_lower, ylo_upper)
+    mask = cv2.erode(mask, None, iterations=2)
+    mask = cv2.dilate(mask, None, iterations=2)
+    cnts = cv2.findContours(mask.copy(), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    cnts = cnts[0] if len(cnts) == 2 else cnts[1]
+    if(len(cnts) == 0):
+        return None
+    c = max(cnts, key=cv2.contourArea)
+    ((x, y), radius) = cv2.minEnclosingCircle(c)
+    M = cv2.moments(c)
+    return (M["m10"]/M["m00"], M["m01"]/M["m00"], radius)
+
+cases = [
+    ("original"         , lambda : original),
+    ("full frame"       , lambda : BallDetector(roi=None)),
+    ("roi"              , lambda : BallDetector()),
+    ("scale 0.5"        , lambda : BallDetector(scale=0.5, roi=None)),
+    ("scale 0.5 + roi"  , lambda : BallDetector(scale=0.5)),
+]
+
+for width, height in ((1280, 720), (1920, 1080)):
+    stream = frames(width, height, args.frames)
+    print("%dx%d" % (width, height))
+    print("%-18s %10s %10s %10s" % ("detector", "ms/frame", "max ms", "error px"))
+    for name, make in cases:
+        detect = make()
+        times, errors = [], []
+        for frame, x, y in stream:
+            t0 = time.perf_counter()
+            found = detect(frame)
+            times.append(time.perf_counter() - t0)
+            if(found is not None):
+                errors.append(np.hypot(found[0] - x, found[1] - y))
+        times = np.array(times)*1000
+        error = np.mean(errors) if errors else float("nan")
+        print("%-18s %10.2f %10.2f %10.2f" % (name, times.mean(), times.max(), error))
+    print()
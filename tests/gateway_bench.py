@@ -0,0 +1,111 @@
+import argparse
+import json
+import os
+import random
+import socket
+import statistics
+import sys
+import threading
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from tandberg import tandberg as td
+from tandberg.emulator import Emulator
+from tandberg.gateway import Gateway
+
+# Several TCP clients on one emulated camera through the gateway: busy
+# clients keep the link full with zoom moves, each between targets of its
+# own so that none is answered from the shadow state, while one interactive
+# client sends inquiries at random moments. Prints the interactive client's
+# latency and how many busy moves finished while it waited, once at the
+# same priority as the busy ones and once above them. Above them it should
+# only wait for the move already on the link (about 1), at the same
+# priority for one move of every busy client. Also counts its cacheable
+# inquiries that never reached the link.
+# Usage: python gateway_bench.py [--busy 4] [--seconds 3] [--baud 9600|115200|0]
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--busy", type=int, default=4, help="clients sending zoom moves")
+parser.add_argument("--seconds", type=float, default=3)
+parser.add_argument("--baud", type=int, default=9600, help="0 disables serial timing")
+args = parser.parse_args()
+
+class Client(object):
+    def __init__(self, address, priority):
+        self.sock = socket.create_connection(address)
+        self.file = self.sock.makefile("rb")
+        self.ident = 0
+        self.request({"priority" : priority})
+
+    def request(self, obj):
+        self.ident += 1
+        obj["id"] = self.ident
+        self.sock.sendall(json.dumps(obj).encode("utf-8") + b'\n')
+        return json.loads(self.file.readline())
+
+    def close(self):
+        self.sock.close()
+
+def busy(address, stop, index, done):
+    client = Client(address, 0)
+    #Targets of this client only, so every move differs from the one before
+    base = 1000 + 40*index
+    k = 0
+    while not stop.is_set():
+        reply = client.request({"cmd" : "zoom_direct", "args" : [base + (k % 2)*200]})
+        #(finished, went over the link)
+        done.append((time.perf_counter(), not reply["local"]))
+        k += 1
+    client.close()
+
+def run(gateway, priority):
+    stop = threading.Event()
+    done = []
+    threads = [threading.Thread(target=busy, args=(gateway.address, stop, k, done)) for k in range(args.busy)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.2)
+
+    client = Client(gateway.address, priority)
+    rng = random.Random(priority)
+    #(sent, answered) of inquiries that went over the link
+    linked = []
+    local = 0
+    deadline = time.monotonic() + args.seconds
+    while time.monotonic() < deadline:
+        #Random moments, so the inquiries land anywhere in the busy moves
+        time.sleep(rng.uniform(0.0, 0.25))
+        for name in ("q_camid", "q_wbMode"):
+            start = time.perf_counter()
+            reply = client.request({"cmd" : name})
+            if(reply["local"]):
+                local += 1
+            else:
+                linked.append((start, time.perf_counter()))
+    client.close()
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    latency = [end - start for start, end in linked]
+    #Busy moves that finished while each inquiry waited
+    waited = [sum(1 for t, link in done if start < t <= end and link) for start, end in linked]
+    #The link is never idle, so a move takes it from the previous completion to its own
+    finished = sorted(t for t, link in done if link)
+    move = statistics.median([b - a for a, b in zip(finished, finished[1:])])
+    print("priority %2d: inquiries over the link p50 %7.1f ms  max %7.1f ms (%d), %.1f moves on the link p50" %
+          (priority, 1000*statistics.median(latency), 1000*max(latency), len(latency),
+           statistics.median(latency)/move))
+    print("             busy moves finished while waiting p50 %.0f max %d; busy moves %d over the link"
+          " (%.1f ms each), %d local; inquiries answered locally %d" %
+          (statistics.median(waited), max(waited), len(finished), 1000*move, len(done) - len(finished), local))
+
+emu = Emulator(baudrate=args.baud or None)
+cam = td.Controller()
+cam.connect(emu.start())
+with Gateway(cam, ("127.0.0.1", 0)) as gateway:
+    run(gateway, 0)
+    run(gateway, 10)
+    print(gateway.stats())
+cam.disconnect()
+emu.stop()
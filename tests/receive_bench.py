@@ -0,0 +1,55 @@
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from tandberg import tandberg as td
+from tandberg.emulator import Emulator
+
+# Round-trip latency of Controller.send/receive against the emulated camera
+# (serial timing off), comparing the old byte-at-a-time reader with the framed reader.
+# Usage: python receive_bench.py [rounds]
+
+ROUNDS = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+
+class LegacyController(td.Controller):
+    """Controller with the original byte-at-a-time receive, for comparison"""
+    def receive(self, query_stat):
+        resp        = b''
+        rcvd_byte   = None
+        hex_str     = []
+        while rcvd_byte != b'\xff':
+            rcvd_byte = self.ser.read()
+            resp += rcvd_byte
+            hex_str.append(rcvd_byte.hex())
+        resp = resp[1:-1]
+        if(resp[0] != 80):
+            return 1
+        return 0
+
+def bench(cls, port, msg):
+    cam = cls()
+    cam.connect(port)
+    for _ in range(50):
+        cam.send(msg)
+    samples = []
+    for _ in range(ROUNDS):
+        t0 = time.perf_counter()
+        cam.send(msg)
+        samples.append(time.perf_counter() - t0)
+    cam.disconnect()
+    samples.sort()
+    return samples[len(samples)//2], samples[int(len(samples)*0.99)]
+
+emu = Emulator(baudrate=None)
+port = emu.start()
+
+for name, msg in (("command", b'\x01\x06\x01\x03\x03\x03\x03'), ("inquiry", b'\x09\x06\x12')):
+    for cls in (LegacyController, td.Controller):
+        # Inquiry replies are printed by receive, keep that out of the timing
+        sys.stdout = open(os.devnull, 'w')
+        p50, p99 = bench(cls, port, msg)
+        sys.stdout = sys.__stdout__
+        print("%-8s %-16s p50 %7.1f us  p99 %7.1f us" % (name, cls.__name__, p50*1e6, p99*1e6))
+
+emu.stop()
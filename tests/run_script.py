@@ -0,0 +1,63 @@
+import argparse
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from tandberg import tandberg as td
+from tandberg.emulator import Emulator
+from tandberg.pipeline import PipelinedController
+from tandberg.script import Script
+
+# Runs a file of basic_test commands, one per line, and reports how long
+# every line took. See tandberg/script.py for the syntax.
+# Usage: python run_script.py PORT|emulator setup.txt [--dry-run] [--blocking]
+#   --dry-run   only check and encode, print the frames every line would send
+#   --blocking  wait for every command before the next (plain Controller)
+
+parser = argparse.ArgumentParser()
+parser.add_argument("port", help="serial port, or 'emulator' for the emulated camera")
+parser.add_argument("script")
+parser.add_argument("--dry-run", action="store_true")
+parser.add_argument("--blocking", action="store_true")
+args = parser.parse_args()
+
+if(args.dry_run):
+    try:
+        script = Script.load(args.script)
+    except ValueError as error:
+        print(error)
+        sys.exit(1)
+    print(script.dump())
+    sys.exit(0)
+
+emu = None
+port = args.port
+if(port == "emulator"):
+    emu = Emulator()
+    port = emu.start()
+
+cam = td.Controller() if args.blocking else PipelinedController()
+if(cam.connect(port) != td.stat_OK):
+    print("Connection to port: FAILED")
+    sys.exit(1)
+
+status = td.stat_OK
+try:
+    #Toggles resolve against what the camera reported at connect
+    script = Script.load(args.script, cam.state.values)
+except ValueError as error:
+    print(error)
+    status = td.stat_FAIL
+else:
+    results, total = script.run(cam)
+    for r in results:
+        print("%4d  %-32s %-6s %9.1f ms  %s" % (r.line.number, r.line.text, "ok" if r.ok else "FAILED",
+                                              1000*r.latency, "" if r.value is None else r.value))
+        if(not r.ok):
+            status = td.stat_FAIL
+    print("%d lines in %.3f s" % (len(results), total))
+
+cam.disconnect()
+if(emu is not None):
+    emu.stop()
+sys.exit(status)
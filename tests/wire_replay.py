@@ -0,0 +1,85 @@
+import argparse
+import contextlib
+import io
+import os
+import statistics
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from tandberg import tandberg as td
+from tandberg import wire
+from tandberg.emulator import Emulator
+from tandberg.metrics import commandName
+
+# Replays a wire recording against the emulated camera and compares the
+# per-command latencies with the recorded ones. Without a recording, one is
+# made first from a short session against the emulator.
+# Usage: python wire_replay.py [recording.wire] [--speed 1.0] [--baud 9600|115200|0] [--controller]
+#   --controller also runs the session again on a Controller answered by the recording
+
+parser = argparse.ArgumentParser()
+parser.add_argument("recording", nargs="?")
+parser.add_argument("--speed", type=float, default=1.0, help="replay this many times faster")
+parser.add_argument("--baud", type=int, default=9600, help="emulator speed, 0 disables serial timing")
+parser.add_argument("--controller", action="store_true")
+args = parser.parse_args()
+
+def session(cam):
+    cam.power(["on"])
+    cam.wb_auto(["off", 3])
+    cam.pt_direct([408, 135])
+    cam.qCmd(["q_pt"])
+    cam.zoomFocus_direct([0, -1])
+    cam.qCmd(["q_zoompos"])
+    cam.steer(["stop"])
+
+def summary(title, exchanges):
+    groups = {}
+    for t, msg, latency in exchanges:
+        groups.setdefault(commandName(msg), []).append(latency)
+    print(title)
+    for name, latencies in sorted(groups.items()):
+        done = [1000*l for l in latencies if l is not None]
+        print("  %-18s %4d  p50 %8.2f ms  max %8.2f ms  no reply %d" %
+              (name, len(latencies), statistics.median(done) if done else float("nan"),
+               max(done) if done else float("nan"), len(latencies) - len(done)))
+
+path = args.recording
+if(path is None):
+    path = "/tmp/wire_replay.wire"
+    if(os.path.exists(path)):
+        os.remove(path)
+    with Emulator(baudrate=args.baud or None) as emu:
+        cam = td.Controller()
+        cam.recorder = wire.Recorder(path)
+        with contextlib.redirect_stdout(io.StringIO()):
+            cam.connect(emu.port)
+            session(cam)
+            cam.disconnect()
+        cam.recorder.close()
+
+records = wire.load(path)
+print("%s: %d records, %d bytes out, %d bytes in" % (path, len(records),
+      int(records["len"][records["dir"] == wire.OUT].sum()), int(records["len"][records["dir"] == wire.IN].sum())))
+
+with Emulator(baudrate=args.baud or None) as emu:
+    start = time.monotonic()
+    recorded, replayed = wire.replay(records, emu.port, speed=args.speed, baudrate=args.baud or 9600)
+    elapsed = time.monotonic() - start
+summary("recorded", recorded)
+summary("replayed x%g (%.2f s)" % (args.speed, elapsed), replayed)
+
+if(args.controller):
+    #Same session, the recording plays the camera
+    port = wire.ReplayPort(records, speed=args.speed)
+    cam = td.Controller()
+    cam.ser = port
+    start = time.monotonic()
+    with contextlib.redirect_stdout(io.StringIO()):
+        #What connect() does after opening the port
+        cam._negotiate()
+        cam.sync()
+        session(cam)
+    print("controller on the recording: %.3f s, %d/%d writes matched, %d mismatches" %
+          (time.monotonic() - start, port.position - port.mismatches, len(port.script), port.mismatches))